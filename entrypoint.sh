@@ -12,20 +12,22 @@ echo "PostgreSQL is up. Running migrations..."
 python manage.py migrate
 
 
-# Ensure the cron service is running
-echo "Setting up cron job..."
-
-
-
-echo "0 * * * * cd /app && /usr/local/bin/python manage.py run_pipeline >> /var/log/pipeline.log 2>&1" | crontab -
-
-# Start the cron daemon
-echo "Starting cron..."
-crond -b -l 2
-
-# Verify cron job is installed
-echo "Current crontab:"
-crontab -l
+# One long running process runs the pipeline, hourly unless PIPELINE_SCHEDULE is set
+# (an interval like 15m, or a cron expression like "*/15 * * * *")
+PIPELINE_SCHEDULE="${PIPELINE_SCHEDULE:-1h}"
+case "$PIPELINE_SCHEDULE" in
+  *" "*) SCHEDULE_OPTION="--cron" ;;
+  *) SCHEDULE_OPTION="--every" ;;
+esac
+
+echo "Starting the pipeline daemon ($SCHEDULE_OPTION $PIPELINE_SCHEDULE)..."
+python manage.py run_pipeline --daemon "$SCHEDULE_OPTION" "$PIPELINE_SCHEDULE" >> /var/log/pipeline.log 2>&1 &
+
+# incrementally loaded tables are kept within seconds of their sources between runs, unless PIPELINE_MICRO_BATCH is off
+if [ "${PIPELINE_MICRO_BATCH:-on}" != "off" ]; then
+  echo "Starting the micro-batch loader (every ${PIPELINE_MICRO_BATCH_EVERY:-5s})..."
+  python manage.py run_pipeline --micro-batch --every "${PIPELINE_MICRO_BATCH_EVERY:-5s}" >> /var/log/micro_batch.log 2>&1 &
+fi
 
 echo "Starting Python container..."
 exec "$@"
@@ -87,6 +87,9 @@ DATABASES = {
         'PASSWORD': os.getenv("POSTGRES_PASSWORD"),
         'HOST': os.getenv("POSTGRES_HOST", "db"),
         'PORT': os.getenv("POSTGRES_PORT", 5432),
+        # the pipeline daemon keeps its connections between runs, checking they still work before each one
+        'CONN_MAX_AGE': None,
+        'CONN_HEALTH_CHECKS': True,
         "OPTIONS": {
                     "options": "-c search_path=public,analytics"
                 },
@@ -102,6 +105,8 @@ DATABASES = {
         "PASSWORD": os.getenv("POSTGRES_PASSWORD"),
         "HOST": os.getenv("POSTGRES_HOST", "db"),
         "PORT": os.getenv("POSTGRES_PORT", "5432"),
+        "CONN_MAX_AGE": None,
+        "CONN_HEALTH_CHECKS": True,
         #
         # 'TEST': {
         #     'NAME': 'test_msk_db'
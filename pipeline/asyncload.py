@@ -0,0 +1,267 @@
+# Async alternative to run_parallel for pipelines of many small tables. Set based full and incremental loads
+# (the copy and pushdown extract modes) run as coroutines on one event loop with psycopg 3's async driver,
+# sharing a pool of connections per database, so their queries and writes are all in flight at once
+# instead of each loader paying for its own connection and round trips.
+# Loaders the async backend doesn't cover (row by row, swap, partitioned, hash and change data capture loads)
+# run as usual on worker threads, scheduled on the same loop.
+# Every model is loaded from a worker thread holding its lock, like the other backends, so a micro-batch never
+# writes to a table while the async load does. Async loads go back to the event loop from there.
+# Needs psycopg 3 and its pool, "psycopg[binary,pool]" from requirements.txt (django uses psycopg 3 as well then).
+
+import asyncio
+import logging
+import tempfile
+import threading
+import time
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+
+from django.conf import settings
+from django.db import connections
+
+from pipeline.locks import model_lock
+from pipeline.models.context import LoadContext
+from pipeline.models.loaders import FullLoadManager, IncrementalLoadManager
+from pipeline.models.pgcopy import COPY_BUFFER_SIZE, COPY_SPOOL_SIZE
+from pipeline.scheduler import topological_order
+
+logger = logging.getLogger('Pipeline Runner')
+
+# connections per database shared by every async load
+POOL_SIZE = 10
+
+
+@dataclass
+class AsyncLoad:
+    """Everything an async load needs, worked out up front with the ORM on a worker thread"""
+    model: type
+    # state of the load, the log and metrics go here
+    context: LoadContext
+    source: str
+    destination: str
+    # SELECT of the source rows, parameters already inlined
+    select_sql: str
+    # clears the destination first, for full loads
+    delete_sql: str = ''
+    # copy loads
+    copy_before: list[str] = field(default_factory=list)
+    copy_sql: str = ''
+    copy_after: list[str] = field(default_factory=list)
+    # pushdown loads
+    insert_sql: str = ''
+    orphan_sql: str = ''
+    orphan_fields: list[str] = field(default_factory=list)
+    # incremental log row of incremental loads, moved on once the rows are in
+    last_loaded: object = None
+
+    @property
+    def pushdown(self) -> bool:
+        return bool(self.insert_sql)
+
+
+def async_loadable(model) -> bool:
+    manager = model.objects
+    if manager.extract_mode == 'values':
+        return False
+    if type(manager) is FullLoadManager:
+        # tables other tables reference need the ORM to delete their rows
+        return not manager.swap and not manager.merge and not model._meta.related_objects
+    return type(manager) is IncrementalLoadManager and manager.partitions == 1
+
+
+def prepare_load(model, context: LoadContext | None = None) -> AsyncLoad | None:
+    """The SQL of an async load of a model, or None if it has to be loaded the usual way"""
+    if not async_loadable(model):
+        return None
+    context = context or LoadContext()
+    manager = model.objects.in_context(context)
+    destination = connections[manager.db]
+    quote_name = destination.ops.quote_name
+
+    if isinstance(manager, IncrementalLoadManager):
+        last_loaded = manager.get_last_loaded()
+        queryset = manager.incremental_load_queryset(getattr(last_loaded, manager.table_key))
+        delete_sql = ''
+    else:
+        last_loaded = None
+        queryset = manager.full_load_queryset()
+        delete_sql = f"DELETE FROM {quote_name(model._meta.db_table)}"
+
+    if manager.extract_mode == 'pushdown' and queryset.db != manager.db:
+        # can't be pushed down, the usual load says why
+        return None
+    source = connections[queryset.db]
+    fields = manager.get_source_fields()
+    sql, params = queryset.values_list(*fields).query.sql_with_params()
+    load = AsyncLoad(model=model, context=context, source=queryset.db, destination=manager.db,
+                     select_sql=source.ops.compose_sql(sql, params), delete_sql=delete_sql, last_loaded=last_loaded)
+
+    if manager.extract_mode == 'pushdown':
+        insert_sql, orphan_sql, params = manager.pushdown_sql(queryset)
+        load.insert_sql = destination.ops.compose_sql(insert_sql, params)
+        if orphan_sql:
+            load.orphan_sql = destination.ops.compose_sql(orphan_sql, params)
+            load.orphan_fields = [fld.name for fld in model._meta.concrete_fields
+                                  if fld.is_relation and fld.name in fields]
+    else:
+        columns = [quote_name(model._meta.get_field(name).column) for name in fields]
+        load.copy_before, load.copy_sql, load.copy_after = manager.copy_statements(columns)
+    return load
+
+
+def finish_load(load: AsyncLoad, rows: int) -> None:
+    """Record the load with its manager, and move the incremental log on"""
+    if load.last_loaded is not None and rows:
+        load.model.objects.update_last_loaded(load.last_loaded)
+    load.context.log.append(("Loaded Values", load.model.__name__, rows))
+
+
+def load_locked(model, context: LoadContext, run_on_loop, threads: threading.Semaphore):
+    """
+    Load a model holding its lock, on one worker thread from start to end so the lock's connection stays the same.
+    Async loads are run on the event loop by run_on_loop, the others are loaded here once one of threads is free
+    """
+    with model_lock(model, wait=True):
+        load = prepare_load(model, context)
+        if load is None:
+            with threads:
+                return model.objects.populate_model(context)
+        logger.info(f"Executing {model.objects.LOAD_TYPE} for {model.__name__} asynchronously")
+        rows = run_on_loop(load)
+        finish_load(load, rows)
+        return context.log
+
+
+def conninfo(alias: str) -> str:
+    from psycopg.conninfo import make_conninfo
+
+    database = connections[alias].settings_dict
+    return make_conninfo(**{
+        key: value for key, value in {
+            'dbname': database.get('NAME'),
+            'user': database.get('USER'),
+            'password': database.get('PASSWORD'),
+            'host': database.get('HOST'),
+            'port': database.get('PORT'),
+        }.items() if value
+    })
+
+
+async def run_load(load: AsyncLoad, pools: dict) -> int:
+    """Run a prepared load, returns the number of rows loaded"""
+    context = load.context
+    start = time.time()
+    if load.pushdown:
+        async with pools[load.destination].connection() as connection:
+            exists = await connection.execute(f"SELECT EXISTS ({load.select_sql})")
+            if not (await exists.fetchone())[0]:
+                return 0
+            if load.delete_sql:
+                await connection.execute(load.delete_sql)
+            if load.orphan_sql:
+                orphans = await (await connection.execute(load.orphan_sql)).fetchone()
+                for name, count in zip(load.orphan_fields, orphans):
+                    if count:
+                        context.integrity.add_orphans(name, count)
+                        context.log.append(('Missing Values', name, count))
+            with context.metrics.batch('pushdown') as pushdown:
+                rows = (await connection.execute(load.insert_sql)).rowcount
+                pushdown.rows += rows
+    else:
+        with tempfile.SpooledTemporaryFile(max_size=COPY_SPOOL_SIZE) as stream:
+            with context.metrics.stage('source_query') as extract:
+                async with pools[load.source].connection() as connection:
+                    async with connection.cursor() as cursor:
+                        async with cursor.copy(f"COPY ({load.select_sql}) TO STDOUT") as copy:
+                            async for data in copy:
+                                stream.write(data)
+                        rows = cursor.rowcount
+                extract.rows += rows
+                extract.bytes += stream.tell()
+            if not rows:
+                return 0
+
+            stream.seek(0)
+            with context.metrics.batch('write') as write:
+                async with pools[load.destination].connection() as connection:
+                    if load.delete_sql:
+                        await connection.execute(load.delete_sql)
+                    for sql in load.copy_before:
+                        await connection.execute(sql)
+                    async with connection.cursor() as cursor:
+                        async with cursor.copy(load.copy_sql) as copy:
+                            while data := stream.read(COPY_BUFFER_SIZE):
+                                await copy.write(data)
+                    for sql in load.copy_after:
+                        await connection.execute(sql)
+                write.rows += rows
+                write.bytes += stream.tell()
+
+    logger.info(f"{load.model.__name__} Loaded {rows} records.")
+    logger.info(f"{load.model.__name__} took: {time.time() - start:.2f} seconds")
+    return rows
+
+
+def in_worker(function, *args):
+    """Django calls made from the event loop run on worker threads, which close their connections when done"""
+    try:
+        return function(*args)
+    finally:
+        connections.close_all()
+
+
+async def run_async(pipeline, graph: dict, workers: int = 1, pool_size: int = POOL_SIZE,
+                    contexts: dict | None = None) -> dict:
+    """
+    Run every loader as soon as everything it depends on has loaded, each in its LoadContext from contexts
+    if given. Async loads all run at once, the others on up to workers threads at a time.
+    After a failure nothing new is started, loaders already running are allowed to finish.
+    """
+    try:
+        from psycopg_pool import AsyncConnectionPool
+    except ImportError as e:
+        raise ImportError('The async backend needs psycopg 3 and its pool, pip install "psycopg[binary,pool]"') from e
+
+    order = topological_order(pipeline, graph)  # fail early on cycles
+    pools = {alias: AsyncConnectionPool(conninfo(alias), min_size=1, max_size=pool_size, open=False)
+             for alias in settings.DATABASES}
+    loop = asyncio.get_running_loop()
+    # a thread per model, async loads wait on theirs while they run on the loop
+    locked = ThreadPoolExecutor(max_workers=max(len(order), 1), thread_name_prefix='pipeline-load')
+    threads = threading.Semaphore(workers)
+    contexts = contexts or {}
+    analytics_log = {}
+    failed = False
+
+    async def load_model(model, dependencies):
+        nonlocal failed
+        if not all(await asyncio.gather(*dependencies)) or failed:
+            return False
+        context = contexts.get(model) or LoadContext()
+
+        def run_on_loop(load: AsyncLoad) -> int:
+            return asyncio.run_coroutine_threadsafe(run_load(load, pools), loop).result()
+
+        try:
+            analytics_log[model.__name__] = await loop.run_in_executor(
+                locked, in_worker, load_locked, model, context, run_on_loop, threads)
+            return True
+        except Exception as e:
+            logger.error(f"Error loading {model.__name__}:\n\t\t{e}")
+            traceback.print_exception(e)
+            failed = True
+            return False
+
+    for pool in pools.values():
+        await pool.open()
+    try:
+        tasks = {}
+        for model in order:
+            tasks[model] = asyncio.ensure_future(load_model(model, [tasks[dep] for dep in graph[model]]))
+        await asyncio.gather(*tasks.values())
+    finally:
+        locked.shutdown()
+        for pool in pools.values():
+            await pool.close()
+    return analytics_log
@@ -0,0 +1,117 @@
+# Times every staging and analytics loader against the synthetic source data and keeps the results
+# in a JSON lines file, so runs on different commits can be compared like for like.
+# Only for a local database, the destination tables are emptied before every run.
+
+import datetime
+import json
+import logging
+import os
+import subprocess
+import time
+
+from django.conf import settings
+from django.db import connections
+
+from pipeline.models.analytics import AnalyticsIncrementalLog
+from pipeline.models.checkpoints import LoadCheckpoint
+from pipeline.models.context import LoadContext
+from pipeline.models.staging import IncrementalLog
+from pipeline.scheduler import dependency_graph, topological_order
+
+logger = logging.getLogger('Pipeline Runner')
+
+# results are compared between runs with the same values of these
+BENCHMARK_PARAMETERS = ('scale', 'seed', 'orphan_rate', 'distinct_slugs', 'slug_skew', 'phase')
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=settings.BASE_DIR, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+
+def reset_destination(pipelines, using='default') -> None:
+    """Empty every table the pipelines load, and the incremental logs, so the next run starts from scratch"""
+    connection = connections[using]
+    models = [model for pipeline in pipelines for model in pipeline]
+    models += [IncrementalLog, AnalyticsIncrementalLog, LoadCheckpoint]
+    tables = ', '.join(connection.ops.quote_name(model._meta.db_table) for model in models)
+    with connection.cursor() as cursor:
+        cursor.execute(f"TRUNCATE {tables} RESTART IDENTITY CASCADE")
+
+
+def time_pipeline(pipeline) -> list[dict]:
+    """Run each loader of a pipeline in dependency order, returns the timings of each one"""
+    results = []
+    for model in topological_order(pipeline, dependency_graph(pipeline)):
+        context = LoadContext()
+        start = time.perf_counter()
+        model.objects.populate_model(context)
+        seconds = time.perf_counter() - start
+        results.append({
+            'model': model.__name__,
+            'seconds': round(seconds, 4),
+            'rows': model.objects.count(),
+            'peak_rss_kb': context.metrics.peak_rss_kb,
+            'stages': context.metrics.as_dict()['stages'],
+        })
+        logger.info(f"Benchmarked {model.__name__}: {seconds:.2f} seconds")
+    return results
+
+
+def read_results(path: str) -> list[dict]:
+    if not os.path.exists(path):
+        return []
+    with open(path) as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def append_results(path: str, results: list[dict]) -> None:
+    if directory := os.path.dirname(path):
+        os.makedirs(directory, exist_ok=True)
+    with open(path, 'a') as f:
+        for result in results:
+            f.write(json.dumps(result) + '\n')
+
+
+def best_times(results: list[dict]) -> dict:
+    """Fastest time of each loader per commit and benchmark parameters, repeats are taken at their best"""
+    best = {}
+    for result in results:
+        key = (result['commit'], *(result[name] for name in BENCHMARK_PARAMETERS), result['model'])
+        best[key] = min(best.get(key, float('inf')), result['seconds'])
+    return best
+
+
+def compare(results: list[dict], history: list[dict]) -> list[tuple]:
+    """
+    Compare the best time of each loader in results with the most recent other commit in the history
+    that was benchmarked with the same parameters.
+    Returns (phase, model, seconds, previous commit, previous seconds) rows
+    """
+    current = best_times(results)
+    previous = best_times(history)
+    # commits ordered by their latest results
+    commits_in_order = list(reversed(dict.fromkeys(result['commit'] for result in reversed(history))))
+
+    rows = []
+    for (commit, *parameters, model), seconds in current.items():
+        earlier = [c for c in commits_in_order if c != commit and (c, *parameters, model) in previous]
+        if earlier:
+            rows.append((parameters[-1], model, seconds, earlier[-1], previous[(earlier[-1], *parameters, model)]))
+        else:
+            rows.append((parameters[-1], model, seconds, None, None))
+    return rows
+
+
+def benchmark_record(commit: str, parameters: dict, phase: str, repeat: int, result: dict) -> dict:
+    return {
+        'commit': commit,
+        'recorded': datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        **parameters,
+        'phase': phase,
+        'repeat': repeat,
+        **result,
+    }
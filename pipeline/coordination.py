@@ -0,0 +1,110 @@
+# Splits a pipeline between instances started with run_pipeline --shared, possibly in different containers.
+# An instance joins the shared run going on, or starts one, and claims models as it gets to them: it takes
+# the model's lock, loads it unless the registry says another instance already did in this run, and records
+# the outcome. Models another instance is loading are waited for, so dependencies still load first.
+
+import logging
+import os
+import socket
+
+from django.db import transaction
+from django.utils import timezone
+
+from pipeline.locks import acquire, release, is_locked, transaction_lock, lock_id, model_lock
+from pipeline.models.runs import PipelineRun, ModelRun
+
+logger = logging.getLogger('Pipeline Runner')
+
+REGISTRY_LOCK = lock_id('pipeline.registry')
+
+# outcomes of claiming a model
+LOADED = 'loaded'
+BUSY = 'busy'
+DONE_ELSEWHERE = 'done elsewhere'
+FAILED_ELSEWHERE = 'failed elsewhere'
+
+
+def run_lock_id(run: PipelineRun) -> int:
+    return lock_id(f'pipeline.run.{run.run_id}')
+
+
+class SharedRun:
+    """
+    One instance's part in a shared run, join it on the main connection for as long as the instance takes part
+    """
+
+    def __init__(self, instance: str | None = None, using: str = 'default'):
+        self.instance = instance or f"{socket.gethostname()}:{os.getpid()}"
+        self.using = using
+        self.run = None
+
+    def __enter__(self) -> 'SharedRun':
+        self.join()
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.leave()
+
+    def join(self) -> PipelineRun:
+        """
+        Join the shared run instances are in, or start one. Every instance in a run holds its lock shared,
+        a run nobody holds the lock of anymore was left behind by instances that died
+        """
+        with transaction.atomic(using=self.using):
+            transaction_lock(REGISTRY_LOCK, self.using)
+            runs = PipelineRun.objects.using(self.using)
+            run = runs.filter(finished__isnull=True).order_by('-started').first()
+            if run is not None and not is_locked(run_lock_id(run), self.using):
+                run.finished = timezone.now()
+                run.save(update_fields=['finished'])
+                run = None
+            if run is None:
+                run = runs.create()
+            acquire(run_lock_id(run), self.using, shared=True)
+        self.run = run
+        logger.info(f"{self.instance} joined pipeline run {run.run_id}")
+        return run
+
+    def leave(self) -> None:
+        """Leave the run, the last instance to leave finishes it"""
+        with transaction.atomic(using=self.using):
+            transaction_lock(REGISTRY_LOCK, self.using)
+            release(run_lock_id(self.run), self.using, shared=True)
+            if not is_locked(run_lock_id(self.run), self.using):
+                self.run.finished = timezone.now()
+                self.run.save(update_fields=['finished'])
+
+    def populate(self, model, context=None, wait: bool = False) -> tuple[str, object]:
+        """
+        Load the model unless another instance is loading it or did already in this run, with wait it waits
+        for the other instance to finish first. Returns the outcome, with the loader's log when it was loaded here
+        and the instance that loaded it otherwise
+        """
+        with model_lock(model, wait=wait) as acquired:
+            if not acquired:
+                return BUSY, None
+            model_run, created = ModelRun.objects.get_or_create(
+                run=self.run, model_name=model.__name__,
+                defaults={'instance': self.instance, 'started': timezone.now()})
+            if model_run.status == ModelRun.DONE:
+                return DONE_ELSEWHERE, model_run.instance
+            if model_run.status == ModelRun.FAILED:
+                return FAILED_ELSEWHERE, model_run.instance
+            if not created:
+                # the instance that claimed it died while loading it, and its lock went with its connection
+                logger.warning(f"Loading {model.__name__} again, {model_run.instance} didn't finish it")
+                model_run.instance = self.instance
+                model_run.started = timezone.now()
+                model_run.save(update_fields=['instance', 'started'])
+
+            try:
+                log = model.objects.populate_model(context)
+            except Exception:
+                model_run.status = ModelRun.FAILED
+                raise
+            else:
+                model_run.status = ModelRun.DONE
+            finally:
+                model_run.finished = timezone.now()
+                model_run.save(update_fields=['status', 'finished'])
+            return LOADED, log
@@ -0,0 +1,128 @@
+# Runs the pipeline over and over from one long lived process (run_pipeline --daemon), on an interval
+# or a cron expression, instead of starting python and django from scratch for every run.
+# Database connections, foreign key indexes and parsed slugs carry over from one run to the next.
+
+import logging
+import re
+import threading
+from datetime import datetime, date, time, timedelta
+from typing import Callable
+
+logger = logging.getLogger('Pipeline Runner')
+
+DURATION_UNITS = {'s': 1, 'm': 60, 'h': 3600, 'd': 86400}
+
+
+def parse_duration(value: str) -> float:
+    """Seconds in a duration like 90, 30s, 15m or 1h"""
+    match = re.fullmatch(r'\s*(\d+(?:\.\d+)?)\s*([smhd]?)\s*', value)
+    if not match or float(match.group(1)) <= 0:
+        raise ValueError(f"Invalid duration {value!r}, expected a number of seconds or e.g. 30s, 15m, 1h")
+    return float(match.group(1)) * DURATION_UNITS[match.group(2) or 's']
+
+
+class IntervalSchedule:
+    """Runs every so many seconds, counted from the start of the previous run"""
+
+    def __init__(self, seconds: float):
+        self.seconds = seconds
+
+    def next_run(self, after: datetime) -> datetime:
+        return after + timedelta(seconds=self.seconds)
+
+    def __str__(self) -> str:
+        return f"every {self.seconds:g} seconds"
+
+
+class CronSchedule:
+    """
+    Runs at the times matched by a cron expression: minute hour day-of-month month day-of-week,
+    each field *, a number, a range a-b, a list a,b and any of them stepped with /n. Sunday is 0 or 7
+    """
+    FIELDS = (('minute', 0, 59), ('hour', 0, 23), ('day', 1, 31), ('month', 1, 12), ('weekday', 0, 7))
+
+    def __init__(self, expression: str):
+        self.expression = expression
+        parts = expression.split()
+        if len(parts) != len(self.FIELDS):
+            raise ValueError(f"Invalid cron expression {expression!r}, expected 5 fields")
+        values = [self.parse_field(part, low, high) for part, (_, low, high) in zip(parts, self.FIELDS)]
+        self.minutes, self.hours, self.days, self.months, weekdays = map(sorted, values)
+        self.weekdays = {weekday % 7 for weekday in weekdays}
+        # with both day fields restricted a day matching either one runs, as in cron
+        self.any_day = parts[2] == '*'
+        self.any_weekday = parts[4] == '*'
+
+    @staticmethod
+    def parse_field(field: str, low: int, high: int) -> set[int]:
+        values = set()
+        for part in field.split(','):
+            match = re.fullmatch(r'(\*|(\d+)(?:-(\d+))?)(?:/(\d+))?', part)
+            if not match:
+                raise ValueError(f"Invalid cron field {field!r}")
+            _, start, end, step = match.groups()
+            if start is None:
+                start, end = low, high
+            else:
+                start = int(start)
+                # a stepped single value runs from there to the end of the range
+                end = int(end) if end is not None else (high if step else start)
+            step = int(step or 1)
+            if not low <= start <= end <= high or step < 1:
+                raise ValueError(f"Invalid cron field {field!r}, values go from {low} to {high}")
+            values.update(range(start, end + 1, step))
+        return values
+
+    def day_matches(self, day: date) -> bool:
+        if day.month not in self.months:
+            return False
+        # python counts weekdays from monday, cron from sunday
+        in_days = day.day in self.days
+        in_weekdays = (day.weekday() + 1) % 7 in self.weekdays
+        if self.any_day or self.any_weekday:
+            return in_days and in_weekdays
+        return in_days or in_weekdays
+
+    def next_run(self, after: datetime) -> datetime:
+        start = (after + timedelta(minutes=1)).replace(second=0, microsecond=0)
+        day = start.date()
+        # a date like the 29th of february on a given weekday can be years away
+        for _ in range(366 * 8):
+            if self.day_matches(day):
+                for hour in self.hours:
+                    for minute in self.minutes:
+                        candidate = datetime.combine(day, time(hour, minute), tzinfo=after.tzinfo)
+                        if candidate >= start:
+                            return candidate
+            day += timedelta(days=1)
+        raise ValueError(f"Cron expression {self.expression!r} never runs")
+
+    def __str__(self) -> str:
+        return f"at {self.expression!r}"
+
+
+def run_forever(run: Callable[[], None], schedule, stop: threading.Event,
+                now: Callable[[], datetime] = datetime.now, log_next_run: bool = True) -> int:
+    """
+    Call run on the schedule until stop is set, a run in progress is always finished first.
+    Runs that overrun skip the times they missed instead of running back to back to catch up.
+    A failed run is logged and the next one goes ahead as usual. Returns the number of runs.
+    Runs a few seconds apart can leave out logging when the next one is
+    """
+    runs = 0
+    next_run = now()
+    while not stop.is_set():
+        if stop.wait(max(0.0, (next_run - now()).total_seconds())):
+            break
+        started = now()
+        try:
+            run()
+        except Exception:
+            logger.exception("Pipeline run failed")
+        runs += 1
+        next_run = schedule.next_run(started)
+        while next_run <= now():
+            next_run = schedule.next_run(next_run)
+        if log_next_run:
+            logger.info(f"Next pipeline run at {next_run:%Y-%m-%d %H:%M:%S}")
+    return runs
@@ -0,0 +1,69 @@
+# Postgres advisory locks, so pipeline runs started from different processes (the daemon, a manual run,
+# another container) never overlap. Session locks are released when their connection closes,
+# so a run that dies can't leave one behind.
+# Instances sharing a pipeline (run_pipeline --shared) hold the pipeline lock shared instead, and lock each
+# model while they load it, so they never load the same table at the same time.
+
+import hashlib
+from contextlib import contextmanager
+
+from django.db import connections
+
+
+def lock_id(name: str) -> int:
+    """64 bit advisory lock key for a name, signed so it fits a postgres bigint"""
+    return int.from_bytes(hashlib.blake2b(name.encode(), digest_size=8).digest(), 'big', signed=True)
+
+
+PIPELINE_LOCK = lock_id('pipeline.run')
+
+
+def model_lock_id(model) -> int:
+    return lock_id(f'pipeline.model.{model.__name__}')
+
+
+def acquire(key: int, using: str = 'default', shared: bool = False, wait: bool = False) -> bool:
+    """Take a session advisory lock, with wait blocks until it's free, otherwise returns whether it was taken"""
+    function = ('pg_advisory_lock' if wait else 'pg_try_advisory_lock') + ('_shared' if shared else '')
+    with connections[using].cursor() as cursor:
+        cursor.execute(f"SELECT {function}(%s)", [key])
+        return wait or cursor.fetchone()[0]
+
+
+def release(key: int, using: str = 'default', shared: bool = False) -> None:
+    with connections[using].cursor() as cursor:
+        cursor.execute(f"SELECT pg_advisory_unlock{'_shared' if shared else ''}(%s)", [key])
+
+
+def is_locked(key: int, using: str = 'default') -> bool:
+    """Whether another session holds the lock, shared or not"""
+    if not acquire(key, using):
+        return True
+    release(key, using)
+    return False
+
+
+def transaction_lock(key: int, using: str = 'default') -> None:
+    """Wait for the lock and hold it until the end of the current transaction"""
+    with connections[using].cursor() as cursor:
+        cursor.execute("SELECT pg_advisory_xact_lock(%s)", [key])
+
+
+@contextmanager
+def advisory_lock(key: int, using: str = 'default', shared: bool = False, wait: bool = False):
+    """Take a session advisory lock for the block (without waiting unless wait is set), yields whether it was taken"""
+    acquired = acquire(key, using, shared, wait)
+    try:
+        yield acquired
+    finally:
+        if acquired:
+            release(key, using, shared)
+
+
+def pipeline_lock(using: str = 'default', shared: bool = False):
+    """Taken by every run, shared by the instances of a shared run and exclusive otherwise"""
+    return advisory_lock(PIPELINE_LOCK, using, shared)
+
+
+def model_lock(model, using: str = 'default', wait: bool = False):
+    return advisory_lock(model_lock_id(model), using, wait=wait)
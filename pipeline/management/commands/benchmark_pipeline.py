@@ -0,0 +1,71 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from pipeline.benchmark import (git_commit, reset_destination, time_pipeline, read_results, append_results, compare,
+                                benchmark_record)
+from pipeline.models.analytics import analytics_pipeline
+from pipeline.models.staging import staging_pipeline
+from pipeline.synthetic import SyntheticDataGenerator
+
+
+class Command(BaseCommand):
+    help = 'Benchmark every loader against generated source data, only for a local database'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--scale', type=int, nargs='+', default=[10_000],
+                            help='Approximate number of source rows to generate, several scales run one after another')
+        parser.add_argument('--seed', type=int, default=0, help='Seed of the generated data')
+        parser.add_argument('--orphan-rate', type=float, default=0.01,
+                            help='Share of foreign keys in the source that point at missing rows')
+        parser.add_argument('--distinct-slugs', type=int, default=50, help='Number of different schedule slugs')
+        parser.add_argument('--slug-skew', type=float, default=1.0,
+                            help='Zipf exponent of the schedule slug distribution, 0 is uniform')
+        parser.add_argument('--repeat', type=int, default=1, help='Times to run each benchmark, the best time counts')
+        parser.add_argument('--results', default='benchmarks/results.jsonl',
+                            help='JSON lines file the results are appended to and compared with')
+        parser.add_argument('--skip-generate', action='store_true',
+                            help='Use the source data that is already there, it must match the parameters')
+        parser.add_argument('--force', action='store_true',
+                            help='Required, the benchmark replaces the source tables and empties every pipeline table')
+
+    def handle(self, *args, **options):
+        if not options['force']:
+            raise CommandError('The benchmark overwrites msk_db and empties the pipeline tables, '
+                               'run it against a local database with --force')
+
+        commit = git_commit()
+        history = read_results(options['results'])
+        results = []
+
+        for scale in options['scale']:
+            parameters = {
+                'scale': scale,
+                'seed': options['seed'],
+                'orphan_rate': options['orphan_rate'],
+                'distinct_slugs': options['distinct_slugs'],
+                'slug_skew': options['slug_skew'],
+            }
+            if not options['skip_generate']:
+                self.stdout.write(f'Generating source data for scale {scale}...')
+                generator = SyntheticDataGenerator(**parameters)
+                for table, rows in generator.write_all(replace=True).items():
+                    self.stdout.write(f'  {table}: {rows} rows')
+
+            for repeat in range(options['repeat']):
+                reset_destination([staging_pipeline, analytics_pipeline])
+                # the first run loads everything, the second is an hourly run with nothing new in the source
+                for phase in ('initial', 'incremental'):
+                    for pipeline in (staging_pipeline, analytics_pipeline):
+                        results += [benchmark_record(commit, parameters, phase, repeat, result)
+                                    for result in time_pipeline(pipeline)]
+
+        append_results(options['results'], results)
+
+        self.stdout.write(f"{'phase':<12} {'model':<40} {'seconds':>10} {'previous':>10} {'change':>8}")
+        for phase, model, seconds, previous_commit, previous_seconds in compare(results, history):
+            if previous_commit is None:
+                self.stdout.write(f"{phase:<12} {model:<40} {seconds:>10.3f}")
+                continue
+            change = (seconds - previous_seconds) / previous_seconds * 100 if previous_seconds else 0.0
+            self.stdout.write(f"{phase:<12} {model:<40} {seconds:>10.3f} {previous_seconds:>10.3f} {change:>+7.1f}%"
+                              f" (vs {previous_commit})")
+        self.stdout.write(self.style.SUCCESS(f"Results for {commit} appended to {options['results']}"))
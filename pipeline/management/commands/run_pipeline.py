@@ -1,23 +1,74 @@
+import asyncio
 import logging
-from django.core.management.base import BaseCommand
+import os
+import signal
+import threading
+import uuid
+from contextlib import nullcontext
+from django.core.management.base import BaseCommand, CommandError
+from django.db import close_old_connections
+from django.utils import timezone
 from pipeline.models.staging import staging_pipeline
 from pipeline.models.analytics import analytics_pipeline
+from pipeline.models.context import LoadContext, collect_metrics
+from pipeline.models.integrity import IntegrityReport, OrphanSpill
+from pipeline.models.loaders import KeyIndexCache
+from pipeline.models.metrics import save_run_metrics, metrics_json, prometheus_text
+from pipeline.scheduler import dependency_graph, topological_order, run_parallel, run_shared, populate_locked
+from pipeline.asyncload import run_async
+from pipeline.daemon import CronSchedule, IntervalSchedule, parse_duration, run_forever
+from pipeline.microbatch import micro_batch_models, load_micro_batches
+from pipeline.models.batching import MICRO_BATCH_ROWS
+from pipeline.coordination import SharedRun
+from pipeline.locks import pipeline_lock
 logger = logging.getLogger('Pipeline Runner')
 
-def execute_pipeline(pipeline):
+def load_contexts(pipeline, resume=False, orphans_dir=None, key_indexes=None) -> dict:
+    """
+    A fresh LoadContext for each model of a pipeline, for one run.
+
+    Args:
+        pipeline (list): List of model classes to process
+        resume (bool): Carry on with row by row loads that failed part way from their last committed batch
+        orphans_dir (str): Write every orphaned foreign key to a gzipped file per model in this directory
+        key_indexes (KeyIndexCache): Foreign key indexes kept from earlier runs of the same process
+    """
+    contexts = {}
+    for model in pipeline:
+        spill = OrphanSpill(os.path.join(orphans_dir, f"{model.__name__}.orphans.gz")) if orphans_dir else None
+        contexts[model] = LoadContext(resume=resume, integrity=IntegrityReport(spill=spill), key_indexes=key_indexes)
+    return contexts
+
+
+def execute_pipeline(pipeline, workers=1, backend='sync', contexts=None, shared_run=None):
     """
     Execute a pipeline of models with population from unmanaged sources.
 
     Args:
         pipeline (list): List of model classes to process
+        workers (int): Number of loaders to run at the same time, independent models run concurrently
+        backend (str): 'async' runs set based loads together on an event loop, the rest on up to workers threads
+        contexts (dict): LoadContext of each model for this run, from load_contexts, fresh ones if not given
+        shared_run (SharedRun): Split the models with the other instances in this shared run
 
     Returns:
         dict: Analytics log with results for each model
     """
+    if contexts is None:
+        contexts = load_contexts(pipeline)
+
+    graph = dependency_graph(pipeline)
+    if shared_run is not None:
+        return run_shared(pipeline, graph, workers, contexts, shared_run)
+    if backend == 'async':
+        return asyncio.run(run_async(pipeline, graph, workers, contexts=contexts))
+    if workers > 1:
+        return run_parallel(pipeline, graph, workers, contexts)
+
     analytics_log = {}
-    for model in pipeline:
+    for model in topological_order(pipeline, graph):
         try:
-            mval_log = model.objects.populate_model()
+            mval_log = populate_locked(model, contexts[model])
             analytics_log[model.__name__] = mval_log
         except Exception as e:
             logger.error(f"Error loading {model.__name__}:\n\t\t{e}")
@@ -46,6 +97,77 @@ class Command(BaseCommand):
             action='store_true',
             help='Skip analytics pipeline execution'
         )
+        parser.add_argument(
+            '--workers',
+            type=int,
+            default=1,
+            help='Number of models to load concurrently, dependencies are always loaded first'
+        )
+        parser.add_argument(
+            '--backend',
+            choices=['sync', 'async'],
+            default='sync',
+            help='async loads the copy and pushdown loaders together on one event loop (needs psycopg 3)'
+        )
+        parser.add_argument(
+            '--resume',
+            action='store_true',
+            help='Carry on with row by row loads (the values extract mode) that failed part way from their last '
+                 'committed batch, otherwise they start over. Copy, pushdown, swap and merge loads commit all at '
+                 'once, a failed one left nothing behind and starts over. Partitioned loads carry on from the '
+                 'incremental log either way, it moves on as their key ranges commit'
+        )
+        parser.add_argument(
+            '--metrics-json',
+            metavar='PATH',
+            help='Write the timings of each stage of each load to this file as JSON'
+        )
+        parser.add_argument(
+            '--metrics-prometheus',
+            metavar='PATH',
+            help='Write the timings of each stage of each load to this file in the Prometheus text format'
+        )
+        parser.add_argument(
+            '--orphans-dir',
+            metavar='PATH',
+            help='Write every orphaned foreign key to a gzipped file per model in this directory, '
+                 'the logs only keep a count and a sample'
+        )
+        parser.add_argument(
+            '--shared',
+            action='store_true',
+            help='Split the pipeline with the other instances running it with --shared, possibly on other nodes, '
+                 'each model is loaded by one of them'
+        )
+        parser.add_argument(
+            '--daemon',
+            action='store_true',
+            help='Keep running and run the pipeline on a schedule (hourly unless --every or --cron is given), '
+                 'reusing connections and caches between runs'
+        )
+        parser.add_argument(
+            '--micro-batch',
+            action='store_true',
+            help='Keep running and load what the sources of incrementally loaded tables gained every few seconds '
+                 '(5s unless --every is given), alongside the pipeline runs'
+        )
+        parser.add_argument(
+            '--micro-batch-rows',
+            type=int,
+            default=MICRO_BATCH_ROWS,
+            help='With --micro-batch, the most source rows read for a table at a time'
+        )
+        schedule = parser.add_mutually_exclusive_group()
+        schedule.add_argument(
+            '--every',
+            metavar='DURATION',
+            help='With --daemon or --micro-batch, run this often, e.g. 90, 30s, 15m or 1h'
+        )
+        schedule.add_argument(
+            '--cron',
+            metavar='EXPRESSION',
+            help='With --daemon or --micro-batch, run at the times of a cron expression, e.g. "*/15 * * * *"'
+        )
         parser.add_argument(
             '--print-logs',
             action='store_true',
@@ -53,6 +175,13 @@ class Command(BaseCommand):
             help='Skip analytics pipeline execution'
         )
 
+    def print_logs(self, contexts, log):
+        for model_name, log_entry in log.items():
+            self.stdout.write(f'{model_name}: {log_entry}')
+        for model, context in contexts.items():
+            if context.integrity:
+                self.stdout.write(f'{model.__name__} integrity: {context.integrity}')
+
     def handle(self, *args, **options):
         """
         Main command execution method.
@@ -60,24 +189,118 @@ class Command(BaseCommand):
         Modify staging_pipeline and analytics_pipeline
         to include your specific model classes.
         """
+        if options['shared'] and options['backend'] == 'async':
+            raise CommandError('--shared loads models on threads, it needs the sync backend')
+        if options['micro_batch']:
+            if options['daemon']:
+                raise CommandError('Run --micro-batch and --daemon as two processes')
+            return self.run_micro_batches(options)
+        if options['daemon']:
+            return self.run_daemon(options)
+        if options['every'] or options['cron']:
+            raise CommandError('--every and --cron need --daemon or --micro-batch')
+
+        with pipeline_lock(shared=options['shared']) as acquired:
+            if not acquired:
+                self.stderr.write('Another pipeline run is in progress, not starting this one')
+                return
+            self.run_once(options)
+
+    @staticmethod
+    def schedule(options, default_every):
+        try:
+            if options['cron']:
+                return CronSchedule(options['cron'])
+            return IntervalSchedule(parse_duration(options['every'] or default_every))
+        except ValueError as e:
+            raise CommandError(str(e)) from e
+
+    @staticmethod
+    def stop_on_signals() -> threading.Event:
+        stop = threading.Event()
+        # finish the run in progress, then stop
+        for stop_signal in (signal.SIGTERM, signal.SIGINT):
+            signal.signal(stop_signal, lambda *args: stop.set())
+        return stop
+
+    def run_daemon(self, options):
+        schedule = self.schedule(options, '1h')
+        # kept for the life of the process, an index is only fetched again once its table changes
+        key_indexes = KeyIndexCache()
+        stop = self.stop_on_signals()
+
+        def run():
+            # connections are kept between runs, only the ones that broke in the meantime are replaced
+            close_old_connections()
+            with pipeline_lock(shared=options['shared']) as acquired:
+                if not acquired:
+                    logger.warning('Another pipeline run is in progress, skipping this one')
+                    return
+                self.run_once(options, key_indexes)
+
+        self.stdout.write(f'Running the pipeline {schedule}')
+        runs = run_forever(run, schedule, stop)
+        self.stdout.write(f'Stopped after {runs} runs')
+
+    def run_micro_batches(self, options):
+        schedule = self.schedule(options, '5s')
+        pipeline = (([] if options['skip_staging'] else staging_pipeline) +
+                    ([] if options['skip_analytics'] else analytics_pipeline))
+        models = micro_batch_models(pipeline)
+        stop = self.stop_on_signals()
+
+        def run():
+            close_old_connections()
+            for model_name, rows in load_micro_batches(models, options['micro_batch_rows']).items():
+                if rows:
+                    logger.info(f"{model_name} micro-batch read {rows} new rows")
+
+        self.stdout.write(f"Loading {', '.join(model.__name__ for model in models)} in micro-batches {schedule}")
+        runs = run_forever(run, schedule, stop, log_next_run=False)
+        self.stdout.write(f'Stopped after {runs} micro-batches')
+
+    def run_once(self, options, key_indexes=None):
+        # the instances of a shared run keep their metrics under the same run id
+        with SharedRun() if options['shared'] else nullcontext() as shared_run:
+            run_id = shared_run.run.run_id if shared_run else uuid.uuid4()
+            self.run_pipelines(options, key_indexes, run_id, shared_run)
+
+    def run_pipelines(self, options, key_indexes, run_id, shared_run):
+        run_started = timezone.now()
+        run_metrics = {}
 
         # Execute pipelines based on command options
         if not options['skip_staging']:
             self.stdout.write('Starting staging pipeline...')
-            staging_log = execute_pipeline(staging_pipeline)
+            staging_contexts = load_contexts(staging_pipeline, options['resume'], options['orphans_dir'], key_indexes)
+            staging_log = execute_pipeline(staging_pipeline, workers=options['workers'], backend=options['backend'],
+                                           contexts=staging_contexts, shared_run=shared_run)
+            run_metrics.update(collect_metrics(staging_contexts))
             self.stdout.write(self.style.SUCCESS('Staging pipeline completed'))
 
             # Optional: log details about staging pipeline execution
             if options['print_logs']:
-                for model_name, log_entry in staging_log.items():
-                    self.stdout.write(f'{model_name}: {log_entry}')
+                self.print_logs(staging_contexts, staging_log)
 
         if not options['skip_analytics']:
             self.stdout.write('Starting analytics pipeline...')
-            analytics_log = execute_pipeline(analytics_pipeline)
+            analytics_contexts = load_contexts(analytics_pipeline, options['resume'], options['orphans_dir'],
+                                               key_indexes)
+            analytics_log = execute_pipeline(analytics_pipeline, workers=options['workers'],
+                                             backend=options['backend'], contexts=analytics_contexts,
+                                             shared_run=shared_run)
+            run_metrics.update(collect_metrics(analytics_contexts))
             self.stdout.write(self.style.SUCCESS('Analytics pipeline completed'))
 
             # Optional: log details about analytics pipeline execution
             if options['print_logs']:
-                for model_name, log_entry in analytics_log.items():
-                    self.stdout.write(f'{model_name}: {log_entry}')
+                self.print_logs(analytics_contexts, analytics_log)
+
+        # keep the run history, so regressions in the stages of a load can be spotted over time
+        save_run_metrics(run_id, run_started, run_metrics)
+        if options['metrics_json']:
+            with open(options['metrics_json'], 'w') as f:
+                f.write(metrics_json(run_id, run_started, run_metrics))
+        if options['metrics_prometheus']:
+            with open(options['metrics_prometheus'], 'w') as f:
+                f.write(prometheus_text(run_metrics))
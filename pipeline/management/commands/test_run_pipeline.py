@@ -1,7 +1,10 @@
+import json
+import os
+import tempfile
 
 from django.core.management import call_command
 from django.test import TestCase
-from unittest.mock import patch, MagicMock
+from unittest.mock import patch, MagicMock, ANY
 
 from pipeline.management.commands.run_pipeline import execute_pipeline
 from pipeline.models.staging import StagingScheduleModel, StagingJourneyModel, StagingPatientModel, StagingDeviceModel, StagingActivityModel, StagingSurveyModel,  StagingStepResultsModel, StagingJourneyActivityModel, StagingPatientJourneyModel, StagingSurveyResultsModel, staging_pipeline
@@ -21,8 +24,10 @@ class RunPipelineCommandTest(TestCase):
         call_command("run_pipeline")
 
         # Ensure execute_pipeline is called with both pipelines
-        mock_execute_pipeline.assert_any_call(staging_pipeline)
-        mock_execute_pipeline.assert_any_call(analytics_pipeline)
+        mock_execute_pipeline.assert_any_call(staging_pipeline, workers=1, backend='sync', contexts=ANY,
+                                              shared_run=None)
+        mock_execute_pipeline.assert_any_call(analytics_pipeline, workers=1, backend='sync', contexts=ANY,
+                                              shared_run=None)
         assert mock_execute_pipeline.call_count == 2
 
     @patch('pipeline.models.staging.staging_pipeline', new_callable=lambda: list(intended_staging_pipeline))
@@ -69,4 +74,18 @@ class RunPipelineCommandTest(TestCase):
         # Check the returned analytics log contains expected results
         expected_log = {mock_model.__name__: "Success" for mock_model in mock_models}
 
-        assert result == expected_log
\ No newline at end of file
+        assert result == expected_log
+
+    @patch('pipeline.management.commands.run_pipeline.execute_pipeline')
+    def test_metrics_are_exported(self, mock_execute_pipeline):
+        """Test that the run metrics are written out when asked for"""
+        mock_execute_pipeline.return_value = {}
+
+        with tempfile.TemporaryDirectory() as directory:
+            json_path, prometheus_path = os.path.join(directory, 'run.json'), os.path.join(directory, 'run.prom')
+            call_command("run_pipeline", metrics_json=json_path, metrics_prometheus=prometheus_path)
+
+            with open(json_path) as f:
+                assert 'run_id' in json.load(f)
+            with open(prometheus_path) as f:
+                assert '# TYPE pipeline_stage_seconds_total counter' in f.read()
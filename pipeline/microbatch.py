@@ -0,0 +1,51 @@
+# Keeps incrementally loaded tables within seconds of their source between pipeline runs (run_pipeline --micro-batch).
+# Every few seconds each incremental loader loads what its source gained past the incremental log, a small batch
+# at a time, on its own. The pipeline runs still do everything else: full loads, change windows, deletions.
+# Loads of a table never overlap, a pipeline run loading a table waits for its micro-batch, and a micro-batch
+# leaves a table alone while a run is loading it, or while a failed load of it waits to be resumed or discarded.
+
+import logging
+
+from pipeline.locks import model_lock
+from pipeline.models.batching import MICRO_BATCH_ROWS
+from pipeline.models.context import LoadContext
+from pipeline.models.loaders import IncrementalLoadManager
+from pipeline.scheduler import dependency_graph, topological_order
+
+logger = logging.getLogger('Pipeline Runner')
+
+
+def micro_batch_models(pipeline) -> list:
+    """
+    Incrementally loaded models of a pipeline that can be loaded in micro-batches, in the order they load in.
+    A model is left out if anything it depends on isn't, rows pointing at rows only the next run would load
+    would lose their foreign keys
+    """
+    graph = dependency_graph(pipeline)
+    models = []
+    for model in topological_order(pipeline, graph):
+        if isinstance(model.objects, IncrementalLoadManager) and graph[model] <= set(models):
+            models.append(model)
+    return models
+
+
+def load_micro_batches(models, rows: int = MICRO_BATCH_ROWS) -> dict[str, int]:
+    """
+    Load what each model's source gained since its incremental log, rows at a time until it has caught up.
+    Returns the source rows read for each model
+    """
+    loaded = {}
+    for model in models:
+        with model_lock(model) as acquired:
+            if not acquired:
+                logger.info(f"{model.__name__} is being loaded by a pipeline run, leaving it to the run")
+                continue
+            loader = model.objects.in_context(LoadContext())
+            loaded[model.__name__] = 0
+            while count := loader.micro_batch(rows):
+                loaded[model.__name__] += count
+                if count < rows:
+                    break
+            if loader.integrity:
+                logger.warning(f"{model.__name__} integrity: {loader.integrity}")
+    return loaded
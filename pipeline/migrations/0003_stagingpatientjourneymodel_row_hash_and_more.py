@@ -0,0 +1,23 @@
+# Generated by Django 5.1.5 on 2026-10-18 06:14
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pipeline', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='stagingpatientjourneymodel',
+            name='row_hash',
+            field=models.BigIntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='stagingsurveyresultsmodel',
+            name='row_hash',
+            field=models.BigIntegerField(blank=True, null=True),
+        ),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 5.1.5 on 2026-10-18 06:23
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pipeline', '0003_stagingpatientjourneymodel_row_hash_and_more'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='LoaderRunMetric',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('run_id', models.UUIDField(db_index=True)),
+                ('run_started', models.DateTimeField()),
+                ('model_name', models.CharField(max_length=255)),
+                ('stage', models.CharField(max_length=50)),
+                ('seconds', models.FloatField()),
+                ('rows', models.BigIntegerField()),
+                ('bytes', models.BigIntegerField()),
+                ('batches', models.IntegerField()),
+                ('batch_seconds', models.FloatField()),
+                ('batch_buckets', models.JSONField(default=dict)),
+                ('peak_rss_kb', models.BigIntegerField(blank=True, null=True)),
+            ],
+            options={
+                'db_table': 'loader_run_metric',
+            },
+        ),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 5.1.5 on 2026-10-18 06:30
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pipeline', '0004_loaderrunmetric'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='LoadCheckpoint',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('model_name', models.CharField(max_length=255, unique=True)),
+                ('key_field', models.CharField(max_length=255)),
+                ('last_key', models.CharField(max_length=255)),
+                ('rows', models.BigIntegerField(default=0)),
+                ('started', models.DateTimeField(auto_now_add=True)),
+                ('updated', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'db_table': 'load_checkpoint',
+            },
+        ),
+    ]
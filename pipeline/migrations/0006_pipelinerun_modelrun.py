@@ -0,0 +1,43 @@
+# Generated by Django 5.1.5 on 2026-10-18 06:55
+
+import django.db.models.deletion
+import uuid
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pipeline', '0005_loadcheckpoint'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PipelineRun',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('run_id', models.UUIDField(default=uuid.uuid4, unique=True)),
+                ('started', models.DateTimeField(auto_now_add=True)),
+                ('finished', models.DateTimeField(blank=True, null=True)),
+            ],
+            options={
+                'db_table': 'pipeline_run',
+            },
+        ),
+        migrations.CreateModel(
+            name='ModelRun',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('model_name', models.CharField(max_length=255)),
+                ('instance', models.CharField(max_length=255)),
+                ('status', models.CharField(choices=[('running', 'Running'), ('done', 'Done'), ('failed', 'Failed')], default='running', max_length=10)),
+                ('started', models.DateTimeField()),
+                ('finished', models.DateTimeField(blank=True, null=True)),
+                ('run', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='model_runs', to='pipeline.pipelinerun')),
+            ],
+            options={
+                'db_table': 'model_run',
+                'constraints': [models.UniqueConstraint(fields=('run', 'model_name'), name='model_run_once_per_run')],
+            },
+        ),
+    ]
@@ -1,3 +1,6 @@
 from .core import *
 from .staging import *
-from .analytics import *
\ No newline at end of file
+from .analytics import *
+from .metrics import *
+from .checkpoints import *
+from .runs import *
@@ -7,9 +7,9 @@ from django.db.models import Func, OuterRef, Subquery, Value, QuerySet, F
 from django.db.models.functions import Coalesce
 from .staging import (StagingScheduleModel, StagingJourneyModel, StagingPatientModel, StagingDeviceModel,
                       StagingActivityModel, StagingSurveyModel, StagingStepResultsModel, StagingJourneyActivityModel,
-                      StagingPatientJourneyModel, StagingSurveyResultsModel)
+                      StagingPatientJourneyModel, StagingSurveyResultsModel, CHANGE_WINDOW)
 from .loaders import FullLoadManager, IncrementalLoadManager, IncrementalTransformLoadManager, \
-    ScheduleWindowTransformer, FullLoadQueryManager
+    ScheduleWindowTransformer, HashIncrementalQueryManager
 
 
 class AnalyticsModel(models.Model):
@@ -47,6 +47,7 @@ class AnalyticsSchedule(AnalyticsModel):
         table_model=StagingScheduleModel,
         incremental_key='id',
         incremental_model=AnalyticsIncrementalLog,
+        extract_mode='pushdown',
     )
 
     class Meta:
@@ -63,6 +64,8 @@ class AnalyticsPatient(AnalyticsModel):
         table_model=StagingPatientModel,
         incremental_key='id',
         incremental_model=AnalyticsIncrementalLog,
+        extract_mode='pushdown',
+        change_window=CHANGE_WINDOW,
     )
 
     class Meta:
@@ -80,6 +83,7 @@ class AnalyticsActivity(AnalyticsModel):
         table_model=StagingActivityModel,
         incremental_key='id',
         incremental_model=AnalyticsIncrementalLog,
+        extract_mode='pushdown',
     )
 
     class Meta:
@@ -97,6 +101,7 @@ class AnalyticsJourney(AnalyticsModel):
         table_model=StagingJourneyModel,
         incremental_key='id',
         incremental_model=AnalyticsIncrementalLog,
+        extract_mode='pushdown',
     )
 
     class Meta:
@@ -113,6 +118,8 @@ class AnalyticsDevice(AnalyticsModel):
         table_model=StagingDeviceModel,
         incremental_key='id',
         incremental_model=AnalyticsIncrementalLog,
+        extract_mode='pushdown',
+        change_window=CHANGE_WINDOW,
     )
 
     class Meta:
@@ -130,6 +137,8 @@ class AnalyticsSurvey(AnalyticsModel):
         table_model=StagingSurveyModel,
         incremental_key='id',
         incremental_model=AnalyticsIncrementalLog,
+        extract_mode='pushdown',
+        change_window=CHANGE_WINDOW,
     )
 
     class Meta:
@@ -141,7 +150,7 @@ class AnalyticsJourneyActivity(AnalyticsModel):
                                    blank=True)
     activity_id = models.ForeignKey(AnalyticsActivity, db_column='activity_id', on_delete=models.SET_NULL, null=True,
                                     blank=True)
-    objects = FullLoadManager(table_model=StagingJourneyActivityModel)
+    objects = FullLoadManager(table_model=StagingJourneyActivityModel, extract_mode='pushdown', swap=True)
 
     class Meta:
         db_table = "journey_activity"
@@ -159,7 +168,7 @@ class AnalyticsPatientJourney(AnalyticsModel):
     discharge_date = models.DateField(null=True, blank=True)
     consent_date = models.DateField(null=True, blank=True)
     clinician_id = models.IntegerField(null=True, blank=True)
-    objects = FullLoadManager(table_model=StagingPatientJourneyModel)
+    objects = FullLoadManager(table_model=StagingPatientJourneyModel, extract_mode='pushdown', merge=True)
 
     class Meta:
         db_table = "patient_journey"
@@ -176,6 +185,8 @@ class AnalyticsStepResults(AnalyticsModel):
         table_model=StagingStepResultsModel,
         incremental_key='date',
         incremental_model=AnalyticsIncrementalLog,
+        extract_mode='pushdown',
+        partitions=4,
     )
 
     class Meta:
@@ -196,7 +207,7 @@ class AnalyticsSurveyResults(AnalyticsModel):
     start_time = models.DateTimeField()
     end_time = models.DateTimeField()
 
-    objects = FullLoadManager(table_model=StagingSurveyResultsModel)
+    objects = FullLoadManager(table_model=StagingSurveyResultsModel, extract_mode='pushdown', swap=True)
 
     class Meta:
         db_table = "survey_results"
@@ -255,20 +266,14 @@ class AnalyticsPatientJourneyScheduleWindow(AnalyticsModel):
             schedule_start_offset_days=F('journey_id__activities__schedule_id__schedule_window__schedule_offset_start'),
             schedule_end_offset_days=F('journey_id__activities__schedule_id__schedule_window__schedule_offset_end'),
             schedule_milestone_slug=F('journey_id__activities__schedule_id__schedule_window__schedule_milestone_slug')
-        ).values(
-            'patient_id',
-            'patient_journey_id',
-            'activity_id',
-            'activity_content_slug',
-            'schedule_id',
-            'schedule_slug',
-            'schedule_start_offset_days',
-            'schedule_end_offset_days',
-            'schedule_milestone_slug'
-        ).iterator()
-
-    objects = FullLoadQueryManager(table_model=AnalyticsPatientJourney,
-                                   query=loader_query)
+        )
+
+    objects = HashIncrementalQueryManager(table_model=AnalyticsPatientJourney,
+                                          query=loader_query,
+                                          write_mode='copy',
+                                          depends_on=[AnalyticsJourneyActivity, AnalyticsScheduleWindow],
+                                          # wide rows, batches are sized to keep their memory under 64MB
+                                          batch_memory=64 * 1024 * 1024)
 
     class Meta:
         db_table = "patient_journey_schedule_window"
@@ -0,0 +1,71 @@
+# How many rows go into each batch of a row by row load.
+# By default a fixed number of rows, set per model on its manager. Given a memory ceiling the batches are sized
+# adaptively instead: a batch is written as soon as its rows reach the ceiling, and after every commit the row
+# limit is retuned from the bytes per row and commit time measured, so narrow rows end up in big batches
+# and wide rows in small ones.
+
+import sys
+from typing import NamedTuple
+
+DEFAULT_BATCH_SIZE = 100_000
+# adaptive batches aim to commit in about this long, longer commits hold locks and memory for little gain
+TARGET_BATCH_SECONDS = 2.0
+# adaptive batches don't shrink below this many rows unless the memory ceiling is hit first
+MIN_BATCH_SIZE = 1_000
+# source rows fetched from a server side cursor at a time, django's default of 2000 means 50 round trips a batch
+DEFAULT_CHUNK_SIZE = 20_000
+# most source rows read by one micro-batch of an incremental load, run_pipeline --micro-batch polls every few seconds
+MICRO_BATCH_ROWS = 1_000
+
+
+def object_bytes(obj) -> int:
+    """Rough memory held by a model instance, its attributes and their values"""
+    values = vars(obj)
+    return sys.getsizeof(obj) + sys.getsizeof(values) + sum(sys.getsizeof(value) for value in values.values())
+
+
+class Batch(NamedTuple):
+    # model instances, or a buffer of rows encoded for COPY
+    rows: object
+    count: int
+    # bytes the rows take up, model instances are only measured when the batches are adaptive
+    size: int
+    last_key: object = None
+    # the CopyWriter that encoded the rows
+    writer: object = None
+
+
+class BatchSizer:
+    """
+    Decides when a batch is full, and with a memory ceiling (max_bytes) learns the row limit as the load goes
+    """
+
+    def __init__(self, rows: int = DEFAULT_BATCH_SIZE, max_bytes: int | None = None,
+                 target_seconds: float = TARGET_BATCH_SECONDS):
+        self.rows = rows
+        self.max_bytes = max_bytes
+        self.target_seconds = target_seconds
+
+    @classmethod
+    def of(cls, batch_size: 'int | BatchSizer') -> 'BatchSizer':
+        """A plain number of rows is a fixed batch size"""
+        return batch_size if isinstance(batch_size, BatchSizer) else cls(batch_size)
+
+    @property
+    def adaptive(self) -> bool:
+        return self.max_bytes is not None
+
+    def full(self, rows: int, size: int = 0) -> bool:
+        return rows >= self.rows or (self.adaptive and size >= self.max_bytes)
+
+    def committed(self, rows: int, size: int, seconds: float) -> None:
+        """Retune the row limit after a batch of rows taking size bytes was written in seconds"""
+        if not self.adaptive or not rows:
+            return
+        # grow gradually, a single quick commit isn't much to go on
+        limits = [self.rows * 2]
+        if size:
+            limits.append(self.max_bytes * rows // size)
+        if seconds > 0:
+            limits.append(int(self.target_seconds * rows / seconds))
+        self.rows = max(MIN_BATCH_SIZE, min(limits))
@@ -0,0 +1,21 @@
+# Loads that commit batch by batch record how far they got in the same transaction as each batch.
+# If a load fails part way the checkpoint is left behind, and `run_pipeline --resume` carries on after it
+# instead of loading everything again.
+
+from django.db import models
+
+
+class LoadCheckpoint(models.Model):
+    """
+    Last committed key of a load in progress, removed once the load finishes
+    """
+    model_name = models.CharField(max_length=255, unique=True)
+    key_field = models.CharField(max_length=255)
+    # stored as text, converted back with the key field of the model
+    last_key = models.CharField(max_length=255)
+    rows = models.BigIntegerField(default=0)
+    started = models.DateTimeField(auto_now_add=True)
+    updated = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        db_table = "load_checkpoint"
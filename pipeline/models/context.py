@@ -0,0 +1,57 @@
+# State of one run of a loader. Managers are module level singletons (Model.objects), so anything a load
+# accumulates (its log, metrics, orphans, how far it got) is kept in a LoadContext handed to populate_model,
+# and the same loader can run again, or at the same time, in a long lived process.
+# Source cursors and foreign key lookups are locals of a load already, they never outlive it,
+# unless the foreign key indexes are shared between the runs of a long lived process with key_indexes.
+
+from dataclasses import dataclass, field
+
+from .integrity import IntegrityReport
+from .metrics import LoadMetrics
+
+
+@dataclass
+class LoadContext:
+    log: list = field(default_factory=list)
+    # timings and row counts of each stage of the load
+    metrics: LoadMetrics = field(default_factory=LoadMetrics)
+    # orphaned foreign keys, counted per field with a sample of the keys
+    integrity: IntegrityReport = field(default_factory=IntegrityReport)
+    # carry on after the checkpoint of a failed load instead of starting over
+    resume: bool = False
+    # how source rows map onto output rows, worked out on the first row of a load
+    row_plan: object = None
+    # set while a full load is writing to a shadow table instead of the model's table
+    write_table: str | None = None
+    # KeyIndexCache shared by the runs of a long lived process
+    key_indexes: object = None
+
+    def fork(self) -> 'LoadContext':
+        """A context for part of the same load running at the same time, merged back in afterwards"""
+        return LoadContext(integrity=self.integrity.fork(), resume=self.resume, write_table=self.write_table,
+                           key_indexes=self.key_indexes)
+
+    def merge(self, other: 'LoadContext') -> None:
+        self.log += other.log
+        self.metrics.merge(other.metrics)
+        self.integrity.merge(other.integrity)
+
+
+class ContextAttribute:
+    """An attribute of a loader kept in its current LoadContext"""
+
+    def __set_name__(self, owner, name):
+        self.name = name
+
+    def __get__(self, loader, owner=None):
+        if loader is None:
+            return self
+        return getattr(loader.context, self.name)
+
+    def __set__(self, loader, value):
+        setattr(loader.context, self.name, value)
+
+
+def collect_metrics(contexts: dict) -> dict[str, LoadMetrics]:
+    """Metrics of the loads of a run that did something, by model name"""
+    return {model.__name__: context.metrics for model, context in contexts.items() if context.metrics.stages}
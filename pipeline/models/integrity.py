@@ -0,0 +1,104 @@
+# Foreign keys pointing at rows the related table doesn't have (orphans) are loaded as null.
+# Instead of keeping every offending row, loaders count the orphans of each field and keep a small sample of
+# their keys, so memory stays flat however dirty the source is.
+# Every orphaned key can be spilled to a gzipped file as well, with run_pipeline --orphans-dir.
+
+import gzip
+import threading
+
+# orphaned keys kept per field to show in the report
+ORPHAN_SAMPLE_SIZE = 10
+
+
+class FieldOrphans:
+    __slots__ = ('count', 'sample')
+
+    def __init__(self):
+        self.count = 0
+        self.sample = []
+
+    def as_dict(self) -> dict:
+        return {'orphans': self.count, 'sample': list(self.sample)}
+
+
+class OrphanSpill:
+    """
+    Writes orphaned keys to a gzipped file, a field<TAB>key line each. Shared by the threads loading a table.
+    The file is replaced on the first key, and appended to after each close, gzip files can be appended to
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.file = None
+        self.started = False
+        self.lock = threading.Lock()
+
+    def write(self, field_name: str, key) -> None:
+        with self.lock:
+            if self.file is None:
+                self.file = gzip.open(self.path, 'at' if self.started else 'wt', encoding='utf-8')
+                self.started = True
+            self.file.write(f"{field_name}\t{key}\n")
+
+    def close(self) -> None:
+        with self.lock:
+            if self.file is not None:
+                self.file.close()
+                self.file = None
+
+
+class IntegrityReport:
+    """
+    Orphaned foreign keys of one loader for one run, per field of the output model
+    """
+
+    def __init__(self, sample_size: int = ORPHAN_SAMPLE_SIZE, spill: OrphanSpill | None = None):
+        self.fields: dict[str, FieldOrphans] = {}
+        self.sample_size = sample_size
+        self.spill = spill
+
+    def get(self, field_name: str) -> FieldOrphans:
+        if field_name not in self.fields:
+            self.fields[field_name] = FieldOrphans()
+        return self.fields[field_name]
+
+    def orphan(self, field_name: str, key) -> None:
+        """Record an orphaned key of a row"""
+        orphans = self.get(field_name)
+        orphans.count += 1
+        if len(orphans.sample) < self.sample_size:
+            orphans.sample.append(key)
+        if self.spill is not None:
+            self.spill.write(field_name, key)
+
+    def add_orphans(self, field_name: str, count: int) -> None:
+        """Record orphans counted in the database, their keys never come through python"""
+        self.get(field_name).count += count
+
+    def counts(self) -> dict[str, int]:
+        return {name: orphans.count for name, orphans in self.fields.items()}
+
+    def fork(self) -> 'IntegrityReport':
+        """An empty report sharing the spill file, for a loader loading part of the same table at the same time"""
+        return IntegrityReport(self.sample_size, self.spill)
+
+    def merge(self, other: 'IntegrityReport') -> None:
+        for name, other_orphans in other.fields.items():
+            orphans = self.get(name)
+            orphans.count += other_orphans.count
+            orphans.sample.extend(other_orphans.sample[:self.sample_size - len(orphans.sample)])
+
+    def close(self) -> None:
+        if self.spill is not None:
+            self.spill.close()
+
+    def as_dict(self) -> dict:
+        return {name: orphans.as_dict() for name, orphans in self.fields.items()}
+
+    def __bool__(self) -> bool:
+        return bool(self.fields)
+
+    def __str__(self) -> str:
+        # set based loads count their orphans without seeing the keys
+        return ', '.join(f"{name}: {orphans.count} orphaned" + (f", e.g. {orphans.sample}" if orphans.sample else '')
+                         for name, orphans in self.fields.items())
@@ -1,9 +1,24 @@
-from django.db import models, transaction
-from typing import Iterable
-from django.db.models import Field, F
+from django.db import models, transaction, connections
+from typing import Iterable, Iterator, NamedTuple
+from django.db.models import Field, F, Func, Count, Sum
 from abc import ABC, abstractmethod
-
+from array import array
+from bisect import bisect_left
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from .pgcopy import CopyWriter, copy_from, copy_to, COPY_SPOOL_SIZE
+from .batching import Batch, BatchSizer, DEFAULT_BATCH_SIZE, DEFAULT_CHUNK_SIZE, MICRO_BATCH_ROWS, object_bytes
+from .checkpoints import LoadCheckpoint
+from .context import ContextAttribute, LoadContext
+from .pipelining import run_pipelined
+from .shadow import swap_blocker, create_shadow_table, build_shadow_table, swap_tables
+from .transformers import BatchTransformer, TransformerChain
+
+import copy
+import functools
+import itertools
 import logging
+import tempfile
+import threading
 import time
 import re
 
@@ -35,6 +50,14 @@ class ColumnTransformer(ABC):
         """
         pass
 
+    @classmethod
+    def transform_many(cls, values: Iterable) -> list:
+        """
+        Transform a batch of input values, returns the output of transform for each of them in order.
+        Override when a batch can be transformed more cheaply than one value at a time
+        """
+        return [cls.transform(value) for value in values]
+
 
 class ScheduleWindowTransformer(ColumnTransformer):
     SLUG_REGEX = re.compile(
@@ -47,7 +70,7 @@ class ScheduleWindowTransformer(ColumnTransformer):
 
     @property
     def output_fields(self) -> list:
-        return ['id', 'schedule', 'schedule_offset_start', 'schedule_offset_end', 'schedule_milestone_slug']
+        return ['id', 'schedule_id', 'schedule_offset_start', 'schedule_offset_end', 'schedule_milestone_slug']
 
     @staticmethod
     def convert_to_days(s: str) -> int | None:
@@ -90,7 +113,7 @@ class ScheduleWindowTransformer(ColumnTransformer):
     @classmethod
     def process_slug(cls, slug: str) -> dict:
 
-        if res := re.search(cls.SLUG_REGEX, slug):
+        if res := cls.SLUG_REGEX.search(slug):
             # extract by position
             start, end, identifier = res.groups()
             offset_sign = cls.extract_offset_sign(identifier)
@@ -114,84 +137,618 @@ class ScheduleWindowTransformer(ColumnTransformer):
 
         return {}
 
+    @classmethod
+    @functools.lru_cache(maxsize=4096)
+    def parse_slug(cls, slug: str) -> dict:
+        """
+        process_slug, memoised as schedules reuse a small set of slugs.
+        The result is shared between callers, don't modify it
+        """
+        return cls.process_slug(slug)
+
     @classmethod
     def transform(cls, slug: str) -> dict:
 
-        return cls.process_slug(slug)
+        return cls.parse_slug(slug)
 
+    @classmethod
+    def transform_many(cls, slugs: Iterable[str]) -> list[dict]:
+        """
+        Each distinct slug in the batch is parsed once, so the cost follows the number of distinct slugs
+        """
+        slugs = list(slugs)
+        parsed = {slug: cls.parse_slug(slug) for slug in set(slugs)}
+        return [parsed[slug] for slug in slugs]
+
+
+class KeyIndex:
+    """
+    Sorted array of integer keys for foreign key checks.
+    Costs 8 bytes a key, where a set costs a python object per key
+    """
+    __slots__ = ('keys',)
+
+    def __init__(self, sorted_keys: Iterable[int]):
+        self.keys = array('q', sorted_keys)
+
+    def __contains__(self, key) -> bool:
+        if not isinstance(key, int):
+            return False
+        position = bisect_left(self.keys, key)
+        return position < len(self.keys) and self.keys[position] == key
+
+    def __len__(self) -> int:
+        return len(self.keys)
+
+
+def build_key_index(model, field: models.Field) -> KeyIndex | frozenset:
+    """Index of the keys of a related model, only the key column is fetched"""
+    keys = model.objects.order_by(field.name).values_list(field.name, flat=True).iterator(chunk_size=100_000)
+    if isinstance(field, models.IntegerField):
+        return KeyIndex(keys)
+    return frozenset(keys)
+
+
+class KeyHash(Func):
+    """64 bit hash of a key, whatever its type"""
+    template = "hashtextextended(%(expressions)s::text, 0)"
+    output_field = models.BigIntegerField()
+
+
+class KeyIndexCache:
+    """
+    Foreign key indexes kept between the runs of a long lived process. An index is reused as long as the related
+    table has the same keys, checked with a count and checksum of the key column worked out in the database,
+    which is a lot cheaper than fetching every key again
+    """
 
-class DataLoader(models.Manager):
     def __init__(self):
+        self.indexes = {}
+        self.lock = threading.Lock()
+
+    def get(self, model, field: models.Field) -> KeyIndex | frozenset:
+        # taken before the index is built, if the table changes in between the next check rebuilds it
+        fingerprint = model.objects.aggregate(rows=Count('*'), checksum=Sum(KeyHash(field.name)))
+        with self.lock:
+            cached = self.indexes.get((model, field.name))
+        if cached is not None and cached[0] == fingerprint:
+            return cached[1]
+        index = build_key_index(model, field)
+        with self.lock:
+            self.indexes[(model, field.name)] = (fingerprint, index)
+        return index
+
+
+class DataLoader(models.Manager):
+    # bulk_create builds a model instance per row, copy streams rows with COPY ... FROM STDIN
+    WRITE_MODES = ('bulk_create', 'copy')
+    # values pulls source rows through python as dicts,
+    # copy streams them table to table with COPY TO / COPY FROM,
+    # pushdown runs a single INSERT ... SELECT when source and destination share a database
+    EXTRACT_MODES = ('values', 'copy', 'pushdown')
+
+    # state of the current load, kept in its LoadContext
+    log = ContextAttribute()
+    metrics = ContextAttribute()
+    integrity = ContextAttribute()
+    resume = ContextAttribute()
+    row_plan = ContextAttribute()
+    write_table = ContextAttribute()
+
+    def __init__(self, write_mode='bulk_create', extract_mode='values', batch_size=DEFAULT_BATCH_SIZE,
+                 batch_memory=None, pipelined=True, chunk_size=DEFAULT_CHUNK_SIZE,
+                 transformers: Iterable[BatchTransformer] = ()):
         super().__init__()
-        self.log = []
+        if write_mode not in self.WRITE_MODES:
+            raise ValueError(f"Unknown write mode {write_mode!r}, expected one of {self.WRITE_MODES}")
+        if extract_mode not in self.EXTRACT_MODES:
+            raise ValueError(f"Unknown extract mode {extract_mode!r}, expected one of {self.EXTRACT_MODES}")
+        # cleansing steps run over the rows in the build stage, a batch at a time
+        self.transformers = TransformerChain(transformers)
+        if self.transformers:
+            # copy and pushdown loads don't bring rows into python, a loader with transformers reads its rows
+            # with the values extract mode whatever it was given, the other loaders keep theirs
+            extract_mode = 'values'
+        self.write_mode = write_mode
+        self.extract_mode = extract_mode
+        # rows per batch of a row by row load, or with batch_memory (bytes) the most rows to start with,
+        # batches are then sized adaptively to stay under it
+        self.batch_size = batch_size
+        self.batch_memory = batch_memory
+        # read, build and write batches on separate threads at the same time
+        self.pipelined = pipelined
+        # source rows fetched from the server side cursor at a time
+        self.chunk_size = chunk_size
+        # models this loader reads from beyond its foreign keys, used to schedule the pipeline
+        self.depends_on = []
+        # refresh rows that are already loaded instead of failing on the primary key
+        self.upsert = False
+        # loads that commit in batches of rows ordered by this field record it in a LoadCheckpoint with every batch.
+        # only row by row loads do, set based loads commit in one transaction and partitioned ones move the
+        # incremental log as their key ranges commit, there is nothing for them to resume from
+        self.checkpoint_key = None
+        # state of the load, used by loads run without a context of their own
+        self.context = LoadContext()
+
+    def populate_model(self, context: LoadContext | None = None, **options):
+        """
+        Load the model, returns the log of the load. Everything the load keeps track of goes into context,
+        so the same loader can run again, or at the same time, each run with a context of its own.
+        Without one, the manager's own context is used and carries over from one load to the next
+        """
+        loader = self if context is None else self.in_context(context)
+        return loader.load(**options)
+
+    def load(self, **options):
+        raise NotImplementedError(f"{type(self).__name__} doesn't load anything by itself")
+
+    def in_context(self, context: LoadContext) -> 'DataLoader':
+        """A copy of this loader keeping the state of its load in context"""
+        loader = copy.copy(self)
+        loader.context = context
+        return loader
+
+    def get_source_fields(self) -> list[str]:
+        """Get all non-auto-created, non relation fields from the source model"""
+        return [
+            f.name for f in self.table_model._meta.get_fields()
+            if isinstance(f, Field) and (not f.auto_created and not f.is_relation)
+            # row_hash is bookkeeping for the loader of the source table, it is not data
+            and f.name != 'row_hash'
+        ]
+
+    def source_rows(self, queryset) -> Iterator[tuple]:
+        """
+        Stream the source fields of a queryset as tuples, in the order of get_source_fields.
+        Rows come from a server side cursor, chunk_size at a time
+        """
+        return queryset.values_list(*self.get_source_fields()).iterator(chunk_size=self.chunk_size)
+
+    def row_fields(self) -> list[str]:
+        """Fields of the rows that are built, the source fields followed by any the transformers add"""
+        return self.transformers.fields(self.get_source_fields())
 
     @staticmethod
-    def make_related_fields_lookup(related_fields_for_model) -> dict:
+    def make_related_fields_lookup(related_fields_for_model, key_indexes: KeyIndexCache | None = None) -> dict:
         """
-        # Make a dictionary with related fields for fast lookup in batch loading
-        # This makes a massive memory vs performance trade off
+        # Make an index of the keys of each related model for fast lookup in batch loading
+        # Only the key column is fetched, foreign keys are then assigned by id
+        # Indexes from key_indexes are reused while the related table hasn't changed
         """
         related_lookup = {}
         for field in related_fields_for_model:
             if field.many_to_many:
                 continue
-            related_column_name = field.related_fields[0][1].name
-            related_objs = list(field.related_model.objects.all())
-            model_id_to_native_instance = {getattr(obj, related_column_name): obj for obj in related_objs}
-            related_lookup[field.related_model.__name__] = model_id_to_native_instance
+            related_field = field.related_fields[0][1]
+            if key_indexes is not None:
+                related_lookup[field.related_model.__name__] = key_indexes.get(field.related_model, related_field)
+            else:
+                related_lookup[field.related_model.__name__] = build_key_index(field.related_model, related_field)
 
         return related_lookup
 
-    def build_output_object(self,
-                            instance: dict,
-                            related_fields_for_model: list[models.Field],
-                            related_field_lookup: dict) -> models.Model:
+    def relation_source_fields(self, related_fields_for_model: list[models.Field]) -> list[tuple[models.Field, str]]:
+        """Each foreign key of the output model with the source field holding its key"""
+        return [(fld, fld.name) for fld in related_fields_for_model if not fld.many_to_many]
+
+    def batch_related_lookup(self, related_fields_for_model: list[models.Field], rows: list[tuple]) -> dict:
+        """
+        Same as make_related_fields_lookup, but only with the keys the rows point at, a query for each foreign key.
+        For a handful of rows that's a lot cheaper than indexing every key of the related tables
+        """
+        source_fields = self.get_source_fields()
+        related_lookup = {}
+        for fld, source_field in self.relation_source_fields(related_fields_for_model):
+            index = source_fields.index(source_field)
+            keys = {row[index] for row in rows if row[index] is not None}
+            related_field = fld.related_fields[0][1].name
+            related_lookup[fld.related_model.__name__] = frozenset(
+                fld.related_model.objects.filter(**{f"{related_field}__in": keys}).values_list(related_field, flat=True)
+            )
+        return related_lookup
+
+    def batch_sizer(self) -> BatchSizer:
+        return BatchSizer(self.batch_size, self.batch_memory)
+
+    def bulk_create_options(self) -> dict:
+        if not self.upsert:
+            return {'ignore_conflicts': False}
+        pk = self.model._meta.pk
+        return {
+            'update_conflicts': True,
+            'unique_fields': [pk.name],
+            'update_fields': [f.name for f in self.model._meta.concrete_fields if f is not pk],
+        }
+
+    def destination_table(self) -> str:
+        """The (unquoted) table rows are written to"""
+        return self.write_table or self.model._meta.db_table
+
+    def get_checkpoint(self) -> LoadCheckpoint | None:
+        """The checkpoint a failed load of this model left behind"""
+        if not self.checkpoint_key:
+            return None
+        return LoadCheckpoint.objects.filter(model_name=self.model.__name__).first()
+
+    def resume_from(self):
+        """
+        The key to carry on from after a failed load if it should be resumed, otherwise None.
+        Keys don't have to be unique, so rows with the last committed key are removed and loaded again.
+        A checkpoint that isn't resumed is cleared along with what the failed load committed
+        """
+        checkpoint = self.get_checkpoint()
+        if checkpoint is None:
+            return None
+        if not self.resume or checkpoint.key_field != self.checkpoint_key:
+            logger.info(f"Discarding the checkpoint of an unfinished load of {self.model.__name__}")
+            with transaction.atomic(using=self.db):
+                self.discard_partial_load()
+                checkpoint.delete()
+            return None
+
+        last_key = self.model._meta.get_field(self.checkpoint_key).to_python(checkpoint.last_key)
+        logger.info(f"Resuming {self.model.__name__} from {self.checkpoint_key} {last_key}, "
+                    f"{checkpoint.rows} rows were already loaded")
+        self.model.objects.filter(**{f"{self.checkpoint_key}__gte": last_key}).delete()
+        return last_key
+
+    def discard_partial_load(self) -> None:
+        """Undo the batches a failed load committed, when it isn't resumed"""
+        pass
 
+    def save_checkpoint(self, last_key, rows: int) -> None:
+        """Record the last key of a batch, call inside the transaction that writes the batch"""
+        if not self.checkpoint_key:
+            return
+        checkpoint, created = LoadCheckpoint.objects.get_or_create(
+            model_name=self.model.__name__,
+            defaults={'key_field': self.checkpoint_key, 'last_key': str(last_key), 'rows': rows})
+        if not created:
+            checkpoint.last_key = str(last_key)
+            checkpoint.rows += rows
+            checkpoint.save()
+
+    def clear_checkpoint(self) -> None:
+        if self.checkpoint_key:
+            LoadCheckpoint.objects.filter(model_name=self.model.__name__).delete()
+
+    def on_conflict_sql(self, columns: list[str]) -> str:
+        """
+        ON CONFLICT clause for INSERTs of the given (quoted) columns, updates the loaded row in place
+        """
+        if not self.upsert:
+            return ''
+        quote_name = connections[self.db].ops.quote_name
+        pk_column = quote_name(self.model._meta.pk.column)
+        updates = ', '.join(f"{column} = EXCLUDED.{column}" for column in columns if column != pk_column)
+        return f" ON CONFLICT ({pk_column}) DO UPDATE SET {updates}"
+
+    def copy_statements(self, columns: list[str]) -> tuple[list[str], str, list[str]]:
+        """
+        SQL to COPY rows into the destination table: statements to run before the COPY, the COPY and statements
+        to run after it. COPY can't handle conflicts, so upserts go through a temporary table and an
+        INSERT ... ON CONFLICT
+        """
+        quote_name = connections[self.db].ops.quote_name
+        table = quote_name(self.destination_table())
+        column_list = ', '.join(columns)
+        if not self.upsert:
+            return [], f"COPY {table} ({column_list}) FROM STDIN", []
+
+        staged = quote_name(f"{self.model._meta.db_table}_upsert")
+        return (
+            [f"DROP TABLE IF EXISTS {staged}",
+             f"CREATE TEMPORARY TABLE {staged} (LIKE {table} INCLUDING DEFAULTS)"],
+            f"COPY {staged} ({column_list}) FROM STDIN",
+            [f"INSERT INTO {table} ({column_list}) SELECT {column_list} FROM {staged}{self.on_conflict_sql(columns)}",
+             f"DROP TABLE {staged}"],
+        )
+
+    def copy_into_destination(self, cursor, columns: list[str], stream) -> None:
+        """COPY rows into the destination table"""
+        before, copy_sql, after = self.copy_statements(columns)
+        for sql in before:
+            cursor.execute(sql)
+        copy_from(cursor, copy_sql, stream)
+        for sql in after:
+            cursor.execute(sql)
+
+    def make_row_plan(self, related_fields_for_model: list[models.Field]) -> list[str]:
+        """Keyword argument of the output model for each source field"""
+        related = {fld.name for fld in related_fields_for_model if not fld.many_to_many}
+        # add _id suffix to assign the foreign key without fetching the related object
+        return [f"{name}_id" if name in related else name for name in self.row_fields()]
+
+    def build_output_values(self,
+                            instance: tuple,
+                            related_fields_for_model: list[models.Field],
+                            related_field_lookup: dict) -> dict | None:
+        """
+        Map a source row to the keyword arguments of the output model, or None to skip the row
+        """
+        if self.row_plan is None:
+            self.row_plan = self.make_row_plan(related_fields_for_model)
+        output = dict(zip(self.row_plan, instance))
         for fld in related_fields_for_model:
             if fld.many_to_many:
                 continue
-            related_model_name = fld.related_model.__name__
-            try:
-                related_obj = related_field_lookup[related_model_name][instance[fld.name]]
-            except KeyError as e:
+            key = f"{fld.name}_id"
+            if output[key] not in related_field_lookup.get(fld.related_model.__name__, ()):
                 # Looks like we have an integrity problem, set to null
-                error_log = ('Missing Value', fld.name, instance)
-                self.log.append(error_log)
-                related_obj = None
-            instance[fld.name] = related_obj
-        return self.model(**instance)
+                self.integrity.orphan(fld.name, output[key])
+                output[key] = None
+        return output
+
+    def build_output_object(self,
+                            instance: tuple,
+                            related_fields_for_model: list[models.Field],
+                            related_field_lookup: dict) -> models.Model | None:
+
+        output = self.build_output_values(instance, related_fields_for_model, related_field_lookup)
+        if output is None:
+            return None
+        return self.model(**output)
 
     def batch_loader(self,
-                     batch_size: int,
+                     batch_size: int | BatchSizer,
                      first: dict,
                      instances_to_load: Iterable,
                      related_field_lookup: dict,
                      related_fields_for_model: list) -> None:
-        batch = [self.build_output_object(first, related_fields_for_model, related_field_lookup)]
-
-        batch_counter = 1
-        record_counter = 1
+        """
+        Build the rows and write them in batches, each in a transaction of its own.
+        Pipelined loaders write on another thread while the next batches are read and built, unless the load
+        is part of a bigger transaction, which the other thread's connection couldn't see into
+        """
+        batches = BatchSizer.of(batch_size)
+        self.row_plan = None
+        if self.write_mode == 'copy':
+            build_batches = functools.partial(self.build_copy_batches, batches, connections[self.db],
+                                              related_fields_for_model, related_field_lookup)
+        else:
+            build_batches = functools.partial(self.build_batches, batches, related_fields_for_model,
+                                              related_field_lookup)
+        # stages filled in from the other threads are created up front
+        built, _ = self.metrics.get('build'), self.metrics.get('write')
+        loaded_before = built.rows
+        orphans_before = self.integrity.counts()
+
+        def build(rows: Iterator[tuple]) -> Iterator[Batch]:
+            for batch in build_batches(self.transform_rows(rows, batches)):
+                built.rows += batch.count
+                yield batch
+
+        rows = itertools.chain([first], self.metrics.timed_rows('source_query', instances_to_load, self.chunk_size))
+        try:
+            if self.pipelined and not connections[self.db].in_atomic_block:
+                built.seconds += run_pipelined(rows, build, functools.partial(self.commit_batch, batches))
+            else:
+                with self.metrics.stage('build', exclude=['source_query', 'write']):
+                    for batch in build(rows):
+                        self.commit_batch(batches, batch)
+        finally:
+            self.integrity.close()
+
+        # same as the set based loads, the orphans of each field are logged as a count
+        for field_name, count in self.integrity.counts().items():
+            if orphans := count - orphans_before.get(field_name, 0):
+                self.log.append(('Missing Values', field_name, orphans))
+        record_counter = built.rows - loaded_before
+        logger.info(f"{self.model.__name__} Loaded {record_counter} records.")
+        self.log.append(("Loaded Values", self.model.__name__, record_counter))
 
-        # load in batches using atomic transactions for safety
-        for obj in instances_to_load:
+    def transform_rows(self, rows: Iterator[tuple], batches: BatchSizer) -> Iterator:
+        """Change the source rows before they are built, done in the build stage"""
+        if not self.transformers:
+            return rows
+        return self.transformers.transform_rows(rows, self.get_source_fields())
+
+    def build_batches(self,
+                      batches: BatchSizer,
+                      related_fields_for_model: list,
+                      related_field_lookup: dict,
+                      rows: Iterable[tuple]) -> Iterator[Batch]:
+        """Model instances of the rows, in batches as big as the sizer allows"""
+        batch, size = [], 0
+        for obj in rows:
             output_model = self.build_output_object(obj, related_fields_for_model, related_field_lookup)
             if not output_model:
                 continue
             batch.append(output_model)
-            record_counter += 1
-            if len(batch) >= batch_size:
-                logger.info(f"Inserting batch {batch_counter}: {len(batch)} records.")
-                with transaction.atomic():
-                    self.model.objects.bulk_create(batch, ignore_conflicts=False)
-                batch_counter += 1
-                batch = []
-
+            if batches.adaptive:
+                # memory of the batch is only measured when it decides the batch size
+                size += object_bytes(output_model)
+            if batches.full(len(batch), size):
+                yield Batch(batch, len(batch), size)
+                batch, size = [], 0
         if batch:
-            logger.info(f"Inserting last batch: {len(batch)} records.")
-            with transaction.atomic():
-                self.model.objects.bulk_create(batch, ignore_conflicts=False)
+            yield Batch(batch, len(batch), size)
+
+    def build_copy_batches(self,
+                           batches: BatchSizer,
+                           connection,
+                           related_fields_for_model: list,
+                           related_field_lookup: dict,
+                           rows: Iterable[tuple]) -> Iterator[Batch]:
+        """
+        Same batching as build_batches, but the rows are encoded for COPY FROM STDIN,
+        skipping model instantiation entirely
+        """
+        writer = None
+        last_key = None
+        for obj in rows:
+            output = self.build_output_values(obj, related_fields_for_model, related_field_lookup)
+            if not output:
+                continue
+            if writer is None:
+                writer = CopyWriter(self.model, output, connection, load=self.copy_into_destination)
+            writer.write(output)
+            last_key = output.get(self.checkpoint_key)
+            # the encoded rows waiting in the buffer are what the batch holds in memory
+            if batches.full(writer.row_count, writer.buffer.tell()):
+                size = writer.buffer.tell()
+                yield Batch(*writer.detach(), size, last_key, writer)
+        if writer and writer.row_count:
+            size = writer.buffer.tell()
+            yield Batch(*writer.detach(), size, last_key, writer)
+
+    def commit_batch(self, batches: BatchSizer, batch: Batch) -> None:
+        """Write a batch, and tell the sizer how long it took"""
+        logger.info(f"{'Copying' if batch.writer else 'Inserting'} batch of {batch.count} records.")
+        start = time.perf_counter()
+        if batch.writer:
+            self.write_copy_batch(batch)
+        else:
+            self.write_batch(batch.rows)
+        batches.committed(batch.count, batch.size, time.perf_counter() - start)
+
+    def write_batch(self, batch: list[models.Model]) -> None:
+        with self.metrics.batch('write') as write, transaction.atomic():
+            self.model.objects.bulk_create(batch, **self.bulk_create_options())
+            if self.checkpoint_key:
+                self.save_checkpoint(getattr(batch[-1], self.checkpoint_key), len(batch))
+            write.rows += len(batch)
+
+    def write_copy_batch(self, batch: Batch) -> None:
+        with self.metrics.batch('write') as write, transaction.atomic(using=self.db):
+            write.bytes += batch.size
+            # on the connection of the thread writing, which may not be the one the rows were built on
+            batch.writer.copy_buffer(batch.rows, connections[self.db])
+            self.save_checkpoint(batch.last_key, batch.count)
+            write.rows += batch.count
+
+    def copy_extract(self, queryset, stream, fields=None) -> int:
+        """
+        Write the source rows of a queryset to a binary stream with COPY (SELECT ...) TO STDOUT
+        Returns the number of rows extracted
+        """
+        source_connection = connections[queryset.db]
+        sql, params = queryset.values_list(*(fields or self.get_source_fields())).query.sql_with_params()
+        select = source_connection.ops.compose_sql(sql, params)
+        with self.metrics.stage('source_query') as extract, source_connection.cursor() as cursor:
+            start = stream.tell()
+            rows = copy_to(cursor, f"COPY ({select}) TO STDOUT", stream)
+            extract.rows += rows
+            extract.bytes += stream.tell() - start
+        return rows
+
+    def copy_load(self, stream, fields=None) -> None:
+        """
+        Load the output of copy_extract into the destination table with COPY FROM STDIN
+        """
+        connection = connections[self.db]
+        quote_name = connection.ops.quote_name
+        columns = [quote_name(self.model._meta.get_field(name).column) for name in (fields or self.get_source_fields())]
+        stream.seek(0)
+        with connection.cursor() as cursor:
+            self.copy_into_destination(cursor, columns, stream)
+
+    def copy_pipeline(self, queryset, replace=False, fields=None) -> int:
+        """
+        Table to table copy of a source queryset, the rows never become python objects.
+        With replace the destination is cleared in the same transaction as the load.
+        Returns the number of rows loaded
+        """
+        logger.info(f"Executing {self.LOAD_TYPE} for {self.model.__name__} with COPY")
+        start = time.time()
+
+        with tempfile.SpooledTemporaryFile(max_size=COPY_SPOOL_SIZE) as stream:
+            record_counter = self.copy_extract(queryset, stream, fields)
+            if not record_counter:
+                return 0
+            with self.metrics.batch('write') as write, transaction.atomic(using=self.db):
+                if replace:
+                    self.model.objects.all().delete()
+                self.copy_load(stream, fields)
+                write.rows += record_counter
+                write.bytes += stream.tell()
+
+        logger.info(f"{self.model.__name__} Loaded {record_counter} records.")
+        self.log.append(("Loaded Values", self.model.__name__, record_counter))
+        duration = (time.time() - start)
+        logger.info(f"{self.model.__name__} took: {duration:.2f} seconds")
+        return record_counter
+
+    def pushdown_sql(self, queryset) -> tuple[str, str, list]:
+        """
+        Compile the load into an INSERT INTO ... SELECT over the source queryset.
+        Foreign keys are LEFT JOINed to the related table so orphans come out as null,
+        the same as build_output_values does.
+        Returns the insert, a query counting orphans per foreign key and the params for both
+        """
+        connection = connections[self.db]
+        quote_name = connection.ops.quote_name
+        source_fields = self.get_source_fields()
+        source_sql, params = queryset.values_list(*source_fields).query.sql_with_params()
+        source_columns = {name: self.table_model._meta.get_field(name).column for name in source_fields}
+
+        columns, select, joins, orphan_counts = [], [], [], []
+        for fld in self.model._meta.concrete_fields:
+            if fld.name not in source_columns:
+                # auto ids and anything else not in the source are left to their defaults
+                continue
+            source_column = f"source.{quote_name(source_columns[fld.name])}"
+            columns.append(quote_name(fld.column))
+            if fld.is_relation:
+                alias = quote_name(f"related_{len(joins)}")
+                target = f"{alias}.{quote_name(fld.target_field.column)}"
+                joins.append(f"LEFT JOIN {quote_name(fld.related_model._meta.db_table)} AS {alias} "
+                             f"ON {target} = {source_column}")
+                select.append(target)
+                orphan_counts.append(f"COUNT(*) FILTER (WHERE {source_column} IS NOT NULL AND {target} IS NULL)")
+            else:
+                select.append(source_column)
+
+        source = f"({source_sql}) AS source {' '.join(joins)}"
+        insert_sql = (f"INSERT INTO {quote_name(self.destination_table())} ({', '.join(columns)}) "
+                      f"SELECT {', '.join(select)} FROM {source}{self.on_conflict_sql(columns)}")
+        orphan_sql = f"SELECT {', '.join(orphan_counts)} FROM {source}" if orphan_counts else ''
+        return insert_sql, orphan_sql, list(params)
+
+    def pushdown_pipeline(self, queryset, replace=False) -> int:
+        """
+        Load the destination from a source queryset in the same database entirely server side.
+        With replace the destination is cleared in the same transaction as the load.
+        Returns the number of rows loaded
+        """
+        if queryset.db != self.db:
+            raise ValueError(f"Can't push down {self.model.__name__}, "
+                             f"the source is in {queryset.db} and the destination in {self.db}")
+        logger.info(f"Executing {self.LOAD_TYPE} for {self.model.__name__} in the database")
+        start = time.time()
+
+        if not queryset.exists():
+            return 0
+
+        insert_sql, orphan_sql, params = self.pushdown_sql(queryset)
+        related_fields_for_model = [fld for fld in self.model._meta.concrete_fields
+                                    if fld.is_relation and fld.name in self.get_source_fields()]
+        with transaction.atomic(using=self.db):
+            if replace:
+                self.model.objects.all().delete()
+            with connections[self.db].cursor() as cursor:
+                if orphan_sql:
+                    cursor.execute(orphan_sql, params)
+                    for fld, orphans in zip(related_fields_for_model, cursor.fetchone()):
+                        if orphans:
+                            self.integrity.add_orphans(fld.name, orphans)
+                            self.log.append(('Missing Values', fld.name, orphans))
+                with self.metrics.batch('pushdown') as pushdown:
+                    cursor.execute(insert_sql, params)
+                    record_counter = cursor.rowcount
+                    pushdown.rows += record_counter
+
         logger.info(f"{self.model.__name__} Loaded {record_counter} records.")
         self.log.append(("Loaded Values", self.model.__name__, record_counter))
+        duration = (time.time() - start)
+        logger.info(f"{self.model.__name__} took: {duration:.2f} seconds")
+        return record_counter
+
+    def set_based_pipeline(self, queryset, replace=False) -> int:
+        """Load a source queryset without building python rows, using the extract mode of this loader"""
+        if self.extract_mode == 'pushdown':
+            return self.pushdown_pipeline(queryset, replace)
+        return self.copy_pipeline(queryset, replace)
 
     def execute_pipeline(self, first_instance, instances_to_load: Iterable) -> None:
 
@@ -200,10 +757,13 @@ class DataLoader(models.Manager):
         related_fields_for_model = [fld for fld in self.model._meta.get_fields() if
                                     fld.is_relation and not fld.auto_created]
 
-        related_field_lookup = self.make_related_fields_lookup(related_fields_for_model)
+        with self.metrics.stage('related_lookup') as lookup:
+            related_field_lookup = self.make_related_fields_lookup(related_fields_for_model,
+                                                                   self.context.key_indexes)
+            lookup.rows += sum(len(keys) for keys in related_field_lookup.values())
 
         self.batch_loader(
-            100_000,
+            self.batch_sizer(),
             first_instance,
             instances_to_load,
             related_field_lookup,
@@ -217,36 +777,195 @@ class DataLoader(models.Manager):
 class FullLoadManager(DataLoader):
     LOAD_TYPE = "Full Load"
 
-    def __init__(self, table_model):
-        super().__init__()
+    def __init__(self, table_model, write_mode='bulk_create', extract_mode='values', swap=False, merge=False,
+                 batch_size=DEFAULT_BATCH_SIZE, batch_memory=None, pipelined=True, chunk_size=DEFAULT_CHUNK_SIZE,
+                 transformers=()):
+        super().__init__(write_mode=write_mode, extract_mode=extract_mode, batch_size=batch_size,
+                         batch_memory=batch_memory, pipelined=pipelined, chunk_size=chunk_size,
+                         transformers=transformers)
         self.table_model = table_model
-
-    def full_load_query(self):
+        # load into a shadow table and swap it in, readers keep seeing the old rows until the swap
+        self.swap = swap
+        # load into a shadow table and merge it into the destination by primary key, for tables other tables
+        # reference, their foreign keys keep pointing at the rows that stay
+        self.merge = merge
+        if (swap or merge) and write_mode == 'bulk_create' and self.extract_mode == 'values':
+            raise ValueError("Swap and merge loads need the copy write mode or a set based extract mode, "
+                             "bulk_create can only write to the model's own table")
+        # only row by row loads commit in batches, set based, swap and merge loads are all or nothing
+        if self.extract_mode == 'values' and not swap and not merge:
+            self.checkpoint_key = table_model._meta.pk.name
+
+    def full_load_queryset(self):
+        return self.table_model.objects.all()
+
+    def full_load_query(self, resume_from=None):
         """
         Query for full table load
         """
-        source_fields = [
-            f.name for f in self.table_model._meta.get_fields()
-            if isinstance(f, Field) and (not f.auto_created and not f.is_relation)
-        ]
-        # Fetch all records from unmanaged source as a generator, 100K items at a time
-        instances = self.table_model.objects.all().values(*source_fields).iterator()
-        return instances
-
-    def populate_model(self):
+        queryset = self.full_load_queryset()
+        if self.checkpoint_key:
+            # batches are checkpointed by key, so the rows have to come in key order
+            queryset = queryset.order_by(self.checkpoint_key)
+            if resume_from is not None:
+                queryset = queryset.filter(**{f"{self.checkpoint_key}__gte": resume_from})
+        return self.source_rows(queryset)
+
+    def load(self):
         """Populates objects from unmanaged database with full refresh
         """
-        instances = self.full_load_query()
+        if self.merge:
+            return self.merge_load()
+        if self.swap:
+            return self.swap_load()
+
+        if self.extract_mode != 'values':
+            # the destination is only cleared if the source had rows
+            self.set_based_pipeline(self.full_load_queryset(), replace=True)
+            return self.log
+
+        resume_from = self.resume_from()
+        instances = self.full_load_query(resume_from)
 
         # check if we have any instances.
         if first_instance := next(instances, None):
             # if we have something in the generator time to full load so clear out the destination table
-            self.model.objects.all().delete()
+            # (unless carrying on with a failed load)
+            if resume_from is None:
+                self.model.objects.all().delete()
         else:
+            self.clear_checkpoint()
             return None
 
         # run the batch loading pipeline
         self.execute_pipeline(first_instance, instances)
+        self.clear_checkpoint()
+
+        return self.log
+
+    def prepared_load(self):
+        """The load of the whole source into the destination table, or None if the source has no rows"""
+        if self.extract_mode != 'values':
+            queryset = self.full_load_queryset()
+            if not queryset.exists():
+                return None
+            return functools.partial(self.set_based_pipeline, queryset)
+        instances = self.full_load_query()
+        if not (first_instance := next(instances, None)):
+            return None
+        return functools.partial(self.execute_pipeline, first_instance, instances)
+
+    def swap_load(self):
+        """
+        Full load into an unlogged shadow table, build its indexes and constraints once it is loaded,
+        then swap it in for the destination with a rename in one short transaction.
+        Tables other tables reference can't be swapped, they are merged instead. Tables views depend on
+        are cleared in the load transaction
+        """
+        connection = connections[self.db]
+        quote_name = connection.ops.quote_name
+        table = self.model._meta.db_table
+
+        with connection.cursor() as cursor:
+            blocker = swap_blocker(cursor, table, quote_name)
+        if blocker == 'referenced by foreign keys' and not self.model._meta.pk.auto_created:
+            logger.info(f"Can't swap {self.model.__name__} as it is {blocker}, merging it instead")
+            return self.merge_load()
+
+        # the destination is only replaced if the source has rows
+        if (load := self.prepared_load()) is None:
+            return None
+
+        if blocker:
+            logger.info(f"Can't swap {self.model.__name__} as it is {blocker}, replacing it in one transaction")
+            with transaction.atomic(using=self.db):
+                if blocker == 'referenced by foreign keys':
+                    # without keys from the source, the referencing rows can't keep pointing at the same rows
+                    self.model.objects.all().delete()
+                else:
+                    with connection.cursor() as cursor:
+                        cursor.execute(f"TRUNCATE {quote_name(table)}")
+                load()
+            return self.log
+
+        shadow = f"{table[:50]}__shadow"
+        logger.info(f"Loading {self.model.__name__} into {shadow}")
+        with connection.cursor() as cursor:
+            create_shadow_table(cursor, table, shadow, quote_name)
+        self.write_table = shadow
+        try:
+            load()
+            with connection.cursor() as cursor:
+                renames = build_shadow_table(cursor, table, shadow, quote_name)
+            with transaction.atomic(using=self.db):
+                with connection.cursor() as cursor:
+                    swap_tables(cursor, table, shadow, renames, quote_name)
+        except Exception:
+            with connection.cursor() as cursor:
+                cursor.execute(f"DROP TABLE IF EXISTS {quote_name(shadow)}")
+            raise
+        finally:
+            self.write_table = None
+        logger.info(f"Swapped {shadow} in for {table}")
+
+        return self.log
+
+    def merge_load(self):
+        """
+        Full load into an unlogged shadow table, then in one transaction update the rows that changed, insert the new
+        ones and delete only the rows the source no longer has. Rows of other tables pointing at rows that stay keep
+        their foreign keys, which deleting and loading everything again would clear
+        """
+        connection = connections[self.db]
+        quote_name = connection.ops.quote_name
+        table = self.model._meta.db_table
+        pk = self.model._meta.pk
+        if pk.auto_created:
+            raise ValueError(f"Merge loads match rows by primary key, {self.model.__name__} needs one from the source")
+
+        # the destination is only replaced if the source has rows
+        if (load := self.prepared_load()) is None:
+            return None
+
+        shadow = f"{table[:50]}__merge"
+        logger.info(f"Loading {self.model.__name__} into {shadow}")
+        with connection.cursor() as cursor:
+            create_shadow_table(cursor, table, shadow, quote_name)
+        self.write_table = shadow
+        try:
+            load()
+            self.write_table = None
+            key = quote_name(pk.column)
+            columns = [quote_name(fld.column) for fld in self.model._meta.concrete_fields]
+            updated = [column for column in columns if column != key]
+            if updated:
+                on_conflict = (f"DO UPDATE SET {', '.join(f'{column} = EXCLUDED.{column}' for column in updated)} "
+                               f"WHERE ({', '.join(f'loaded.{column}' for column in updated)}) IS DISTINCT FROM "
+                               f"({', '.join(f'EXCLUDED.{column}' for column in updated)})")
+            else:
+                on_conflict = "DO NOTHING"
+            with self.metrics.stage('merge') as merge, transaction.atomic(using=self.db):
+                with connection.cursor() as cursor:
+                    cursor.execute(
+                        f"INSERT INTO {quote_name(table)} AS loaded ({', '.join(columns)}) "
+                        f"SELECT {', '.join(columns)} FROM {quote_name(shadow)} ON CONFLICT ({key}) {on_conflict}"
+                    )
+                    changed = cursor.rowcount
+                    cursor.execute(
+                        f"SELECT loaded.{key} FROM {quote_name(table)} AS loaded WHERE NOT EXISTS ("
+                        f"SELECT 1 FROM {quote_name(shadow)} AS source WHERE source.{key} = loaded.{key})"
+                    )
+                    stale = [row[0] for row in cursor.fetchall()]
+                # through the ORM, so rows pointing at the deleted ones are cleared or deleted as the models say
+                for start in range(0, len(stale), 10_000):
+                    self.model.objects.filter(pk__in=stale[start:start + 10_000]).delete()
+                merge.rows += changed + len(stale)
+        finally:
+            self.write_table = None
+            with connection.cursor() as cursor:
+                cursor.execute(f"DROP TABLE IF EXISTS {quote_name(shadow)}")
+        logger.info(f"Merged {shadow} into {table}, {changed} records inserted or updated, {len(stale)} deleted")
+        self.log.append(("Deleted Values", self.model.__name__, len(stale)))
 
         return self.log
 
@@ -254,45 +973,56 @@ class FullLoadManager(DataLoader):
 class IncrementalLoadManager(DataLoader):
     LOAD_TYPE = "Incremental Load"
 
-    def __init__(self, table_key, table_model, incremental_key, incremental_model):
-        super().__init__()
+    def __init__(self, table_key, table_model, incremental_key, incremental_model, write_mode='bulk_create',
+                 extract_mode='values', change_window=None, partitions=1, batch_size=DEFAULT_BATCH_SIZE,
+                 batch_memory=None, pipelined=True, chunk_size=DEFAULT_CHUNK_SIZE, transformers=()):
+        super().__init__(write_mode=write_mode, extract_mode=extract_mode, batch_size=batch_size,
+                         batch_memory=batch_memory, pipelined=pipelined, chunk_size=chunk_size,
+                         transformers=transformers)
         self.table_key = table_key
         self.table_model = table_model
         self.incremental_key = incremental_key
         self.incremental_model = incremental_model
+        # re-read this far back behind the last loaded key (a number, or a timedelta for dates)
+        # and upsert, so changes to recently loaded rows are picked up
+        self.change_window = change_window
+        self.upsert = change_window is not None
+        # split each load into this many ranges of the incremental key, loaded side by side on their own connections
+        self.partitions = partitions
+        # partitioned loads keep the incremental log up to date as they go instead
+        if self.extract_mode == 'values' and partitions == 1:
+            self.checkpoint_key = incremental_key
 
     def get_last_loaded(self):
         """Retrieve the last loaded schedule ID from the incremental log."""
         last_loaded = self.incremental_model.objects.order_by(f'-{self.table_key}').first()
         if last_loaded:
             return last_loaded
-        return self.incremental_model.objects.create()
-
-    def incremental_load_query(self, last_loaded_id, mock_increment=0):
+        # loaders running at the same time can all find the log empty, only one of them creates it
+        return self.incremental_model.objects.get_or_create(id=1)[0]
 
-        # Get all non-auto-created fields from the old model:
-        source_fields = [
-            f.name for f in self.table_model._meta.get_fields()
-            if isinstance(f, Field) and (not f.auto_created and not f.is_relation)
-        ]
+    def incremental_load_queryset(self, last_loaded_id, mock_increment=0):
         if mock_increment:
             logger.info(f'Loading values less than {mock_increment}')
-            instances = self.table_model.objects.filter(**{f"{self.incremental_key}__lt": mock_increment}).values(
-                *source_fields).iterator()
-        else:
-            if not last_loaded_id:
-                logger.info(f'Loading all values as there was nothing in the incremental log')
-                self.model.objects.all().delete()  # redundant, but if we are here, its a good safety net
-                instances = self.table_model.objects.all().order_by(self.incremental_key).values(
-                    *source_fields).iterator()
-            else:
-                instances = self.table_model.objects.filter(
-                    **{f"{self.incremental_key}__gt": last_loaded_id}
-                ).order_by(self.incremental_key).values(*source_fields).iterator()
+            return self.table_model.objects.filter(**{f"{self.incremental_key}__lt": mock_increment})
+
+        if not last_loaded_id:
+            logger.info(f'Loading all values as there was nothing in the incremental log')
+            self.model.objects.all().delete()  # redundant, but if we are here, its a good safety net
+            return self.table_model.objects.all().order_by(self.incremental_key)
+
+        if self.change_window is not None:
+            logger.info(f'Refreshing values in the change window of {self.change_window}')
+            last_loaded_id = last_loaded_id - self.change_window
 
-        return instances
+        return self.table_model.objects.filter(
+            **{f"{self.incremental_key}__gt": last_loaded_id}
+        ).order_by(self.incremental_key)
 
-    def populate_model(self, mock_increment=0):
+    def incremental_load_query(self, last_loaded_id, mock_increment=0):
+        return self.source_rows(self.incremental_load_queryset(last_loaded_id, mock_increment))
+
+    def load(self, mock_increment=0):
         """Populates table from unmanaged database incrementally.
            Also tracks the last loaded ID to enable incremental loading of this table
         """
@@ -300,96 +1030,503 @@ class IncrementalLoadManager(DataLoader):
         last_loaded = self.get_last_loaded()
         last_loaded_id = getattr(last_loaded, self.table_key)
 
-        instances = self.incremental_load_query(last_loaded_id, mock_increment)
+        if self.partitions > 1:
+            logger.info(f'Loading values greater than {last_loaded_id}')
+            # the incremental log is moved forward as the key ranges are loaded
+            if not self.partitioned_pipeline(self.incremental_load_queryset(last_loaded_id, mock_increment),
+                                             last_loaded):
+                logger.info(f'Nothing new to load for {self.model.__name__}')
+            return self.log
 
-        if first_instance := next(instances, None):
-            # if we have something in the generator time to full load so clear out the destination table
+        if self.extract_mode != 'values':
             logger.info(f'Loading values greater than {last_loaded_id}')
+            if not self.set_based_pipeline(self.incremental_load_queryset(last_loaded_id, mock_increment)):
+                logger.info(f'Nothing new to load for {self.model.__name__}')
+                return self.log
         else:
-            logger.info(f'Nothing new to load for {self.model.__name__}')
-            return self.log
-        # run the batch loading pipeline
-        self.execute_pipeline(first_instance, instances)
+            if (resume_from := self.resume_from()) is not None:
+                # the incremental log didn't move with the failed load, carry on from its checkpoint instead
+                instances = self.source_rows(self.table_model.objects.filter(
+                    **{f"{self.incremental_key}__gte": resume_from}
+                ).order_by(self.incremental_key))
+            else:
+                instances = self.incremental_load_query(last_loaded_id, mock_increment)
+
+            if first_instance := next(instances, None):
+                # if we have something in the generator time to full load so clear out the destination table
+                logger.info(f'Loading values greater than {last_loaded_id}')
+            else:
+                logger.info(f'Nothing new to load for {self.model.__name__}')
+                self.clear_checkpoint()
+                return self.log
+            # run the batch loading pipeline
+            self.execute_pipeline(first_instance, instances)
+
+        with transaction.atomic(using=self.db):
+            self.update_last_loaded(last_loaded)
+            self.clear_checkpoint()
 
-        # find the max value for the incremental key and load that in to the incremental log
-        max_id = self.model.objects.aggregate(models.Max(self.incremental_key))[f'{self.incremental_key}__max']
+        return self.log
+
+    def micro_batch(self, rows: int = MICRO_BATCH_ROWS) -> int:
+        """
+        Load the next rows of the source past the incremental log, about rows of them, for run_pipeline --micro-batch.
+        Made to run every few seconds: the rows come from one LIMIT query instead of a server side cursor, only the
+        foreign keys they hold are looked up, and they are written on this thread in one transaction with the
+        incremental log. The change window is left to the pipeline runs, and so are the rows of the newest key
+        when keys aren't unique.
+        Returns the number of source rows read, 0 once the table has caught up with its source, or while a failed
+        load of the table left a checkpoint: the rows it committed are past the log, the next run resumes or
+        discards them
+        """
+        if self.get_checkpoint() is not None:
+            logger.info(f"{self.model.__name__} has an unfinished load, leaving it to the next pipeline run")
+            return 0
+        key = self.incremental_key
+        source_fields = self.get_source_fields()
+        key_index = source_fields.index(key)
+        last_loaded = self.get_last_loaded()
+        queryset = self.table_model.objects.order_by(key)
+        if (last_loaded_id := getattr(last_loaded, self.table_key)) is not None:
+            queryset = queryset.filter(**{f"{key}__gt": last_loaded_id})
+
+        unique_key = self.table_model._meta.get_field(key).unique
+        # rows are counted as they go through the batch loader
+        with self.metrics.stage('source_query'):
+            if not unique_key:
+                # more rows may still come for the newest key (a date), the log moving past it would skip them
+                # for good, so they wait for a newer key to show up or for the pipeline run
+                newest_key = queryset.aggregate(newest=models.Max(key))['newest']
+                if newest_key is None:
+                    return 0
+                queryset = queryset.filter(**{f"{key}__lt": newest_key})
+            instances = list(queryset.values_list(*source_fields)[:rows])
+            if len(instances) == rows and not unique_key:
+                # rows sharing the last key may go on past the limit, they are loaded together
+                # so the incremental log can move past their key
+                last_key = instances[-1][key_index]
+                instances = [instance for instance in instances if instance[key_index] != last_key]
+                instances += queryset.filter(**{key: last_key}).values_list(*source_fields)
+        if not instances:
+            return 0
+
+        related_fields_for_model = [fld for fld in self.model._meta.get_fields() if
+                                    fld.is_relation and not fld.auto_created]
+        with self.metrics.stage('related_lookup') as lookup:
+            related_field_lookup = self.batch_related_lookup(related_fields_for_model, instances)
+            lookup.rows += sum(len(keys) for keys in related_field_lookup.values())
+
+        with transaction.atomic(using=self.db):
+            self.batch_loader(len(instances), instances[0], iter(instances[1:]), related_field_lookup,
+                              related_fields_for_model)
+            # the log moves to the last key read, rows a transformer dropped aren't read again every few seconds
+            setattr(last_loaded, self.table_key, instances[-1][key_index])
+            last_loaded.save(update_fields=[self.table_key])
+            # the checkpoint the batch loader just wrote, there was none before
+            self.clear_checkpoint()
+        return len(instances)
+
+    def discard_partial_load(self) -> None:
+        """Remove rows a failed load committed past the incremental log"""
+        last_loaded = self.get_last_loaded()
+        stray = self.model.objects.all()
+        if (loaded_up_to := getattr(last_loaded, self.table_key)) is not None:
+            stray = stray.filter(**{f"{self.incremental_key}__gt": loaded_up_to})
+        logger.info(f"Removing {self.model.__name__} rows loaded past {loaded_up_to}")
+        stray.delete()
+
+    def update_last_loaded(self, last_loaded, **key_filter) -> None:
+        """find the max value for the incremental key (within the filter) and load that in to the incremental log"""
+        loaded = self.model.objects.filter(**key_filter) if key_filter else self.model.objects
+        max_id = loaded.aggregate(models.Max(self.incremental_key))[f'{self.incremental_key}__max']
         setattr(last_loaded, self.table_key, max_id)
-        last_loaded.save()
+        # other loaders keep their own keys in the same row
+        last_loaded.save(update_fields=[self.table_key])
+
+    def key_ranges(self, queryset) -> list[dict]:
+        """
+        Split the rows of a queryset into up to self.partitions ranges of the incremental key of about the same width.
+        Works for numbers, dates and datetimes. Returns filter arguments for each range, in key order
+        """
+        key = self.incremental_key
+        bounds = queryset.aggregate(low=models.Min(key), high=models.Max(key))
+        low, high = bounds['low'], bounds['high']
+        if low is None:
+            return []
+        starts = sorted({low + (high - low) * i // self.partitions for i in range(self.partitions)})
+        return [
+            {f"{key}__gte": start, f"{key}__lt": starts[i + 1]} if i + 1 < len(starts)
+            else {f"{key}__gte": start, f"{key}__lte": high}
+            for i, start in enumerate(starts)
+        ]
+
+    def load_partition(self, queryset) -> 'IncrementalLoadManager':
+        """
+        Load one key range in a worker thread. A copy of the loader does the work in a context of its own,
+        so its log and metrics don't mix with the other ranges until they are merged
+        """
+        worker = self.in_context(self.context.fork())
+        try:
+            if self.extract_mode != 'values':
+                worker.set_based_pipeline(queryset)
+            else:
+                instances = self.source_rows(queryset)
+                if first_instance := next(instances, None):
+                    worker.execute_pipeline(first_instance, instances)
+        finally:
+            # each thread gets its own database connections from django
+            connections.close_all()
+        return worker
+
+    def partitioned_pipeline(self, queryset, last_loaded) -> int:
+        """
+        Load a queryset as key ranges in parallel. Each range commits on its own, the incremental log is moved to
+        the end of a range once it and every range before it are loaded. If a range fails, rows loaded past the
+        incremental log are removed again so the next run carries on from the log.
+        Returns the number of ranges loaded
+        """
+        ranges = self.key_ranges(queryset)
+        if not ranges:
+            return 0
+        logger.info(f"Loading {self.model.__name__} in {len(ranges)} key ranges")
+
+        loaded = [False] * len(ranges)
+        committed = 0
+        failure = None
+        with ThreadPoolExecutor(max_workers=len(ranges), thread_name_prefix='partition') as executor:
+            futures = {executor.submit(self.load_partition, queryset.filter(**key_range)): i
+                       for i, key_range in enumerate(ranges)}
+            for future in as_completed(futures):
+                try:
+                    worker = future.result()
+                except Exception as e:
+                    logger.error(f"Error loading {self.model.__name__} {ranges[futures[future]]}:\n\t\t{e}")
+                    failure = failure or e
+                    continue
+                self.context.merge(worker.context)
+                loaded[futures[future]] = True
+                if loaded[committed]:
+                    while committed < len(ranges) and loaded[committed]:
+                        committed += 1
+                    # everything before the first range still loading is committed
+                    key = self.incremental_key
+                    before_pending = {f"{key}__lt": ranges[committed][f"{key}__gte"]} if committed < len(ranges) else {}
+                    self.update_last_loaded(last_loaded, **before_pending)
+
+        if failure:
+            self.discard_partial_load()
+            raise failure
+        return len(ranges)
+
+
+class RowFingerprint(Func):
+    """
+    64 bit fingerprint of a whole row, computed by postgres from md5 of the row as text
+    """
+    template = "('x' || substr(md5((ROW(%(expressions)s))::text), 1, 16))::bit(64)::bigint"
+    output_field = models.BigIntegerField()
+
+
+class ChangeDataCaptureLoadManager(FullLoadManager):
+    """
+    Incremental loading for source tables that have no incremental key.
+    The source database fingerprints every row, the (key, fingerprint) pairs are copied into a
+    temporary table next to the destination and compared with the fingerprints stored in row_hash.
+    Only inserted or updated rows are transferred, only deleted or updated rows are removed.
+    """
+    LOAD_TYPE = "Change Data Capture Load"
+
+    def __init__(self, table_model, key_field='id'):
+        super().__init__(table_model, extract_mode='copy')
+        self.key_field = key_field
+
+    def fingerprint_queryset(self):
+        return self.table_model.objects.annotate(row_hash=RowFingerprint(*self.get_source_fields()))
+
+    def load(self):
+        """Populates objects from unmanaged database, only applying the rows that changed
+        """
+        load_fields = self.get_source_fields() + ['row_hash']
+
+        if not self.model.objects.exists():
+            # nothing loaded to compare against, copy the whole table
+            self.copy_pipeline(self.fingerprint_queryset(), fields=load_fields)
+            return self.log
+
+        connection = connections[self.db]
+        quote_name = connection.ops.quote_name
+        table = quote_name(self.model._meta.db_table)
+        fingerprints = quote_name(f"{self.model._meta.db_table}_fingerprint")
+        key_field = self.model._meta.get_field(self.key_field)
+        key = quote_name(key_field.column)
+
+        # everything in one transaction so readers never see a deleted row before its new version
+        with transaction.atomic(using=self.db):
+            with connection.cursor() as cursor:
+                cursor.execute(f"DROP TABLE IF EXISTS {fingerprints}")
+                cursor.execute(f"CREATE TEMPORARY TABLE {fingerprints} "
+                               f"({key} {key_field.db_type(connection)} PRIMARY KEY, row_hash bigint) ON COMMIT DROP")
+
+            with tempfile.SpooledTemporaryFile(max_size=COPY_SPOOL_SIZE) as stream:
+                source_rows = self.copy_extract(self.fingerprint_queryset(), stream, [self.key_field, 'row_hash'])
+                if not source_rows:
+                    # same as a full load, an empty source leaves the destination alone
+                    logger.info(f'Nothing to load for {self.model.__name__}')
+                    return self.log
+                stream.seek(0)
+                with connection.cursor() as cursor:
+                    copy_from(cursor, f"COPY {fingerprints} ({key}, row_hash) FROM STDIN", stream)
+
+            with self.metrics.stage('compare') as compare, connection.cursor() as cursor:
+                cursor.execute(f"ANALYZE {fingerprints}")
+                # rows deleted from the source, and the old version of updated rows
+                cursor.execute(
+                    f"DELETE FROM {table} AS loaded WHERE NOT EXISTS ("
+                    f"SELECT 1 FROM {fingerprints} AS source "
+                    f"WHERE source.{key} = loaded.{key} AND source.row_hash = loaded.row_hash)"
+                )
+                deleted = cursor.rowcount
+                # new rows, and the new version of updated rows
+                cursor.execute(
+                    f"SELECT source.{key} FROM {fingerprints} AS source WHERE NOT EXISTS ("
+                    f"SELECT 1 FROM {table} AS loaded WHERE loaded.{key} = source.{key})"
+                )
+                changed_keys = [row[0] for row in cursor.fetchall()]
+                compare.rows += deleted + len(changed_keys)
+
+            logger.info(f"{self.model.__name__} Deleted {deleted} records, {len(changed_keys)} to load.")
+            self.log.append(("Deleted Values", self.model.__name__, deleted))
+
+            for start in range(0, len(changed_keys), 50_000):
+                changed = self.fingerprint_queryset().filter(
+                    **{f"{self.key_field}__in": changed_keys[start:start + 50_000]})
+                self.copy_pipeline(changed, fields=load_fields)
 
         return self.log
 
 
+class TransformRowPlan(NamedTuple):
+    """Where each output column of a transformed row comes from, by position in the source row or by name"""
+    # (output column, index in the source row)
+    source: list
+    # output columns the transformer may add
+    transformed: list
+    # (output column or None if it isn't loaded, index in the source row, field name, related model name)
+    relations: list
+
+
 class IncrementalTransformLoadManager(IncrementalLoadManager):
 
-    def __init__(self, table_key, table_model, incremental_key, incremental_model, transformer: ColumnTransformer):
-        super().__init__(table_key, table_model, incremental_key, incremental_model)
+    def __init__(self, table_key, table_model, incremental_key, incremental_model, transformer: ColumnTransformer,
+                 write_mode='bulk_create', batch_size=DEFAULT_BATCH_SIZE, batch_memory=None, pipelined=True,
+                 chunk_size=DEFAULT_CHUNK_SIZE, transformers=()):
+        # transformed rows have to pass through python, so there is no copy extract mode here
+        super().__init__(table_key, table_model, incremental_key, incremental_model, write_mode=write_mode,
+                         batch_size=batch_size, batch_memory=batch_memory, pipelined=pipelined,
+                         chunk_size=chunk_size, transformers=transformers)
         self.table_key = table_key
         self.table_model = table_model
         self.incremental_key = incremental_key
         self.incremental_model = incremental_model
         self.transformer = transformer
 
-    def build_output_object(self,
-                            instance: dict,
-                            related_fields_for_model: list[models.Field],
-                            related_field_lookup: dict) -> models.Model:
-
-        for fld in related_fields_for_model:
-            if fld.many_to_many:
-                continue
-            related_model_name = fld.related_model.__name__
-            relation_name = fld.related_fields[0][1].name
-            try:
-                related_obj = related_field_lookup[related_model_name][instance[relation_name]]
-            except KeyError as e:
-                # Looks like we have an integrity problem, set to null
-                error_log = ('Missing Value', fld.name, instance)
-                self.log.append(error_log)
-                related_obj = None
-            instance[fld.name] = related_obj
-
+    def transformed_rows(self, instances: Iterable[tuple], batch_size: int) -> Iterator[tuple[tuple, dict]]:
+        """
+        Pair each source row with the columns the transformer adds to it, the transformer gets a whole batch
+        at a time. Rows the transformer can't handle are dropped
+        """
+        input_index = self.row_fields().index(self.transformer.input_field)
+        instances = iter(instances)
+        while batch := list(itertools.islice(instances, batch_size)):
+            columns_to_add = self.transformer.transform_many([instance[input_index] for instance in batch])
+            for instance, columns in zip(batch, columns_to_add):
+                if columns:
+                    yield instance, columns
+
+    def transform_rows(self, rows: Iterator[tuple], batches: BatchSizer) -> Iterator:
+        # the column transformer comes after the transformer chain
+        rows = super().transform_rows(rows, batches)
+        if not self.transformer:
+            return rows
+        # transformer batches keep the size the load starts with
+        return self.transformed_rows(rows, batches.rows)
+
+    def relation_source_fields(self, related_fields_for_model: list[models.Field]) -> list[tuple[models.Field, str]]:
+        # as in the row plan, foreign keys are checked against the field of the source row they point at
+        return [(fld, fld.related_fields[0][1].name) for fld in related_fields_for_model if not fld.many_to_many]
+
+    def make_row_plan(self, related_fields_for_model: list[models.Field]) -> TransformRowPlan:
+        source_index = {name: i for i, name in enumerate(self.row_fields())}
+        # foreign keys are checked against the field of the source row they point at
+        relations = [(f"{fld.name}_id", source_index[fld.related_fields[0][1].name], fld.name,
+                      fld.related_model.__name__)
+                     for fld in related_fields_for_model if not fld.many_to_many]
+        relation_keys = {key for key, *_ in relations}
         if self.transformer:
+            output_fields = set(self.transformer.output_fields)
+            # transformed columns take precedence over source columns of the same name
+            transformed = [name for name in self.transformer.output_fields if name not in relation_keys]
+        else:
+            output_fields = set(source_index) | relation_keys
+            transformed = []
+        return TransformRowPlan(
+            source=[(name, i) for name, i in source_index.items()
+                    if name in output_fields and name not in relation_keys],
+            transformed=transformed,
+            relations=[(key if key in output_fields else None, *relation) for key, *relation in relations],
+        )
 
-            input_col = self.transformer.input_field
-            columns_to_add = self.transformer.transform(instance[input_col])
-
-            if columns_to_add:
-                combined_dictionary = instance | columns_to_add
-
-                output = {col_name: value
-                          for col_name, value in combined_dictionary.items()
-                          if col_name in self.transformer.output_fields}
-
-                return self.model(**output)
-            else:
-                return None
-
-        return self.model(**instance)
+    def build_output_values(self,
+                            instance: tuple,
+                            related_fields_for_model: list[models.Field],
+                            related_field_lookup: dict) -> dict | None:
+        if self.row_plan is None:
+            self.row_plan = self.make_row_plan(related_fields_for_model)
+        plan = self.row_plan
+        row, columns = instance if self.transformer else (instance, None)
+
+        output = {name: row[i] for name, i in plan.source}
+        for name in plan.transformed:
+            if name in columns:
+                output[name] = columns[name]
+        for key, index, field_name, related_model_name in plan.relations:
+            related_key = row[index]
+            if related_key not in related_field_lookup.get(related_model_name, ()):
+                # Looks like we have an integrity problem, set to null
+                self.integrity.orphan(field_name, related_key)
+                related_key = None
+            if key is not None:
+                output[key] = related_key
+        return output
 
 
 class FullLoadQueryManager(FullLoadManager):
 
-    def __init__(self, table_model, query=None):
-        super().__init__(table_model)
+    def __init__(self, table_model, query=None, write_mode='bulk_create', depends_on=None,
+                 batch_size=DEFAULT_BATCH_SIZE, batch_memory=None, pipelined=True, chunk_size=DEFAULT_CHUNK_SIZE,
+                 transformers=()):
+        super().__init__(table_model, write_mode=write_mode, batch_size=batch_size, batch_memory=batch_memory,
+                         pipelined=pipelined, chunk_size=chunk_size, transformers=transformers)
 
+        # returns a queryset annotated with the fields of the model (or an iterable of rows of them as tuples)
         self.query = query
-
-    def full_load_query(self):
-        # Fetch all records from provided query
-        return self.query()
-
-    def build_output_object(self, instance, *args, **kwargs):
+        # the query can read any table, so dependencies have to be declared
+        self.depends_on = list(depends_on or [])
+        # the query's rows come in no particular order, a failed load starts over
+        self.checkpoint_key = None
+
+    def get_source_fields(self) -> list[str]:
+        """The query gives a value for every field of the model but its primary key"""
+        return [fld.name for fld in self.model._meta.concrete_fields if not fld.primary_key]
+
+    def full_load_query(self, resume_from=None):
+        # Fetch all records from provided query, as tuples streamed from a server side cursor
+        rows = self.query()
+        if isinstance(rows, models.QuerySet):
+            return self.source_rows(rows)
+        return iter(rows)
+
+    def build_output_values(self, instance, *args, **kwargs):
         """
-        slightly modified from other loaders as is more simple here
+        slightly modified from other loaders as is more simple here, the query's foreign keys aren't checked
         """
-        output = {}
-        for r in self.model._meta.get_fields():
-            if r.name == 'id':
-                continue
-            if r.is_relation:
-                # add _id suffix for foreign key relationships
-                output[f"{r.name}_id"] = instance[r.name]
-            else:
-                output[f"{r.name}"] = instance[r.name]
+        if self.row_plan is None:
+            # _id suffix for foreign key relationships, fields the transformers add that the model hasn't are left out
+            fields = {fld.name: fld for fld in self.model._meta.concrete_fields}
+            self.row_plan = [fields[name].attname if name in fields else None for name in self.row_fields()]
+        return {name: value for name, value in zip(self.row_plan, instance) if name}
+
+
+class HashIncrementalQueryManager(FullLoadQueryManager):
+    """
+    Loads the output of a query incrementally. The query's rows are loaded into an unlogged shadow table and
+    compared with the rows already loaded in the database, by a fingerprint of their columns worked out on both
+    sides as they are stored now, so rows changed since they were loaded (a parent's delete setting their foreign
+    keys to null) are put right too. Rows that aren't loaded yet are inserted, loaded rows the query no longer
+    produces are deleted, so a changed row is replaced and unchanged rows are never touched.
+    Rows have no key of their own, identical rows are matched up by how many of them there are
+    """
+    LOAD_TYPE = "Hash Incremental Load"
+
+    def __init__(self, table_model, query=None, write_mode='copy', depends_on=None, batch_size=DEFAULT_BATCH_SIZE,
+                 batch_memory=None, pipelined=True, chunk_size=DEFAULT_CHUNK_SIZE, transformers=()):
+        if write_mode != 'copy':
+            raise ValueError("Hash incremental loads need the copy write mode, "
+                             "bulk_create can only write to the model's own table")
+        super().__init__(table_model, query=query, write_mode=write_mode, depends_on=depends_on,
+                         batch_size=batch_size, batch_memory=batch_memory, pipelined=pipelined,
+                         chunk_size=chunk_size, transformers=transformers)
+
+    def fingerprint_sql(self, alias: str) -> str:
+        """Fingerprint of the columns of a row of the table, or of its shadow, everything but the key"""
+        quote_name = connections[self.db].ops.quote_name
+        columns = [f"{alias}.{quote_name(fld.column)}" for fld in self.model._meta.concrete_fields
+                   if not fld.primary_key]
+        return RowFingerprint.template % {'expressions': ', '.join(columns)}
+
+    def load(self):
+        """Populates the model from the query, only writing the rows that changed
+        """
+        instances = self.full_load_query()
+        if not (first_instance := next(instances, None)):
+            # like the full loads, an empty source leaves what is loaded alone
+            logger.info(f'Nothing new to load for {self.model.__name__}')
+            return self.log
 
-        return self.model(**output)
+        connection = connections[self.db]
+        quote_name = connection.ops.quote_name
+        table = quote_name(self.model._meta.db_table)
+        shadow = quote_name(f"{self.model._meta.db_table[:50]}__changes")
+        key = quote_name(self.model._meta.pk.column)
+        columns = ', '.join(quote_name(fld.column) for fld in self.model._meta.concrete_fields if not fld.primary_key)
+
+        with connection.cursor() as cursor:
+            create_shadow_table(cursor, self.model._meta.db_table, f"{self.model._meta.db_table[:50]}__changes",
+                                quote_name)
+        self.write_table = f"{self.model._meta.db_table[:50]}__changes"
+        try:
+            self.execute_pipeline(first_instance, instances)
+            self.write_table = None
+
+            # everything in one transaction so readers never see a deleted row before its new version
+            with self.metrics.stage('compare') as compare, transaction.atomic(using=self.db):
+                with connection.cursor() as cursor:
+                    cursor.execute(f"ANALYZE {shadow}")
+                    # loaded rows the query doesn't produce (as many times) anymore
+                    cursor.execute(
+                        f"WITH source AS (SELECT {self.fingerprint_sql('source')} AS fingerprint, count(*) AS copies "
+                        f"FROM {shadow} AS source GROUP BY 1), "
+                        f"loaded AS (SELECT {key}, fingerprint, "
+                        f"row_number() OVER (PARTITION BY fingerprint) AS copy "
+                        f"FROM (SELECT {key}, {self.fingerprint_sql('loaded')} AS fingerprint "
+                        f"FROM {table} AS loaded) AS loaded) "
+                        f"DELETE FROM {table} WHERE {key} IN (SELECT loaded.{key} FROM loaded "
+                        f"LEFT JOIN source ON source.fingerprint = loaded.fingerprint "
+                        f"WHERE loaded.copy > coalesce(source.copies, 0))"
+                    )
+                    deleted = cursor.rowcount
+                    # rows of the query that aren't loaded (as many times) yet
+                    cursor.execute(
+                        f"WITH loaded AS (SELECT {self.fingerprint_sql('loaded')} AS fingerprint, count(*) AS copies "
+                        f"FROM {table} AS loaded GROUP BY 1) "
+                        f"INSERT INTO {table} ({columns}) SELECT {columns} FROM ("
+                        f"SELECT *, row_number() OVER (PARTITION BY fingerprint) AS copy FROM ("
+                        f"SELECT {columns}, {self.fingerprint_sql('source')} AS fingerprint FROM {shadow} AS source"
+                        f") AS source) AS source "
+                        f"LEFT JOIN loaded ON loaded.fingerprint = source.fingerprint "
+                        f"WHERE source.copy > coalesce(loaded.copies, 0)"
+                    )
+                    inserted = cursor.rowcount
+                compare.rows += deleted + inserted
+        finally:
+            self.write_table = None
+            with connection.cursor() as cursor:
+                cursor.execute(f"DROP TABLE IF EXISTS {shadow}")
+
+        if not deleted and not inserted:
+            logger.info(f'Nothing new to load for {self.model.__name__}')
+        logger.info(f"{self.model.__name__} Inserted {inserted} and deleted {deleted} stale records.")
+        self.log.append(("Inserted Values", self.model.__name__, inserted))
+        self.log.append(("Deleted Values", self.model.__name__, deleted))
+
+        return self.log
@@ -0,0 +1,221 @@
+# Timing and throughput of each stage of a load (source query, foreign key lookups, building rows, writing),
+# so a slow run can be traced to the part that got slower.
+# Loaders collect into a LoadMetrics, the run_pipeline command stores them in the run history table
+# and can export them as JSON or in the Prometheus text format.
+
+import json
+import resource
+import time
+from contextlib import contextmanager
+from typing import Iterable, Iterator
+
+from django.db import models
+
+# upper bounds in seconds of the batch latency histogram buckets
+BATCH_LATENCY_BUCKETS = (0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, float('inf'))
+
+
+class StageMetrics:
+    __slots__ = ('seconds', 'rows', 'bytes', 'batches', 'batch_seconds', 'batch_buckets')
+
+    def __init__(self):
+        self.seconds = 0.0
+        self.rows = 0
+        self.bytes = 0
+        self.batches = 0
+        self.batch_seconds = 0.0
+        # count of batches per bucket of BATCH_LATENCY_BUCKETS, not cumulative
+        self.batch_buckets = [0] * len(BATCH_LATENCY_BUCKETS)
+
+    def observe_batch(self, seconds: float) -> None:
+        self.batches += 1
+        self.batch_seconds += seconds
+        for i, bound in enumerate(BATCH_LATENCY_BUCKETS):
+            if seconds <= bound:
+                self.batch_buckets[i] += 1
+                break
+
+    @property
+    def rows_per_second(self) -> float | None:
+        return self.rows / self.seconds if self.seconds else None
+
+    def as_dict(self) -> dict:
+        return {
+            'seconds': round(self.seconds, 6),
+            'rows': self.rows,
+            'bytes': self.bytes,
+            'rows_per_second': round(self.rows_per_second, 1) if self.rows_per_second else None,
+            'batches': self.batches,
+            'batch_seconds': round(self.batch_seconds, 6),
+            'batch_buckets': dict(zip(map(str, BATCH_LATENCY_BUCKETS), self.batch_buckets)),
+        }
+
+
+class LoadMetrics:
+    """
+    Metrics of one loader for one run, stages are created as they are first used
+    """
+
+    def __init__(self):
+        self.stages: dict[str, StageMetrics] = {}
+        self.peak_rss_kb = None
+
+    def get(self, name: str) -> StageMetrics:
+        if name not in self.stages:
+            self.stages[name] = StageMetrics()
+        return self.stages[name]
+
+    def sample_rss(self) -> None:
+        # peak resident set size of the whole process so far, in kilobytes on linux
+        self.peak_rss_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    @contextmanager
+    def stage(self, name: str, exclude: Iterable[str] = ()):
+        """
+        Time a block as part of a stage. Time counted in the excluded stages while the block runs
+        (e.g. a source iterator consumed inside it) is left out, so stages don't overlap
+        """
+        exclude = [self.get(other) for other in exclude]
+        excluded_before = sum(other.seconds for other in exclude)
+        stage = self.get(name)
+        start = time.perf_counter()
+        try:
+            yield stage
+        finally:
+            excluded = sum(other.seconds for other in exclude) - excluded_before
+            stage.seconds += time.perf_counter() - start - excluded
+            self.sample_rss()
+
+    @contextmanager
+    def batch(self, name: str):
+        """Time one batch of a stage, the latency goes into the histogram as well"""
+        stage = self.get(name)
+        start = time.perf_counter()
+        try:
+            yield stage
+        finally:
+            seconds = time.perf_counter() - start
+            stage.seconds += seconds
+            stage.observe_batch(seconds)
+            self.sample_rss()
+
+    def timed_rows(self, name: str, rows: Iterable, chunk_size: int | None = None) -> Iterator:
+        """
+        Pass rows through, counting them and the time spent waiting for each one.
+        With the chunk size of the cursor they come from, the time of each chunk goes into the histogram too
+        """
+        stage = self.get(name)
+        rows = iter(rows)
+        chunk_seconds = 0.0
+        while True:
+            start = time.perf_counter()
+            row = next(rows, StopIteration)
+            seconds = time.perf_counter() - start
+            stage.seconds += seconds
+            chunk_seconds += seconds
+            if row is StopIteration:
+                if chunk_size and stage.rows % chunk_size:
+                    stage.observe_batch(chunk_seconds)
+                return
+            stage.rows += 1
+            if chunk_size and stage.rows % chunk_size == 0:
+                stage.observe_batch(chunk_seconds)
+                chunk_seconds = 0.0
+            yield row
+
+    def merge(self, other: 'LoadMetrics') -> None:
+        """Add the metrics of another loader, e.g. one loading part of the same table at the same time"""
+        for name, other_stage in other.stages.items():
+            stage = self.get(name)
+            stage.seconds += other_stage.seconds
+            stage.rows += other_stage.rows
+            stage.bytes += other_stage.bytes
+            stage.batches += other_stage.batches
+            stage.batch_seconds += other_stage.batch_seconds
+            stage.batch_buckets = [a + b for a, b in zip(stage.batch_buckets, other_stage.batch_buckets)]
+        if other.peak_rss_kb is not None:
+            self.peak_rss_kb = max(self.peak_rss_kb or 0, other.peak_rss_kb)
+
+    def as_dict(self) -> dict:
+        return {
+            'peak_rss_kb': self.peak_rss_kb,
+            'stages': {name: stage.as_dict() for name, stage in self.stages.items()},
+        }
+
+
+class LoaderRunMetric(models.Model):
+    """
+    Run history, one row per stage of each loader in a pipeline run
+    """
+    run_id = models.UUIDField(db_index=True)
+    run_started = models.DateTimeField()
+    model_name = models.CharField(max_length=255)
+    stage = models.CharField(max_length=50)
+    seconds = models.FloatField()
+    rows = models.BigIntegerField()
+    bytes = models.BigIntegerField()
+    batches = models.IntegerField()
+    batch_seconds = models.FloatField()
+    batch_buckets = models.JSONField(default=dict)
+    peak_rss_kb = models.BigIntegerField(null=True, blank=True)
+
+    class Meta:
+        db_table = "loader_run_metric"
+
+
+def save_run_metrics(run_id, run_started, run_metrics: dict[str, LoadMetrics]) -> list[LoaderRunMetric]:
+    return LoaderRunMetric.objects.bulk_create([
+        LoaderRunMetric(run_id=run_id, run_started=run_started, model_name=model_name, stage=name,
+                        seconds=stage.seconds, rows=stage.rows, bytes=stage.bytes, batches=stage.batches,
+                        batch_seconds=stage.batch_seconds,
+                        batch_buckets=stage.as_dict()['batch_buckets'], peak_rss_kb=metrics.peak_rss_kb)
+        for model_name, metrics in run_metrics.items()
+        for name, stage in metrics.stages.items()
+    ])
+
+
+def metrics_json(run_id, run_started, run_metrics: dict[str, LoadMetrics]) -> str:
+    return json.dumps({
+        'run_id': str(run_id),
+        'run_started': run_started.isoformat(),
+        'loaders': {model_name: metrics.as_dict() for model_name, metrics in run_metrics.items()},
+    }, indent=2)
+
+
+def prometheus_text(run_metrics: dict[str, LoadMetrics]) -> str:
+    """
+    The metrics of a run in the Prometheus text exposition format, e.g. for the node exporter textfile collector
+    """
+    counters = [
+        ('pipeline_stage_seconds_total', 'Time spent in each stage of a load', 'seconds'),
+        ('pipeline_stage_rows_total', 'Rows handled by each stage of a load', 'rows'),
+        ('pipeline_stage_bytes_total', 'Bytes handled by each stage of a load', 'bytes'),
+    ]
+    lines = []
+    for metric, help_text, attribute in counters:
+        lines += [f"# HELP {metric} {help_text}", f"# TYPE {metric} counter"]
+        for model_name, metrics in run_metrics.items():
+            for name, stage in metrics.stages.items():
+                lines.append(f'{metric}{{model="{model_name}",stage="{name}"}} {getattr(stage, attribute)}')
+
+    lines += ["# HELP pipeline_batch_seconds Latency of the batches of each stage of a load",
+              "# TYPE pipeline_batch_seconds histogram"]
+    for model_name, metrics in run_metrics.items():
+        for name, stage in metrics.stages.items():
+            if not stage.batches:
+                continue
+            labels = f'model="{model_name}",stage="{name}"'
+            cumulative = 0
+            for bound, count in zip(BATCH_LATENCY_BUCKETS, stage.batch_buckets):
+                cumulative += count
+                le = '+Inf' if bound == float('inf') else bound
+                lines.append(f'pipeline_batch_seconds_bucket{{{labels},le="{le}"}} {cumulative}')
+            lines.append(f'pipeline_batch_seconds_sum{{{labels}}} {stage.batch_seconds}')
+            lines.append(f'pipeline_batch_seconds_count{{{labels}}} {stage.batches}')
+
+    lines += ["# HELP pipeline_peak_rss_kilobytes Peak resident memory of the pipeline process after each load",
+              "# TYPE pipeline_peak_rss_kilobytes gauge"]
+    for model_name, metrics in run_metrics.items():
+        if metrics.peak_rss_kb is not None:
+            lines.append(f'pipeline_peak_rss_kilobytes{{model="{model_name}"}} {metrics.peak_rss_kb}')
+    return '\n'.join(lines) + '\n'
@@ -0,0 +1,147 @@
+# Helpers for moving rows in and out of postgres with COPY instead of row by row INSERTs.
+# We use the text format as it is what postgres itself produces with COPY TO, so the same
+# rows can be streamed between tables without any conversion.
+
+import datetime
+import io
+
+from django.db import models
+
+COPY_BUFFER_SIZE = 1024 * 1024
+# COPY TO output is held in memory up to this size before spilling to a temporary file
+COPY_SPOOL_SIZE = 64 * 1024 * 1024
+
+COPY_NULL = r'\N'
+COPY_ESCAPES = str.maketrans({
+    '\\': '\\\\',
+    '\t': '\\t',
+    '\n': '\\n',
+    '\r': '\\r',
+})
+
+
+def array_literal(values) -> str:
+    """
+    Render a python list as a postgres array literal, e.g. ['a', None] -> {"a",NULL}
+    """
+    items = []
+    for value in values:
+        if value is None:
+            items.append('NULL')
+        elif isinstance(value, (list, tuple)):
+            items.append(array_literal(value))
+        else:
+            escaped = str(value).replace('\\', '\\\\').replace('"', '\\"')
+            items.append(f'"{escaped}"')
+    return '{' + ','.join(items) + '}'
+
+
+def copy_text_value(value) -> str:
+    """
+    Render a single python value as a field of a COPY text format line
+    """
+    if value is None:
+        return COPY_NULL
+    if isinstance(value, bool):
+        return 't' if value else 'f'
+    if isinstance(value, (list, tuple)):
+        value = array_literal(value)
+    elif isinstance(value, (datetime.date, datetime.time)):
+        value = value.isoformat()
+    else:
+        value = str(value)
+    return value.translate(COPY_ESCAPES)
+
+
+def copy_from(cursor, sql: str, stream) -> None:
+    """
+    Run a COPY ... FROM STDIN statement, reading the data from a file like object.
+    Works with both psycopg2 and psycopg 3 cursors (django wraps either)
+    """
+    raw_cursor = getattr(cursor, 'cursor', cursor)
+    if hasattr(raw_cursor, 'copy_expert'):
+        raw_cursor.copy_expert(sql, stream, size=COPY_BUFFER_SIZE)
+        return
+
+    with raw_cursor.copy(sql) as copy:
+        while data := stream.read(COPY_BUFFER_SIZE):
+            copy.write(data)
+
+
+def copy_to(cursor, sql: str, stream) -> int:
+    """
+    Run a COPY ... TO STDOUT statement, writing the data to a binary file like object.
+    Returns the number of rows copied
+    """
+    raw_cursor = getattr(cursor, 'cursor', cursor)
+    if hasattr(raw_cursor, 'copy_expert'):
+        raw_cursor.copy_expert(sql, stream, size=COPY_BUFFER_SIZE)
+    else:
+        with raw_cursor.copy(sql) as copy:
+            for data in copy:
+                stream.write(data)
+    return raw_cursor.rowcount
+
+
+class CopyWriter:
+    """
+    Buffers output rows for a model as COPY text and writes them to the destination table
+    with COPY ... FROM STDIN, so no model instances are needed on the write path.
+
+    Rows are dictionaries of field name (or attname) to value, the same shape that would be
+    passed to the model constructor. Auto primary keys are only copied if the rows provide them.
+    """
+
+    def __init__(self, model, sample_values: dict, connection, load=None):
+        self.connection = connection
+        self.fields = [
+            f for f in model._meta.concrete_fields
+            if not isinstance(f, models.AutoField) or f.name in sample_values or f.attname in sample_values
+        ]
+        self.table = connection.ops.quote_name(model._meta.db_table)
+        self.columns = [connection.ops.quote_name(f.column) for f in self.fields]
+        # load(cursor, columns, stream) writes the buffered rows, by default straight into the table
+        self.load = load or self.copy_into_table
+        self.buffer = io.StringIO()
+        self.row_count = 0
+
+    def copy_into_table(self, cursor, columns: list[str], stream) -> None:
+        copy_from(cursor, f"COPY {self.table} ({', '.join(columns)}) FROM STDIN", stream)
+
+    def row_values(self, values: dict) -> list:
+        row = []
+        for f in self.fields:
+            if f.attname in values:
+                value = values[f.attname]
+            elif f.name in values:
+                value = values[f.name]
+                if isinstance(value, models.Model):
+                    value = getattr(value, f.target_field.attname)
+            else:
+                value = f.get_default()
+            row.append(f.get_db_prep_save(value, self.connection))
+        return row
+
+    def write(self, values: dict) -> None:
+        self.buffer.write('\t'.join(copy_text_value(v) for v in self.row_values(values)))
+        self.buffer.write('\n')
+        self.row_count += 1
+
+    def detach(self) -> tuple[io.StringIO, int]:
+        """Take the buffered rows and their count, and start a new buffer"""
+        buffer, rows = self.buffer, self.row_count
+        self.buffer = io.StringIO()
+        self.row_count = 0
+        return buffer, rows
+
+    def copy_buffer(self, buffer, connection=None) -> None:
+        """Copy detached rows into the table, on another connection if given (e.g. of another thread)"""
+        buffer.seek(0)
+        with (connection or self.connection).cursor() as cursor:
+            self.load(cursor, self.columns, buffer)
+
+    def flush(self) -> int:
+        """Copy everything buffered so far into the table, returns the number of rows written"""
+        buffer, written = self.detach()
+        self.copy_buffer(buffer)
+        return written
@@ -0,0 +1,119 @@
+# Runs the stages of a row by row load (reading the source, building rows, writing batches) on threads of
+# their own, so the source and destination databases are busy at the same time instead of taking turns.
+# Stages are connected by bounded queues: when a stage falls behind, the ones before it block on a full queue
+# (backpressure), so only a couple of batches are ever waiting in memory.
+
+import itertools
+import queue
+import threading
+import time
+from typing import Callable, Iterable, Iterator
+
+from django.db import connections
+
+# items waiting between two stages
+QUEUE_SIZE = 2
+# source rows are handed to the build stage this many at a time, a queue hop per row would cost more than it saves
+CHUNK_SIZE = 1_000
+# how often a blocked stage checks whether the other side has failed
+POLL_SECONDS = 0.1
+
+_DONE = object()
+
+
+class Stage:
+    """
+    Runs consume(items) on its own thread, items are whatever is put on its queue.
+    If consume fails the error is raised in the thread putting items, or when the stage is closed
+    """
+
+    def __init__(self, consume: Callable[[Iterator], None], queue_size: int = QUEUE_SIZE, name: str | None = None):
+        self.consume = consume
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.error = None
+        self.cancelled = False
+        # time the stage spent waiting for items, and time spent waiting to put items on it
+        self.idle_seconds = 0.0
+        self.blocked_seconds = 0.0
+        self.thread = threading.Thread(target=self.run, name=name, daemon=True)
+
+    def items(self) -> Iterator:
+        while True:
+            start = time.perf_counter()
+            item = self.queue.get()
+            self.idle_seconds += time.perf_counter() - start
+            if item is _DONE or self.cancelled:
+                return
+            yield item
+
+    def run(self) -> None:
+        try:
+            self.consume(self.items())
+        except BaseException as e:
+            self.error = e
+        finally:
+            # the thread gets its own database connections from django
+            connections.close_all()
+
+    def put(self, item) -> None:
+        start = time.perf_counter()
+        try:
+            while True:
+                if self.error is not None:
+                    raise self.error
+                if not self.thread.is_alive():
+                    raise RuntimeError(f"Stage {self.thread.name} stopped")
+                try:
+                    self.queue.put(item, timeout=POLL_SECONDS)
+                    return
+                except queue.Full:
+                    continue
+        finally:
+            self.blocked_seconds += time.perf_counter() - start
+
+    def close(self, cancel: bool = False) -> None:
+        """Wait for the stage to finish what has been put on it, or with cancel to stop as soon as it can"""
+        self.cancelled = cancel
+        while self.thread.is_alive():
+            try:
+                self.queue.put(_DONE, timeout=POLL_SECONDS)
+                break
+            except queue.Full:
+                continue
+        self.thread.join()
+        if self.error is not None and not cancel:
+            raise self.error
+
+    def __enter__(self) -> 'Stage':
+        self.thread.start()
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        self.close(cancel=exc is not None)
+
+
+def run_pipelined(rows: Iterable, build: Callable[[Iterator], Iterator], write: Callable[[object], None],
+                  queue_size: int = QUEUE_SIZE) -> float:
+    """
+    write(batch) for every batch of build(rows), with three stages overlapped:
+    rows are read on the calling thread (a source cursor belongs to the connection of the thread that opened it),
+    built into batches on a second thread and written on a third, which has a database connection of its own.
+    Returns the time the build stage was busy
+    """
+    rows = iter(rows)
+
+    def build_stage(chunks: Iterator) -> None:
+        for batch in build(itertools.chain.from_iterable(chunks)):
+            writer.put(batch)
+
+    def write_stage(batches: Iterator) -> None:
+        for batch in batches:
+            write(batch)
+
+    with Stage(write_stage, queue_size, name='write') as writer:
+        with Stage(build_stage, queue_size, name='build') as builder:
+            start = time.perf_counter()
+            while chunk := list(itertools.islice(rows, CHUNK_SIZE)):
+                builder.put(chunk)
+        builder_seconds = time.perf_counter() - start
+    return max(0.0, builder_seconds - builder.idle_seconds - writer.blocked_seconds)
@@ -0,0 +1,42 @@
+# Run registry of pipeline instances sharing a pipeline (run_pipeline --shared), possibly on different nodes.
+# Instances starting while a shared run is going on join it, and between them load each model of it once,
+# whichever instance gets to a model first loads it. The advisory locks in pipeline.locks say who is
+# loading what right now, the registry keeps what was loaded, by which instance, so the others can skip it.
+
+import uuid
+
+from django.db import models
+
+
+class PipelineRun(models.Model):
+    """
+    A run of the pipeline shared by one or more instances, finished once the last of them leaves
+    """
+    run_id = models.UUIDField(default=uuid.uuid4, unique=True)
+    started = models.DateTimeField(auto_now_add=True)
+    finished = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        db_table = "pipeline_run"
+
+
+class ModelRun(models.Model):
+    """
+    The load of one model in a shared run, by the instance that claimed it
+    """
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+    STATUSES = [(RUNNING, 'Running'), (DONE, 'Done'), (FAILED, 'Failed')]
+
+    run = models.ForeignKey(PipelineRun, on_delete=models.CASCADE, related_name='model_runs')
+    model_name = models.CharField(max_length=255)
+    # host:pid of the instance loading the model
+    instance = models.CharField(max_length=255)
+    status = models.CharField(max_length=10, choices=STATUSES, default=RUNNING)
+    started = models.DateTimeField()
+    finished = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        db_table = "model_run"
+        constraints = [models.UniqueConstraint(fields=['run', 'model_name'], name='model_run_once_per_run')]
@@ -0,0 +1,140 @@
+# Full loads can be written to an unlogged shadow copy of the destination table, which is swapped in
+# with a rename once it is complete. Readers never see an empty or half loaded table, and the old rows
+# are dropped with the old table rather than deleted one by one.
+# Indexes and constraints are only built once the shadow is loaded, and renamed back after the swap.
+# All table names are passed unquoted, quote_name comes from the connection.
+
+import re
+
+INDEX_DEFINITION = re.compile(r'^(CREATE (?:UNIQUE )?INDEX )(\S+)( ON (?:ONLY )?)(\S+)( .*)$')
+
+
+def swap_blocker(cursor, table: str, quote_name) -> str | None:
+    """
+    Why the table can't be swapped for a copy of itself, or None if it can.
+    Foreign keys and views point at the table itself, not its name, so they would follow the old table
+    """
+    cursor.execute(
+        "SELECT count(*) FROM pg_constraint "
+        "WHERE contype = 'f' AND confrelid = %s::regclass AND conrelid <> confrelid",
+        [quote_name(table)]
+    )
+    if cursor.fetchone()[0]:
+        return 'referenced by foreign keys'
+    cursor.execute(
+        "SELECT count(*) FROM pg_depend AS dependency JOIN pg_rewrite AS rule ON rule.oid = dependency.objid "
+        "WHERE dependency.refobjid = %s::regclass AND rule.ev_class <> dependency.refobjid",
+        [quote_name(table)]
+    )
+    if cursor.fetchone()[0]:
+        return 'used by views'
+    return None
+
+
+def create_shadow_table(cursor, table: str, shadow: str, quote_name) -> None:
+    """
+    Unlogged copy of the table structure, without indexes so it loads quickly
+    """
+    cursor.execute(f"DROP TABLE IF EXISTS {quote_name(shadow)}")
+    cursor.execute(
+        f"CREATE UNLOGGED TABLE {quote_name(shadow)} (LIKE {quote_name(table)} "
+        f"INCLUDING DEFAULTS INCLUDING IDENTITY INCLUDING GENERATED INCLUDING CONSTRAINTS)"
+    )
+
+
+def build_shadow_table(cursor, table: str, shadow: str, quote_name) -> list[tuple[str, str, str]]:
+    """
+    Recreate the indexes, constraints and grants of the table on the loaded shadow and make it logged.
+    Index and constraint names have to be unique, so they get temporary names for now.
+    Returns (kind, temporary name, original name) for everything that needs renaming after the swap
+    """
+    cursor.execute(
+        "SELECT conname, contype, conindid, pg_get_constraintdef(oid) FROM pg_constraint "
+        "WHERE conrelid = %s::regclass AND contype IN ('p', 'u', 'f', 'x') ORDER BY contype",
+        [quote_name(table)]
+    )
+    constraints = cursor.fetchall()
+    constraint_indexes = {index_oid: (name, kind) for name, kind, index_oid, _ in constraints if kind in 'pu'}
+    # exclusion constraints build their own index
+    exclusion_indexes = {index_oid for _, kind, index_oid, _ in constraints if kind == 'x'}
+
+    cursor.execute(
+        "SELECT indexrelid, relname, pg_get_indexdef(indexrelid) FROM pg_index "
+        "JOIN pg_class ON pg_class.oid = indexrelid WHERE indrelid = %s::regclass",
+        [quote_name(table)]
+    )
+    indexes = cursor.fetchall()
+
+    renames = []
+    for index_oid, index_name, definition in indexes:
+        if index_oid in exclusion_indexes:
+            continue
+        name = quote_name(f"{shadow[:40]}_{len(renames)}")
+        start, _, on, _, rest = INDEX_DEFINITION.match(definition).groups()
+        cursor.execute(f"{start}{name}{on}{quote_name(shadow)}{rest}")
+        if index_oid in constraint_indexes:
+            constraint_name, kind = constraint_indexes[index_oid]
+            constraint_type = 'PRIMARY KEY' if kind == 'p' else 'UNIQUE'
+            cursor.execute(f"ALTER TABLE {quote_name(shadow)} ADD CONSTRAINT {name} {constraint_type} USING INDEX {name}")
+            renames.append(('constraint', name, quote_name(constraint_name)))
+        else:
+            renames.append(('index', name, quote_name(index_name)))
+
+    for constraint_name, kind, _, definition in constraints:
+        if kind in 'fx':
+            name = quote_name(f"{shadow[:40]}_{len(renames)}")
+            cursor.execute(f"ALTER TABLE {quote_name(shadow)} ADD CONSTRAINT {name} {definition}")
+            renames.append(('constraint', name, quote_name(constraint_name)))
+
+    cursor.execute(
+        "SELECT grantee, privilege_type FROM information_schema.role_table_grants "
+        "WHERE table_schema = current_schema() AND table_name = %s",
+        [table]
+    )
+    for grantee, privilege in cursor.fetchall():
+        grantee = grantee if grantee == 'PUBLIC' else quote_name(grantee)
+        cursor.execute(f"GRANT {privilege} ON {quote_name(shadow)} TO {grantee}")
+
+    cursor.execute(f"ALTER TABLE {quote_name(shadow)} SET LOGGED")
+    return renames
+
+
+def column_sequences(cursor, table: str, quote_name) -> list[tuple[str, str, bool]]:
+    """(column, sequence, is identity) for every column backed by a sequence"""
+    cursor.execute(
+        "SELECT attname, pg_get_serial_sequence(%s, attname), attidentity <> '' FROM pg_attribute "
+        "WHERE attrelid = %s::regclass AND attnum > 0 AND NOT attisdropped",
+        [quote_name(table), quote_name(table)]
+    )
+    return [(column, sequence, identity) for column, sequence, identity in cursor.fetchall() if sequence]
+
+
+def swap_tables(cursor, table: str, shadow: str, renames: list, quote_name) -> None:
+    """
+    Swap the shadow in for the table, should run in a single short transaction
+    """
+    original_sequences = column_sequences(cursor, table, quote_name)
+    old = f"{table[:50]}__old"
+
+    cursor.execute(f"ALTER TABLE {quote_name(table)} RENAME TO {quote_name(old)}")
+    cursor.execute(f"ALTER TABLE {quote_name(shadow)} RENAME TO {quote_name(table)}")
+    for column, sequence, identity in original_sequences:
+        if not identity:
+            # serial columns share the old sequence, it must not be dropped with the old table
+            cursor.execute(f"ALTER SEQUENCE {sequence} OWNED BY {quote_name(table)}.{quote_name(column)}")
+    # django's foreign keys are deferred, checks still pending on the old table would block the drop
+    cursor.execute("SET CONSTRAINTS ALL IMMEDIATE")
+    cursor.execute(f"DROP TABLE {quote_name(old)}")
+
+    for kind, temporary, original in renames:
+        if kind == 'index':
+            cursor.execute(f"ALTER INDEX {temporary} RENAME TO {original}")
+        else:
+            cursor.execute(f"ALTER TABLE {quote_name(table)} RENAME CONSTRAINT {temporary} TO {original}")
+
+    # identity columns got a new sequence with the shadow, give it the old name back
+    shadow_sequences = {column: sequence
+                        for column, sequence, identity in column_sequences(cursor, table, quote_name) if identity}
+    for column, sequence, identity in original_sequences:
+        if identity and shadow_sequences[column] != sequence:
+            cursor.execute(f"ALTER SEQUENCE {shadow_sequences[column]} RENAME TO {sequence.split('.')[-1]}")
@@ -11,7 +11,11 @@ from .core import Schedule, Journey, Activity, Patient, Device, Survey, JourneyA
     SurveyResult
 import datetime
 from typing import Iterable
-from .loaders import IncrementalLoadManager, FullLoadManager
+from .loaders import IncrementalLoadManager, FullLoadManager, ChangeDataCaptureLoadManager
+
+# Patients, devices and surveys can be edited after they are created, so the last CHANGE_WINDOW ids
+# are read again on every run and refreshed in place
+CHANGE_WINDOW = 10_000
 
 
 class IncrementalLog(models.Model):
@@ -39,7 +43,8 @@ class StagingScheduleModel(models.Model):
     StagingScheduleManager = IncrementalLoadManager(table_key='schedule_id',
                                                     table_model=Schedule,
                                                     incremental_key='id',
-                                                    incremental_model=IncrementalLog)
+                                                    incremental_model=IncrementalLog,
+                                                    extract_mode='copy')
     objects = StagingScheduleManager
 
     class Meta:
@@ -56,7 +61,9 @@ class StagingPatientModel(models.Model):
     StagingPatientManager = IncrementalLoadManager(table_key='patient_id',
                                                    table_model=Patient,
                                                    incremental_key='id',
-                                                   incremental_model=IncrementalLog)
+                                                   incremental_model=IncrementalLog,
+                                                   extract_mode='copy',
+                                                   change_window=CHANGE_WINDOW)
 
     objects = StagingPatientManager
 
@@ -72,7 +79,8 @@ class StagingActivityModel(models.Model):
     StagingActivityManager = IncrementalLoadManager(table_key='activity_id',
                                                     table_model=Activity,
                                                     incremental_key='id',
-                                                    incremental_model=IncrementalLog)
+                                                    incremental_model=IncrementalLog,
+                                                    extract_mode='copy')
 
     objects = StagingActivityManager
 
@@ -88,7 +96,8 @@ class StagingJourneyModel(models.Model):
     StagingJourneyManager = IncrementalLoadManager(table_key='journey_id',
                                                    table_model=Journey,
                                                    incremental_key='id',
-                                                   incremental_model=IncrementalLog)
+                                                   incremental_model=IncrementalLog,
+                                                   extract_mode='copy')
 
     objects = StagingJourneyManager
 
@@ -105,7 +114,9 @@ class StagingDeviceModel(models.Model):
     StagingDeviceManager = IncrementalLoadManager(table_key='device_id',
                                                   table_model=Device,
                                                   incremental_key='id',
-                                                  incremental_model=IncrementalLog)
+                                                  incremental_model=IncrementalLog,
+                                                  extract_mode='copy',
+                                                  change_window=CHANGE_WINDOW)
     objects = StagingDeviceManager
 
     class Meta:
@@ -121,7 +132,9 @@ class StagingSurveyModel(models.Model):
     StagingSurveyManager = IncrementalLoadManager(table_key='survey_id',
                                                   table_model=Survey,
                                                   incremental_key='id',
-                                                  incremental_model=IncrementalLog)
+                                                  incremental_model=IncrementalLog,
+                                                  extract_mode='copy',
+                                                  change_window=CHANGE_WINDOW)
 
     objects = StagingSurveyManager
 
@@ -133,7 +146,7 @@ class StagingJourneyActivityModel(models.Model):
     journey_id = models.IntegerField()
     activity_id = models.IntegerField()
 
-    StagingJourneyActivityManager = FullLoadManager(table_model=JourneyActivity)
+    StagingJourneyActivityManager = FullLoadManager(table_model=JourneyActivity, extract_mode='copy', swap=True)
     objects = StagingJourneyActivityManager
 
     class Meta:
@@ -150,8 +163,10 @@ class StagingPatientJourneyModel(models.Model):
     discharge_date = models.DateField(null=True, blank=True)
     consent_date = models.DateField(null=True, blank=True)
     clinician_id = models.IntegerField(null=True, blank=True)
+    # fingerprint of the source row, used to load only the changes
+    row_hash = models.BigIntegerField(null=True, blank=True)
 
-    StagingPatientJourneyManager = FullLoadManager(table_model=PatientJourney)
+    StagingPatientJourneyManager = ChangeDataCaptureLoadManager(table_model=PatientJourney)
     objects = StagingPatientJourneyManager
 
     class Meta:
@@ -167,7 +182,11 @@ class StagingStepResultsModel(models.Model):
         table_key='step_result_date',
         table_model=StepResult,
         incremental_key='date',
-        incremental_model=IncrementalLog)
+        incremental_model=IncrementalLog,
+        # the largest incrementally loaded table, split by date so it is extracted on several connections at once
+        partitions=4,
+        # three narrow columns, bigger batches mean fewer commits
+        batch_size=250_000)
 
     objects = StagingStepResultsManager
 
@@ -184,8 +203,11 @@ class StagingSurveyResultsModel(models.Model):
     score_value = models.IntegerField(blank=True, null=True)
     start_time = models.DateTimeField()
     end_time = models.DateTimeField()
+    # fingerprint of the source row, used to load only the changes
+    row_hash = models.BigIntegerField(null=True, blank=True)
 
-    StagingSurveyResultsManger = FullLoadManager(table_model=SurveyResult)
+    # survey results are by far the biggest staging table and grow without bound, only load the changes
+    StagingSurveyResultsManger = ChangeDataCaptureLoadManager(table_model=SurveyResult)
     objects = StagingSurveyResultsManger
 
     class Meta:
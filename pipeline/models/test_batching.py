@@ -0,0 +1,30 @@
+from .batching import BatchSizer, MIN_BATCH_SIZE
+
+
+def test_fixed_batch_size():
+    batches = BatchSizer.of(10)
+    assert not batches.adaptive
+    assert not batches.full(9, size=10 ** 9)
+    assert batches.full(10)
+    batches.committed(10, size=100, seconds=60)
+    assert batches.rows == 10
+
+
+def test_adaptive_batch_size_memory_ceiling():
+    batches = BatchSizer(rows=10_000, max_bytes=1_000_000)
+    assert batches.full(10, size=1_000_000)
+    # 1000 bytes a row fits 1000 rows under the ceiling
+    batches.committed(2_000, size=2_000_000, seconds=0.1)
+    assert batches.rows == 1_000
+
+
+def test_adaptive_batch_size_commit_latency():
+    batches = BatchSizer(rows=10_000, max_bytes=10 ** 9, target_seconds=2.0)
+    # quick commits grow the batches gradually
+    batches.committed(10_000, size=100_000, seconds=0.01)
+    assert batches.rows == 20_000
+    # slow ones shrink them to the target time
+    batches.committed(20_000, size=200_000, seconds=10)
+    assert batches.rows == 4_000
+    batches.committed(4_000, size=40_000, seconds=100)
+    assert batches.rows == MIN_BATCH_SIZE
@@ -0,0 +1,54 @@
+import gzip
+import threading
+
+from .integrity import IntegrityReport, OrphanSpill
+
+
+def test_integrity_report_keeps_a_bounded_sample():
+    report = IntegrityReport(sample_size=3)
+    for key in range(1_000):
+        report.orphan('schedule_id', key)
+    report.add_orphans('activity_id', 5)
+
+    assert report.as_dict() == {
+        'schedule_id': {'orphans': 1_000, 'sample': [0, 1, 2]},
+        'activity_id': {'orphans': 5, 'sample': []},
+    }
+
+
+def test_integrity_report_merges_forks_into_one_spill(tmp_path):
+    path = tmp_path / 'AnalyticsActivity.orphans.gz'
+    report = IntegrityReport(sample_size=2, spill=OrphanSpill(str(path)))
+    forks = [report.fork() for _ in range(4)]
+
+    def load(fork, start):
+        for key in range(start, start + 100):
+            fork.orphan('schedule_id', key)
+        fork.close()
+
+    threads = [threading.Thread(target=load, args=(fork, i * 100)) for i, fork in enumerate(forks)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    for fork in forks:
+        report.merge(fork)
+
+    assert report.get('schedule_id').count == 400
+    assert len(report.get('schedule_id').sample) == 2
+    with gzip.open(path, 'rt') as f:
+        lines = f.read().splitlines()
+    assert sorted(int(line.split('\t')[1]) for line in lines) == list(range(400))
+
+
+def test_orphan_spill_replaces_the_file_of_a_previous_run(tmp_path):
+    path = str(tmp_path / 'orphans.gz')
+    for run in range(2):
+        spill = OrphanSpill(path)
+        spill.write('schedule_id', run)
+        spill.close()
+        spill.write('schedule_id', run)
+        spill.close()
+
+    with gzip.open(path, 'rt') as f:
+        assert f.read() == 'schedule_id\t1\nschedule_id\t1\n'
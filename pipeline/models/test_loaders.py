@@ -1,27 +1,41 @@
+import datetime
+import threading
 import pytest
 from unittest.mock import patch, MagicMock
-from django.db import transaction
+from django.db import transaction, connections
 from types import SimpleNamespace
 
-from .analytics import AnalyticsScheduleWindow, AnalyticsSchedule, AnalyticsActivity
+from .analytics import (AnalyticsScheduleWindow, AnalyticsSchedule, AnalyticsActivity, AnalyticsSurvey,
+                        AnalyticsPatientJourney, AnalyticsPatientJourneyScheduleWindow, AnalyticsIncrementalLog,
+                        AnalyticsJourney, AnalyticsJourneyActivity, AnalyticsStepResults)
 from .loaders import (
     FullLoadManager,
     IncrementalLoadManager,
     IncrementalTransformLoadManager,
     DataLoader,
+    HashIncrementalQueryManager,
+    KeyIndex,
+    KeyIndexCache,
     ScheduleWindowTransformer
 )
-from .staging import StagingScheduleModel, IncrementalLog
+from .checkpoints import LoadCheckpoint
+from .context import LoadContext
+from .core import SurveyResult
+from .pgcopy import copy_text_value
+from .transformers import CleanText, DropRows
+from .staging import (StagingScheduleModel, StagingSurveyModel, StagingSurveyResultsModel, StagingActivityModel,
+                      StagingJourneyActivityModel, StagingPatientJourneyModel, StagingStepResultsModel, IncrementalLog)
 
 
 @pytest.mark.django_db
 def test_full_load_manager():
     """Ensure FullLoadManager performs a full load correctly."""
-    mock_data = [{'id': 1, 'slug': 'test-schedule'}]  # Ensure it's a list of dicts
+    mock_data = [(1, 'test-schedule')]  # source rows come as tuples of the source fields
 
     with patch('pipeline.models.staging.StagingScheduleModel.objects.all') as mock_all:
         mock_queryset = MagicMock()
-        mock_queryset.values.return_value.iterator.return_value = iter(mock_data)  # Correct way to mock
+        mock_queryset.order_by.return_value = mock_queryset
+        mock_queryset.values_list.return_value.iterator.return_value = iter(mock_data)  # Correct way to mock
         mock_all.return_value = mock_queryset
 
         manager = FullLoadManager(table_model=StagingScheduleModel)
@@ -35,12 +49,12 @@ def test_full_load_manager():
 @pytest.mark.django_db
 def test_incremental_load_manager():
     """Ensure IncrementalLoadManager only loads new records."""
-    mock_data = {'id': 2, 'slug': 'new-schedule'}
+    mock_data = (2, 'new-schedule')
     IncrementalLog.objects.create(schedule_id=1)
 
     with patch('pipeline.models.staging.StagingScheduleModel.objects.filter') as mock_filter:
         mock_queryset = MagicMock()
-        mock_queryset.values.return_value = mock_queryset
+        mock_queryset.values_list.return_value = mock_queryset
         mock_queryset.order_by.return_value = mock_queryset
         mock_queryset.iterator.return_value = iter([mock_data])
         mock_filter.return_value = mock_queryset
@@ -61,13 +75,13 @@ def test_incremental_load_manager():
 @pytest.mark.django_db
 def test_incremental_transform_load_manager():
     """Ensure IncrementalTransformLoadManager applies transformations correctly."""
-    mock_data = {'id': 3, 'slug': '7d-10d-post-op'}
+    mock_data = (3, '7d-10d-post-op')
     IncrementalLog.objects.create(schedule_id=2)
     AnalyticsSchedule.objects.create(id=3, slug='7d-10d-post-op')
 
     with patch('pipeline.models.analytics.AnalyticsSchedule.objects.filter') as mock_filter:
         mock_queryset = MagicMock()
-        mock_queryset.values.return_value = mock_queryset
+        mock_queryset.values_list.return_value = mock_queryset
         mock_queryset.order_by.return_value = mock_queryset
         mock_queryset.iterator.return_value = iter([mock_data])
         mock_filter.return_value = mock_queryset
@@ -89,6 +103,29 @@ def test_incremental_transform_load_manager():
         assert staged.schedule_offset_end == 10
 
 
+@pytest.mark.django_db
+def test_incremental_transform_load_manager_builds_rows_from_tuples():
+    """Ensure transformed rows are built from source tuples, with orphaned foreign keys set to null."""
+    AnalyticsSchedule.objects.create(id=1, slug='2w-post-op')
+    manager = IncrementalTransformLoadManager(table_key='schedule_window', table_model=AnalyticsSchedule,
+                                              incremental_key='id', incremental_model=AnalyticsIncrementalLog,
+                                              transformer=ScheduleWindowTransformer())
+    manager.model = AnalyticsScheduleWindow
+    related_fields = [AnalyticsScheduleWindow._meta.get_field('schedule')]
+    lookup = manager.make_related_fields_lookup(related_fields)
+
+    rows = list(manager.transformed_rows([(1, '2w-post-op'), (2, '1d-3d-post-op'), (3, 'unparsed')], 10))
+    built = [manager.build_output_values(row, related_fields, lookup) for row in rows]
+
+    assert built == [
+        {'id': 1, 'schedule_id': 1, 'schedule_offset_start': 14, 'schedule_offset_end': None,
+         'schedule_milestone_slug': 'operation'},
+        {'id': 2, 'schedule_id': None, 'schedule_offset_start': 1, 'schedule_offset_end': 3,
+         'schedule_milestone_slug': 'operation'},
+    ]
+    assert manager.integrity.as_dict() == {'schedule': {'orphans': 1, 'sample': [2]}}
+
+
 @pytest.mark.django_db
 def test_data_loader_batch_loader():
     """Ensure DataLoader's batch_loader processes batches correctly
@@ -120,15 +157,27 @@ def test_data_loader_batch_loader():
             assert len(batch) == 10
 
 
+@pytest.mark.django_db
+@pytest.mark.parametrize('write_mode', ['bulk_create', 'copy'])
+def test_data_loader_batch_memory(write_mode):
+    """Ensure batches are written before they grow past the memory ceiling."""
+    manager = DataLoader(write_mode=write_mode, batch_memory=2_000)
+    manager.model = manager.table_model = StagingScheduleModel
+    instances = [(schedule_id, f'{schedule_id}w-post-op' * 5) for schedule_id in range(1, 101)]
+
+    with patch.object(DataLoader, 'commit_batch', side_effect=DataLoader.commit_batch, autospec=True) as commit:
+        manager.batch_loader(manager.batch_sizer(), instances[0], iter(instances[1:]), {}, [])
+
+    assert StagingScheduleModel.objects.count() == 100
+    assert commit.call_count > 2
+
+
 @pytest.mark.django_db
 def test_data_loader_missing_relations():
     """Ensure missing foreign keys are handled gracefully."""
 
-    mock_instance = {
-        'id': 1,
-        'schedule_id': 999,  # Non-existent schedule id
-        'content_slug': 'ms',
-    }
+    # id, content_slug, schedule_id
+    mock_instance = (1, 'ms', 999)  # Non-existent schedule id
 
     mock_related_fields = [
         SimpleNamespace(name='schedule_id',
@@ -140,6 +189,7 @@ def test_data_loader_missing_relations():
 
     manager = DataLoader()
     manager.model = AnalyticsActivity
+    manager.table_model = StagingActivityModel
 
     with patch.object(manager.model.objects, "bulk_create") as mock_bulk_create:
         with transaction.atomic():
@@ -148,3 +198,709 @@ def test_data_loader_missing_relations():
         assert mock_bulk_create.call_count == 1
 
     assert AnalyticsActivity.objects.count() == 0
+    assert ('Missing Values', 'schedule_id', 1) in manager.log
+    assert manager.integrity.as_dict() == {'schedule_id': {'orphans': 1, 'sample': [999]}}
+
+
+def test_copy_text_value():
+    """Ensure values are escaped for the COPY text format."""
+    assert copy_text_value(None) == r'\N'
+    assert copy_text_value(True) == 't'
+    assert copy_text_value('a\tb\nc\\d') == 'a\\tb\\nc\\\\d'
+    assert copy_text_value(['x', None, 'y"z']) == '{"x",NULL,"y\\\\"z"}'
+
+
+@pytest.mark.django_db
+def test_full_load_manager_copy_write_mode():
+    """Ensure the COPY write mode loads the same rows as bulk_create would."""
+    # id, slug, version, tags
+    mock_data = [
+        (1, 'tab\tand\nnewline', '', ['a', 'b,c']),
+        (2, 'back\\slash', '2', None),
+    ]
+
+    with patch('pipeline.models.staging.StagingSurveyModel.objects.all') as mock_all:
+        mock_queryset = MagicMock()
+        mock_queryset.order_by.return_value = mock_queryset
+        mock_queryset.values_list.return_value.iterator.return_value = iter(mock_data)
+        mock_all.return_value = mock_queryset
+
+        manager = FullLoadManager(table_model=StagingSurveyModel, write_mode='copy')
+        manager.model = AnalyticsSurvey
+        manager.populate_model()
+
+    first, second = AnalyticsSurvey.objects.order_by('id')
+    assert first.slug == 'tab\tand\nnewline'
+    assert first.version == ''
+    assert first.tags == ['a', 'b,c']
+    assert second.slug == 'back\\slash'
+    assert second.tags is None
+
+
+def test_data_loader_rejects_unknown_write_mode():
+    with pytest.raises(ValueError):
+        DataLoader(write_mode='insert')
+
+
+@pytest.mark.django_db
+def test_incremental_load_manager_copy_extract_mode():
+    """Ensure the COPY extract mode streams only new rows and advances the incremental log."""
+    IncrementalLog.objects.create(schedule_id=1)
+    for schedule_id in (1, 2, 3):
+        StagingScheduleModel.objects.create(id=schedule_id, slug=f'{schedule_id}w-post-op')
+
+    manager = IncrementalLoadManager(
+        table_key='schedule_id',
+        table_model=StagingScheduleModel,
+        incremental_key='id',
+        incremental_model=IncrementalLog,
+        extract_mode='copy'
+    )
+    manager.model = AnalyticsSchedule
+    manager.populate_model()
+
+    assert list(AnalyticsSchedule.objects.order_by('id').values_list('id', 'slug')) == [
+        (2, '2w-post-op'), (3, '3w-post-op')
+    ]
+    assert IncrementalLog.objects.get().schedule_id == 3
+
+
+@pytest.mark.django_db
+def test_full_load_manager_copy_extract_mode():
+    """Ensure the COPY extract mode replaces the destination, but keeps it if the source is empty."""
+    AnalyticsSurvey.objects.create(id=9, slug='stale')
+    StagingSurveyModel.objects.create(id=1, slug='oks', version='1', tags=['knee', 'hip'])
+
+    manager = FullLoadManager(table_model=StagingSurveyModel, extract_mode='copy')
+    manager.model = AnalyticsSurvey
+    manager.populate_model()
+
+    assert list(AnalyticsSurvey.objects.values_list('id', 'tags')) == [(1, ['knee', 'hip'])]
+
+    StagingSurveyModel.objects.all().delete()
+    manager.populate_model()
+
+    assert AnalyticsSurvey.objects.count() == 1
+
+
+@pytest.mark.django_db
+@pytest.mark.parametrize('write_mode', ['bulk_create', 'copy'])
+def test_full_load_manager_transformers(write_mode):
+    """Ensure a transformer chain cleans the rows of a full load before they are written."""
+    StagingSurveyModel.objects.create(id=1, slug=' oks ', version='1')
+    StagingSurveyModel.objects.create(id=2, slug='draft', version='')
+
+    manager = FullLoadManager(table_model=StagingSurveyModel, write_mode=write_mode,
+                              transformers=[CleanText(['slug']), DropRows('version', lambda version: not version)])
+    manager.model = AnalyticsSurvey
+    manager.populate_model()
+
+    assert list(AnalyticsSurvey.objects.values_list('id', 'slug')) == [(1, 'oks')]
+
+
+@pytest.mark.django_db
+@pytest.mark.parametrize('extract_mode', ['copy', 'pushdown'])
+def test_transformers_bring_set_based_loads_through_python(extract_mode):
+    """Ensure a loader given transformers reads its rows in the values extract mode to run them."""
+    StagingSurveyModel.objects.create(id=1, slug=' oks ', version='1')
+
+    manager = FullLoadManager(table_model=StagingSurveyModel, extract_mode=extract_mode,
+                              transformers=[CleanText(['slug'])])
+    manager.model = AnalyticsSurvey
+    manager.populate_model()
+
+    assert manager.extract_mode == 'values'
+    assert list(AnalyticsSurvey.objects.values_list('id', 'slug')) == [(1, 'oks')]
+    with pytest.raises(ValueError):
+        FullLoadManager(table_model=StagingSurveyModel, extract_mode='pushdown', swap=True,
+                        transformers=[CleanText(['slug'])])
+
+
+@pytest.mark.django_db
+def test_populate_model_keeps_each_run_in_its_context():
+    """Ensure runs given a context of their own leave the manager and each other alone."""
+    StagingScheduleModel.objects.create(id=1, slug='2w-post-op')
+    manager = FullLoadManager(table_model=StagingScheduleModel)
+    manager.model = AnalyticsSchedule
+    runs = [LoadContext(), LoadContext()]
+
+    logs = [manager.populate_model(context) for context in runs]
+
+    assert logs[0] == logs[1] == [('Loaded Values', 'AnalyticsSchedule', 1)]
+    assert logs[0] is runs[0].log and logs[1] is runs[1].log
+    assert all(context.metrics.get('write').rows == 1 for context in runs)
+    assert manager.log == [] and manager.metrics.stages == {}
+
+
+def test_key_index():
+    index = KeyIndex([1, 5, 9])
+    assert 5 in index
+    assert 4 not in index
+    assert 10 not in index
+    assert None not in index
+    assert len(index) == 3
+
+
+@pytest.mark.django_db
+def test_related_fields_lookup_resolves_foreign_keys_by_id():
+    """Ensure foreign keys are checked against a key index and assigned by id."""
+    AnalyticsSchedule.objects.create(id=1, slug='2w-post-op')
+    related_fields = [AnalyticsActivity._meta.get_field('schedule_id')]
+
+    manager = DataLoader()
+    manager.model = AnalyticsActivity
+    manager.table_model = StagingActivityModel
+    lookup = manager.make_related_fields_lookup(related_fields)
+
+    assert isinstance(lookup['AnalyticsSchedule'], KeyIndex)
+
+    found = manager.build_output_object((1, 'a', 1), related_fields, lookup)
+    orphan = manager.build_output_object((2, 'b', 7), related_fields, lookup)
+
+    assert found.schedule_id_id == 1
+    assert orphan.schedule_id_id is None
+    assert manager.integrity.as_dict() == {'schedule_id': {'orphans': 1, 'sample': [7]}}
+
+
+@pytest.mark.django_db
+def test_key_index_cache_reuses_indexes_until_the_keys_change():
+    AnalyticsSchedule.objects.create(id=1, slug='2w-post-op')
+    key_field = AnalyticsSchedule._meta.pk
+    cache = KeyIndexCache()
+
+    first = cache.get(AnalyticsSchedule, key_field)
+    assert cache.get(AnalyticsSchedule, key_field) is first
+
+    AnalyticsSchedule.objects.filter(id=1).update(id=2)
+    changed = cache.get(AnalyticsSchedule, key_field)
+    assert changed is not first
+    assert 2 in changed and 1 not in changed
+
+
+def schedule_window_row(activity_slug, start, end=None):
+    return {
+        'patient_id': None,
+        'patient_journey_id': None,
+        'activity_id': None,
+        'activity_content_slug': activity_slug,
+        'schedule_id': None,
+        'schedule_slug': f'{start}d-post-op',
+        'schedule_start_offset_days': start,
+        'schedule_end_offset_days': end,
+        'schedule_milestone_slug': 'operation',
+    }
+
+
+def hash_loader(rows):
+    manager = HashIncrementalQueryManager(
+        table_model=AnalyticsPatientJourney,
+        query=lambda: [tuple(row[name] for name in manager.get_source_fields()) for row in rows])
+    manager.model = AnalyticsPatientJourneyScheduleWindow
+    return manager
+
+
+@pytest.mark.django_db
+def test_patient_journey_schedule_window_streams_its_query_as_tuples():
+    """Ensure the schedule window query is read from a server side cursor as tuples of the model's fields."""
+    AnalyticsSchedule.objects.create(id=1, slug='2w-post-op')
+    AnalyticsScheduleWindow.objects.create(schedule_id=1, schedule_milestone_slug='operation',
+                                           schedule_offset_start=0, schedule_offset_end=14)
+    AnalyticsActivity.objects.create(id=1, content_slug='oks', schedule_id_id=1)
+    AnalyticsJourney.objects.create(id=1, abbreviation='tkr')
+    AnalyticsJourneyActivity.objects.create(journey_id_id=1, activity_id_id=1)
+    AnalyticsPatientJourney.objects.create(id=1, journey_id_id=1)
+
+    manager = AnalyticsPatientJourneyScheduleWindow.objects
+    with patch.object(type(manager), 'source_rows', autospec=True,
+                      side_effect=type(manager).source_rows) as source_rows:
+        manager.populate_model()
+
+    assert source_rows.called
+    loaded = AnalyticsPatientJourneyScheduleWindow.objects.get()
+    assert (loaded.patient_journey_id_id, loaded.activity_id_id, loaded.schedule_slug,
+            loaded.schedule_start_offset_days, loaded.schedule_end_offset_days) == (1, 1, '2w-post-op', 0, 14)
+
+
+@pytest.mark.django_db
+def test_hash_incremental_query_manager():
+    """Ensure only rows whose content changed are inserted or deleted."""
+    rows = [schedule_window_row('oks', 7), schedule_window_row('ohs', 14)]
+    manager = hash_loader(rows)
+    manager.populate_model()
+
+    assert AnalyticsPatientJourneyScheduleWindow.objects.count() == 2
+    unchanged_id = AnalyticsPatientJourneyScheduleWindow.objects.get(activity_content_slug='oks').id
+
+    rows[1] = schedule_window_row('ohs', 14, 28)
+    manager.populate_model()
+
+    loaded = AnalyticsPatientJourneyScheduleWindow.objects.order_by('activity_content_slug')
+    assert [(row.activity_content_slug, row.schedule_end_offset_days) for row in loaded] == [
+        ('ohs', 28), ('oks', None)
+    ]
+    assert loaded[1].id == unchanged_id
+
+
+@pytest.mark.django_db
+def test_hash_incremental_query_manager_leaves_the_table_alone_when_the_query_is_empty():
+    rows = [schedule_window_row('oks', 7)]
+    manager = hash_loader(rows)
+    manager.populate_model()
+
+    rows.clear()
+    manager.populate_model()
+
+    assert AnalyticsPatientJourneyScheduleWindow.objects.count() == 1
+
+
+@pytest.mark.django_db
+def test_hash_incremental_query_manager_matches_identical_rows_by_count():
+    rows = [schedule_window_row('oks', 7)] * 3
+    manager = hash_loader(rows)
+    manager.populate_model()
+    loaded_ids = set(AnalyticsPatientJourneyScheduleWindow.objects.values_list('id', flat=True))
+
+    rows.pop()
+    manager.populate_model()
+    assert AnalyticsPatientJourneyScheduleWindow.objects.count() == 2
+    assert set(AnalyticsPatientJourneyScheduleWindow.objects.values_list('id', flat=True)) < loaded_ids
+
+    rows.extend([schedule_window_row('oks', 7)] * 2)
+    manager.populate_model()
+    assert AnalyticsPatientJourneyScheduleWindow.objects.count() == 4
+
+
+@pytest.mark.django_db
+def test_hash_incremental_query_manager_repairs_rows_changed_after_loading():
+    """Ensure rows are compared as they are stored, a parent reload nulling their foreign keys gets repaired."""
+    AnalyticsPatientJourney.objects.create(id=1, clinician_id=1)
+    row = schedule_window_row('oks', 7)
+    row['patient_journey_id'] = 1
+    manager = hash_loader([row])
+    manager.populate_model()
+
+    # reloading the patient journeys by deleting them sets the foreign keys pointing at them to null
+    AnalyticsPatientJourney.objects.all().delete()
+    AnalyticsPatientJourney.objects.create(id=1, clinician_id=1)
+    assert AnalyticsPatientJourneyScheduleWindow.objects.get().patient_journey_id_id is None
+
+    manager.populate_model()
+
+    assert AnalyticsPatientJourneyScheduleWindow.objects.get().patient_journey_id_id == 1
+
+
+def test_hash_incremental_query_manager_needs_the_copy_write_mode():
+    with pytest.raises(ValueError):
+        HashIncrementalQueryManager(table_model=AnalyticsPatientJourney, query=lambda: iter([]),
+                                    write_mode='bulk_create')
+
+
+def survey_result(pk, score_value):
+    start_time = datetime.datetime(2024, 1, pk, 9, 30)
+    return SurveyResult(id=pk, patient_journey_id=pk, survey_id=1, activity_id=1, device_id=1,
+                        score_value=score_value, start_time=start_time, end_time=start_time)
+
+
+@pytest.mark.django_db(databases=['default', 'msk_db'])
+def test_change_data_capture_load_manager():
+    """Ensure only inserted, updated and deleted source rows are applied."""
+    with connections['msk_db'].schema_editor() as editor:
+        editor.create_model(SurveyResult)
+    SurveyResult.objects.bulk_create([survey_result(1, 10), survey_result(2, 20), survey_result(3, 30)])
+
+    StagingSurveyResultsModel.objects.populate_model()
+
+    assert StagingSurveyResultsModel.objects.count() == 3
+    unchanged_hash = StagingSurveyResultsModel.objects.get(id=1).row_hash
+    assert unchanged_hash is not None
+
+    SurveyResult.objects.filter(id=2).update(score_value=21)
+    SurveyResult.objects.filter(id=3).delete()
+    SurveyResult.objects.bulk_create([survey_result(4, 40)])
+
+    with patch.object(StagingSurveyResultsModel.objects, 'copy_pipeline',
+                      wraps=StagingSurveyResultsModel.objects.copy_pipeline) as copy_pipeline:
+        StagingSurveyResultsModel.objects.populate_model()
+
+    # only the updated and the new row are transferred
+    changed = copy_pipeline.call_args[0][0]
+    assert sorted(changed.values_list('id', flat=True)) == [2, 4]
+    assert list(StagingSurveyResultsModel.objects.order_by('id').values_list('id', 'score_value')) == [
+        (1, 10), (2, 21), (4, 40)
+    ]
+    assert StagingSurveyResultsModel.objects.get(id=1).row_hash == unchanged_hash
+
+
+@pytest.mark.django_db
+def test_incremental_load_manager_pushdown_extract_mode():
+    """Ensure a push down load nulls orphaned foreign keys like the python loaders do."""
+    AnalyticsIncrementalLog.objects.create(activity_id=1)
+    AnalyticsSchedule.objects.create(id=5, slug='2w-post-op')
+    StagingActivityModel.objects.create(id=1, content_slug='already-loaded', schedule_id=5)
+    StagingActivityModel.objects.create(id=2, content_slug='linked', schedule_id=5)
+    StagingActivityModel.objects.create(id=3, content_slug='orphan', schedule_id=99)
+
+    AnalyticsActivity.objects.log = []
+    log = AnalyticsActivity.objects.populate_model()
+
+    assert list(AnalyticsActivity.objects.order_by('id').values_list('id', 'content_slug', 'schedule_id')) == [
+        (2, 'linked', 5), (3, 'orphan', None)
+    ]
+    assert ('Missing Values', 'schedule_id', 1) in log
+    assert ('Loaded Values', 'AnalyticsActivity', 2) in log
+    assert AnalyticsIncrementalLog.objects.get().activity_id == 3
+
+
+def test_pushdown_requires_the_same_database():
+    manager = FullLoadManager(table_model=SurveyResult, extract_mode='pushdown')
+    manager.model = StagingSurveyResultsModel
+
+    with pytest.raises(ValueError):
+        manager.pushdown_pipeline(SurveyResult.objects.all())
+
+
+@pytest.mark.django_db
+@pytest.mark.parametrize('extract_mode', ['values', 'copy', 'pushdown'])
+def test_incremental_load_manager_upserts_change_window(extract_mode):
+    """Ensure rows inside the change window are refreshed in place and new rows are added."""
+    IncrementalLog.objects.create(schedule_id=3)
+    for schedule_id in (1, 2, 3, 4):
+        StagingScheduleModel.objects.create(id=schedule_id, slug=f'{schedule_id}w-post-op')
+    for schedule_id in (1, 2, 3):
+        AnalyticsSchedule.objects.create(id=schedule_id, slug='stale')
+
+    manager = IncrementalLoadManager(
+        table_key='schedule_id',
+        table_model=StagingScheduleModel,
+        incremental_key='id',
+        incremental_model=IncrementalLog,
+        extract_mode=extract_mode,
+        change_window=2
+    )
+    manager.model = AnalyticsSchedule
+    manager.populate_model()
+
+    assert list(AnalyticsSchedule.objects.order_by('id').values_list('id', 'slug')) == [
+        (1, 'stale'), (2, '2w-post-op'), (3, '3w-post-op'), (4, '4w-post-op')
+    ]
+    assert IncrementalLog.objects.get().schedule_id == 4
+
+
+def table_definition(table):
+    """oid, index names and constraint names of a table"""
+    with connections['default'].cursor() as cursor:
+        cursor.execute("SELECT %s::regclass::oid", [table])
+        oid = cursor.fetchone()[0]
+        cursor.execute("SELECT indexname FROM pg_indexes WHERE tablename = %s ORDER BY 1", [table])
+        indexes = [row[0] for row in cursor.fetchall()]
+        cursor.execute("SELECT conname, contype FROM pg_constraint WHERE conrelid = %s ORDER BY 1", [oid])
+        constraints = cursor.fetchall()
+    return oid, indexes, constraints
+
+
+@pytest.mark.django_db
+@pytest.mark.parametrize('write_mode, extract_mode', [('copy', 'values'), ('bulk_create', 'copy'),
+                                                      ('bulk_create', 'pushdown')])
+def test_full_load_manager_swaps_in_shadow_table(write_mode, extract_mode):
+    """Ensure a swap load replaces the table with a loaded copy that has the same indexes and constraints."""
+    AnalyticsSchedule.objects.create(id=5, slug='2w-post-op')
+    journey = AnalyticsJourney.objects.create(id=1, abbreviation='hip')
+    for activity_id in (1, 2):
+        AnalyticsActivity.objects.create(id=activity_id, content_slug=f'activity-{activity_id}', schedule_id_id=5)
+    AnalyticsJourneyActivity.objects.create(journey_id=journey, activity_id_id=1)
+    StagingJourneyActivityModel.objects.create(journey_id=1, activity_id=2)
+    StagingJourneyActivityModel.objects.create(journey_id=1, activity_id=1)
+    oid, indexes, constraints = table_definition('journey_activity')
+
+    manager = FullLoadManager(table_model=StagingJourneyActivityModel, write_mode=write_mode,
+                              extract_mode=extract_mode, swap=True)
+    manager.model = AnalyticsJourneyActivity
+    manager.populate_model()
+
+    assert list(AnalyticsJourneyActivity.objects.order_by('activity_id').values_list('journey_id', 'activity_id')) == [
+        (1, 1), (1, 2)
+    ]
+    new_oid, new_indexes, new_constraints = table_definition('journey_activity')
+    assert new_oid != oid
+    assert (new_indexes, new_constraints) == (indexes, constraints)
+    # the identity sequence keeps working under its old name
+    AnalyticsJourneyActivity.objects.create(journey_id=journey, activity_id_id=1)
+    with connections['default'].cursor() as cursor:
+        cursor.execute("SELECT to_regclass('journey_activity__shadow'), to_regclass('journey_activity__old')")
+        assert cursor.fetchone() == (None, None)
+
+
+@pytest.mark.django_db
+def test_full_load_manager_swap_falls_back_for_referenced_tables():
+    """Ensure a table other tables reference is replaced in place rather than swapped."""
+    AnalyticsPatientJourney.objects.create(id=1, clinician_id=1)
+    StagingPatientJourneyModel.objects.create(id=2, patient_id=1, journey_id=1, clinician_id=2)
+    oid, indexes, constraints = table_definition('patient_journey')
+
+    manager = FullLoadManager(table_model=StagingPatientJourneyModel, extract_mode='pushdown', swap=True)
+    manager.model = AnalyticsPatientJourney
+    manager.populate_model()
+
+    assert list(AnalyticsPatientJourney.objects.values_list('id', 'clinician_id')) == [(2, 2)]
+    assert table_definition('patient_journey') == (oid, indexes, constraints)
+
+
+@pytest.mark.django_db
+def test_full_load_manager_merge_keeps_foreign_keys_pointing_at_it():
+    """Ensure a merge only deletes the rows the source lost, rows pointing at the others keep their keys."""
+    for pk in (1, 2):
+        AnalyticsPatientJourney.objects.create(id=pk, clinician_id=1)
+        AnalyticsPatientJourneyScheduleWindow.objects.create(patient_journey_id_id=pk)
+    StagingPatientJourneyModel.objects.create(id=1, patient_id=1, journey_id=1, clinician_id=2)
+    StagingPatientJourneyModel.objects.create(id=3, patient_id=1, journey_id=1, clinician_id=3)
+
+    manager = FullLoadManager(table_model=StagingPatientJourneyModel, extract_mode='pushdown', merge=True)
+    manager.model = AnalyticsPatientJourney
+    log = manager.populate_model()
+
+    assert list(AnalyticsPatientJourney.objects.order_by('id').values_list('id', 'clinician_id')) == [(1, 2), (3, 3)]
+    assert sorted(AnalyticsPatientJourneyScheduleWindow.objects.values_list('patient_journey_id', flat=True),
+                  key=str) == [1, None]
+    assert ('Deleted Values', 'AnalyticsPatientJourney', 1) in log
+
+
+def test_full_load_manager_swap_needs_a_copy_or_set_based_load():
+    with pytest.raises(ValueError):
+        FullLoadManager(table_model=StagingJourneyActivityModel, swap=True)
+
+
+@pytest.mark.django_db
+def test_key_ranges_split_dates():
+    for day in (1, 2, 3, 10):
+        StagingStepResultsModel.objects.create(patient_id=1, date=datetime.date(2024, 1, day), value=day)
+
+    manager = IncrementalLoadManager(table_key='step_result_date', table_model=StagingStepResultsModel,
+                                     incremental_key='date', incremental_model=AnalyticsIncrementalLog, partitions=3)
+    ranges = manager.key_ranges(StagingStepResultsModel.objects.all())
+
+    assert ranges == [
+        {'date__gte': datetime.date(2024, 1, 1), 'date__lt': datetime.date(2024, 1, 4)},
+        {'date__gte': datetime.date(2024, 1, 4), 'date__lt': datetime.date(2024, 1, 7)},
+        {'date__gte': datetime.date(2024, 1, 7), 'date__lte': datetime.date(2024, 1, 10)},
+    ]
+    assert sum(StagingStepResultsModel.objects.filter(**key_range).count() for key_range in ranges) == 4
+    assert manager.key_ranges(StagingStepResultsModel.objects.none()) == []
+
+
+def partitioned_schedule_manager(extract_mode):
+    manager = IncrementalLoadManager(
+        table_key='schedule_id',
+        table_model=StagingScheduleModel,
+        incremental_key='id',
+        incremental_model=IncrementalLog,
+        extract_mode=extract_mode,
+        partitions=3
+    )
+    manager.model = AnalyticsSchedule
+    return manager
+
+
+# the key ranges load on their own connections, so they can't see data inside a test transaction
+@pytest.mark.django_db(transaction=True)
+@pytest.mark.parametrize('extract_mode', ['values', 'copy', 'pushdown'])
+def test_incremental_load_manager_partitions(extract_mode):
+    """Ensure a table is loaded as several key ranges and the incremental log covers all of them."""
+    IncrementalLog.objects.create(schedule_id=2)
+    for schedule_id in range(1, 13):
+        StagingScheduleModel.objects.create(id=schedule_id, slug=f'{schedule_id}w-post-op')
+
+    manager = partitioned_schedule_manager(extract_mode)
+    with patch.object(manager, 'load_partition', wraps=manager.load_partition) as load_partition:
+        manager.populate_model()
+
+    assert load_partition.call_count == 3
+    assert list(AnalyticsSchedule.objects.order_by('id').values_list('id', flat=True)) == list(range(3, 13))
+    assert IncrementalLog.objects.get().schedule_id == 12
+
+
+@pytest.mark.django_db(transaction=True)
+def test_incremental_load_manager_partition_failure():
+    """Ensure a failed key range leaves the log after the last range loaded in order, and nothing past it."""
+    IncrementalLog.objects.create(schedule_id=0)
+    for schedule_id in range(1, 13):
+        StagingScheduleModel.objects.create(id=schedule_id, slug=f'{schedule_id}w-post-op')
+    set_based_pipeline = IncrementalLoadManager.set_based_pipeline
+
+    def fail_middle_range(self, queryset, replace=False):
+        if queryset.filter(id=6).exists():
+            raise RuntimeError('connection lost')
+        return set_based_pipeline(self, queryset, replace)
+
+    manager = partitioned_schedule_manager('pushdown')
+    with patch.object(IncrementalLoadManager, 'set_based_pipeline', fail_middle_range):
+        with pytest.raises(RuntimeError):
+            manager.populate_model()
+
+    assert IncrementalLog.objects.get().schedule_id == 3
+    assert list(AnalyticsSchedule.objects.order_by('id').values_list('id', flat=True)) == [1, 2, 3]
+
+    manager.populate_model()
+    assert AnalyticsSchedule.objects.count() == 12
+    assert IncrementalLog.objects.get().schedule_id == 12
+
+
+@pytest.mark.django_db
+def test_incremental_load_manager_micro_batch():
+    """Ensure micro-batches load the rows past the incremental log a few at a time, nulling orphans."""
+    AnalyticsIncrementalLog.objects.create(activity_id=1)
+    AnalyticsSchedule.objects.create(id=5, slug='2w-post-op')
+    for activity_id, schedule_id in ((1, 5), (2, 5), (3, 99), (4, 5)):
+        StagingActivityModel.objects.create(id=activity_id, content_slug=f'activity-{activity_id}',
+                                            schedule_id=schedule_id)
+
+    loader = AnalyticsActivity.objects.in_context(LoadContext())
+    assert [loader.micro_batch(rows=2) for _ in range(3)] == [2, 1, 0]
+
+    assert list(AnalyticsActivity.objects.order_by('id').values_list('id', 'schedule_id')) == [
+        (2, 5), (3, None), (4, 5)
+    ]
+    assert loader.integrity.counts() == {'schedule_id': 1}
+    assert AnalyticsIncrementalLog.objects.get().activity_id == 4
+
+
+@pytest.mark.django_db
+def test_micro_batch_loads_rows_sharing_the_last_key_together():
+    """Ensure a micro-batch doesn't stop part way through the rows of a key, the log would skip the rest."""
+    AnalyticsIncrementalLog.objects.create()
+    for day, patients in ((1, 3), (2, 2), (3, 1)):
+        for patient_id in range(patients):
+            StagingStepResultsModel.objects.create(patient_id=patient_id, date=datetime.date(2024, 1, day), value=1)
+
+    loader = AnalyticsStepResults.objects.in_context(LoadContext())
+    assert [loader.micro_batch(rows=2) for _ in range(3)] == [3, 2, 0]
+
+    assert AnalyticsStepResults.objects.count() == 5
+    assert AnalyticsIncrementalLog.objects.get().step_result_date == datetime.date(2024, 1, 2)
+
+
+@pytest.mark.django_db
+def test_micro_batch_leaves_the_newest_key_for_later():
+    """Ensure rows still coming in for the newest date aren't skipped once the log gets to it."""
+    AnalyticsIncrementalLog.objects.create()
+    for day, patient_id in ((1, 0), (1, 1), (2, 0)):
+        StagingStepResultsModel.objects.create(patient_id=patient_id, date=datetime.date(2024, 1, day), value=1)
+
+    loader = AnalyticsStepResults.objects.in_context(LoadContext())
+    assert [loader.micro_batch() for _ in range(2)] == [2, 0]
+
+    # more rows for a date already seen
+    for patient_id in (1, 2):
+        StagingStepResultsModel.objects.create(patient_id=patient_id, date=datetime.date(2024, 1, 2), value=1)
+    assert loader.micro_batch() == 0
+
+    StagingStepResultsModel.objects.create(patient_id=0, date=datetime.date(2024, 1, 3), value=1)
+    assert loader.micro_batch() == 3
+
+    assert AnalyticsStepResults.objects.filter(date=datetime.date(2024, 1, 2)).count() == 3
+    assert AnalyticsIncrementalLog.objects.get().step_result_date == datetime.date(2024, 1, 2)
+
+
+@pytest.mark.django_db
+def test_micro_batch_leaves_unfinished_loads_to_the_pipeline_run():
+    """Ensure micro-batches don't load the rows of a failed load again, nor clear its checkpoint."""
+    IncrementalLog.objects.create(schedule_id=0)
+    for schedule_id in range(1, 11):
+        StagingScheduleModel.objects.create(id=schedule_id, slug=f'{schedule_id}w-post-op')
+    write_batch = DataLoader.write_batch
+
+    def fail_second_batch(self, batch):
+        if batch[0].id == 5:
+            raise RuntimeError('connection lost')
+        return write_batch(self, batch)
+
+    manager = IncrementalLoadManager(
+        table_key='schedule_id',
+        table_model=StagingScheduleModel,
+        incremental_key='id',
+        incremental_model=IncrementalLog
+    )
+    manager.model = AnalyticsSchedule
+    manager.batch_size = 4
+    with patch.object(DataLoader, 'write_batch', fail_second_batch):
+        with pytest.raises(RuntimeError):
+            manager.populate_model()
+
+    assert manager.micro_batch() == 0
+    assert AnalyticsSchedule.objects.count() == 4
+    assert LoadCheckpoint.objects.filter(model_name='AnalyticsSchedule').exists()
+
+    manager.populate_model()
+    StagingScheduleModel.objects.create(id=11, slug='11w-post-op')
+    assert manager.micro_batch() == 1
+    assert sorted(AnalyticsSchedule.objects.values_list('id', flat=True)) == list(range(1, 12))
+    assert not LoadCheckpoint.objects.exists()
+
+
+@pytest.mark.django_db
+@pytest.mark.parametrize('resume', [True, False])
+def test_incremental_load_manager_checkpoint(resume):
+    """Ensure a failed load leaves a checkpoint of its last batch, and is either resumed from it or started over."""
+    IncrementalLog.objects.create(schedule_id=0)
+    for schedule_id in range(1, 11):
+        StagingScheduleModel.objects.create(id=schedule_id, slug=f'{schedule_id}w-post-op')
+    write_batch = DataLoader.write_batch
+
+    def fail_second_batch(self, batch):
+        if batch[0].id == 5:
+            raise RuntimeError('connection lost')
+        return write_batch(self, batch)
+
+    manager = IncrementalLoadManager(
+        table_key='schedule_id',
+        table_model=StagingScheduleModel,
+        incremental_key='id',
+        incremental_model=IncrementalLog
+    )
+    manager.model = AnalyticsSchedule
+    # small batches, so the load commits a few of them
+    manager.batch_size = 4
+
+    with patch.object(DataLoader, 'write_batch', fail_second_batch):
+        with pytest.raises(RuntimeError):
+            manager.populate_model()
+
+    checkpoint = LoadCheckpoint.objects.get(model_name='AnalyticsSchedule')
+    assert (checkpoint.key_field, checkpoint.last_key, checkpoint.rows) == ('id', '4', 4)
+    assert AnalyticsSchedule.objects.count() == 4
+    assert IncrementalLog.objects.get().schedule_id == 0
+
+    manager.resume = resume
+    with patch.object(DataLoader, 'write_batch', side_effect=write_batch, autospec=True) as written:
+        manager.populate_model()
+
+    loaded = [row.id for batch in written.call_args_list for row in batch.args[1]]
+    assert loaded == (list(range(4, 11)) if resume else list(range(1, 11)))
+    assert list(AnalyticsSchedule.objects.order_by('id').values_list('id', flat=True)) == list(range(1, 11))
+    assert IncrementalLog.objects.get().schedule_id == 10
+    assert not LoadCheckpoint.objects.exists()
+
+
+# batches are written on another thread with its own connection, so the test data has to be committed
+@pytest.mark.django_db(transaction=True)
+@pytest.mark.parametrize('write_mode', ['bulk_create', 'copy'])
+def test_data_loader_pipelined_writes(write_mode):
+    """Ensure a pipelined load writes its batches on another thread, in key order."""
+    manager = DataLoader(write_mode=write_mode, batch_size=10)
+    manager.model = manager.table_model = StagingScheduleModel
+    manager.checkpoint_key = 'id'
+    instances = [(schedule_id, f'{schedule_id}w-post-op') for schedule_id in range(1, 101)]
+    writing_threads = set()
+    commit_batch = DataLoader.commit_batch
+
+    def record_thread(self, batches, batch):
+        writing_threads.add(threading.current_thread())
+        return commit_batch(self, batches, batch)
+
+    with patch.object(DataLoader, 'commit_batch', record_thread):
+        manager.batch_loader(manager.batch_sizer(), instances[0], iter(instances[1:]), {}, [])
+
+    assert threading.current_thread() not in writing_threads
+    assert list(StagingScheduleModel.objects.order_by('id').values_list('id', flat=True)) == list(range(1, 101))
+    assert LoadCheckpoint.objects.get(model_name='StagingScheduleModel').last_key == '100'
+    assert manager.metrics.get('write').batches == 10
+    assert ('Loaded Values', 'StagingScheduleModel', 100) in manager.log
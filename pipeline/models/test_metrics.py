@@ -0,0 +1,103 @@
+import datetime
+import json
+import time
+import uuid
+
+import pytest
+
+from .analytics import AnalyticsSchedule
+from .context import LoadContext, collect_metrics
+from .loaders import IncrementalLoadManager
+from .metrics import (LoadMetrics, LoaderRunMetric, save_run_metrics, metrics_json, prometheus_text,
+                      BATCH_LATENCY_BUCKETS)
+from .staging import StagingScheduleModel, IncrementalLog
+
+
+def test_stage_leaves_out_excluded_stages():
+    """Ensure time spent in a nested stage is not counted twice."""
+    metrics = LoadMetrics()
+
+    def slow_rows():
+        for i in range(2):
+            time.sleep(0.02)
+            yield i
+
+    with metrics.stage('build', exclude=['source_query']) as build:
+        for _ in metrics.timed_rows('source_query', slow_rows()):
+            build.rows += 1
+
+    assert metrics.stages['source_query'].rows == 2
+    assert metrics.stages['source_query'].seconds >= 0.04
+    assert metrics.stages['build'].seconds < 0.02
+    assert metrics.peak_rss_kb > 0
+
+
+def test_timed_rows_observes_each_fetched_chunk():
+    """Ensure rows read from a cursor in chunks are timed a chunk at a time, including the last partial one."""
+    metrics = LoadMetrics()
+
+    assert list(metrics.timed_rows('source_query', range(25), chunk_size=10)) == list(range(25))
+    assert metrics.stages['source_query'].rows == 25
+    assert metrics.stages['source_query'].batches == 3
+
+
+def test_batch_latency_histogram():
+    metrics = LoadMetrics()
+    stage = metrics.get('write')
+    for seconds in (0.001, 0.2, 0.2, 100):
+        stage.observe_batch(seconds)
+
+    assert stage.batches == 4
+    assert stage.batch_buckets[0] == 1
+    assert stage.batch_buckets[BATCH_LATENCY_BUCKETS.index(0.25)] == 2
+    assert stage.batch_buckets[-1] == 1
+
+
+def test_prometheus_text():
+    metrics = LoadMetrics()
+    with metrics.batch('write') as write:
+        write.rows += 10
+
+    text = prometheus_text({'AnalyticsSchedule': metrics})
+
+    assert 'pipeline_stage_rows_total{model="AnalyticsSchedule",stage="write"} 10' in text
+    assert 'pipeline_batch_seconds_bucket{model="AnalyticsSchedule",stage="write",le="+Inf"} 1' in text
+    assert 'pipeline_batch_seconds_count{model="AnalyticsSchedule",stage="write"} 1' in text
+    assert '# TYPE pipeline_batch_seconds histogram' in text
+
+
+@pytest.mark.django_db
+@pytest.mark.parametrize('write_mode, extract_mode, stages', [
+    ('bulk_create', 'values', {'related_lookup', 'source_query', 'build', 'write'}),
+    ('copy', 'values', {'related_lookup', 'source_query', 'build', 'write'}),
+    ('bulk_create', 'copy', {'source_query', 'write'}),
+    ('bulk_create', 'pushdown', {'pushdown'}),
+])
+def test_loader_records_stage_metrics(write_mode, extract_mode, stages):
+    """Ensure each way of loading reports its stages and rows, and they can be stored in the run history."""
+    for schedule_id in (1, 2, 3):
+        StagingScheduleModel.objects.create(id=schedule_id, slug=f'{schedule_id}w-post-op')
+    IncrementalLog.objects.create(schedule_id=0)
+
+    manager = IncrementalLoadManager(
+        table_key='schedule_id',
+        table_model=StagingScheduleModel,
+        incremental_key='id',
+        incremental_model=IncrementalLog,
+        write_mode=write_mode,
+        extract_mode=extract_mode
+    )
+    manager.model = AnalyticsSchedule
+    context = LoadContext()
+    manager.populate_model(context)
+
+    run_metrics = collect_metrics({AnalyticsSchedule: context})
+    assert set(run_metrics['AnalyticsSchedule'].stages) == stages
+    assert run_metrics['AnalyticsSchedule'].stages[sorted(stages)[-1]].rows == 3
+    assert not manager.metrics.stages
+
+    run_id, run_started = uuid.uuid4(), datetime.datetime.now(datetime.timezone.utc)
+    save_run_metrics(run_id, run_started, run_metrics)
+    assert set(LoaderRunMetric.objects.filter(run_id=run_id).values_list('stage', flat=True)) == stages
+    exported = json.loads(metrics_json(run_id, run_started, run_metrics))
+    assert set(exported['loaders']['AnalyticsSchedule']['stages']) == stages
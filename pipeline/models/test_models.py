@@ -40,16 +40,13 @@ def test_incremental_log_defaults():
 @pytest.mark.django_db(databases=['msk_db', 'default'])
 def test_staging_models_incremental_load():
     """tests incremental loading"""
-    mock_data = {
-        'id': 1,
-        'age_bracket': "Adult",
-        'sex': "M",
-        'hospital': "General"
-    }
-
-    with patch('pipeline.models.core.Patient.objects') as mock_objects:
+    # id, age_bracket, sex, hospital
+    mock_data = (1, "Adult", "M", "General")
+
+    with patch('pipeline.models.core.Patient.objects') as mock_objects, \
+            patch.object(StagingPatientModel.objects, 'extract_mode', 'values'):
         mock_queryset = MagicMock()
-        mock_queryset.values.return_value = mock_queryset
+        mock_queryset.values_list.return_value = mock_queryset
         mock_queryset.order_by.return_value = mock_queryset
         mock_queryset.iterator.return_value = iter([mock_data])
         mock_objects.all.return_value = mock_queryset
@@ -81,3 +78,19 @@ def test_schedule_window_transformer():
 
     assert transformed["schedule_offset_start"] == 7
     assert transformed["schedule_milestone_slug"] == "operation"
+
+
+def test_schedule_window_transformer_transform_many():
+    """Ensure a batch of slugs is transformed in order, parsing each distinct slug once."""
+    slugs = ["7d-op", "2w-1w-pre-appt", "7d-op", "not-a-slug", "7d-op"]
+
+    with patch.object(ScheduleWindowTransformer, 'process_slug',
+                      wraps=ScheduleWindowTransformer.process_slug) as process_slug:
+        ScheduleWindowTransformer.parse_slug.cache_clear()
+        transformed = ScheduleWindowTransformer.transform_many(slugs)
+
+    assert transformed == [ScheduleWindowTransformer.transform(slug) for slug in slugs]
+    assert transformed[1] == {'schedule_offset_start': -14, 'schedule_offset_end': -7,
+                              'schedule_milestone_slug': 'appointment'}
+    assert transformed[3] == {}
+    assert process_slug.call_count == 3
@@ -0,0 +1,57 @@
+import threading
+
+import pytest
+
+from .pipelining import run_pipelined, Stage
+
+
+def batched(rows, size=10):
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) == size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def test_run_pipelined_writes_every_batch_in_order():
+    written, threads = [], set()
+
+    def write(batch):
+        threads.add(threading.current_thread())
+        written.append(batch)
+
+    run_pipelined(range(2_500), batched, write)
+
+    assert [row for batch in written for row in batch] == list(range(2_500))
+    assert threading.current_thread() not in threads
+
+
+def test_run_pipelined_raises_write_errors():
+    def write(batch):
+        if batch[0] == 500:
+            raise RuntimeError('connection lost')
+
+    read = []
+
+    def rows():
+        for row in range(100_000):
+            read.append(row)
+            yield row
+
+    with pytest.raises(RuntimeError, match='connection lost'):
+        run_pipelined(rows(), batched, write)
+    # the queues are bounded, so reading stopped soon after the write failed
+    assert len(read) < 100_000
+
+
+def test_stage_stops_when_cancelled():
+    consumed = []
+    with pytest.raises(ValueError):
+        with Stage(lambda items: consumed.extend(items)) as stage:
+            stage.put(1)
+            raise ValueError
+    assert not stage.thread.is_alive()
+    assert consumed in ([], [1])
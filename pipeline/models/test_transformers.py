@@ -0,0 +1,37 @@
+import pytest
+
+from .transformers import ColumnBatch, CleanText, DropRows, MapColumns, TransformerChain
+
+
+def test_column_batch_round_trip():
+    batch = ColumnBatch.from_rows(['id', 'slug'], [(1, 'a'), (2, 'b'), (3, 'c')])
+    assert batch['slug'] == ['a', 'b', 'c']
+
+    batch['upper'] = [slug.upper() for slug in batch['slug']]
+    batch.keep([True, False, True])
+
+    assert list(batch.rows(['id', 'upper'])) == [(1, 'A'), (3, 'C')]
+    with pytest.raises(ValueError):
+        batch['short'] = [1]
+
+
+def test_transformer_chain_runs_in_order_a_batch_at_a_time():
+    calls = []
+
+    def lengths(values):
+        calls.append(len(values))
+        return [len(value) for value in values]
+
+    chain = TransformerChain([
+        CleanText(['slug'], blank_as_null=True),
+        DropRows('slug', lambda slug: slug is None),
+        MapColumns('slug', lengths, output_field='slug_length'),
+    ], batch_size=2)
+    rows = [(1, ' 2w-post-op '), (2, '  '), (3, '3w'), (4, 'x')]
+
+    assert chain.fields(['id', 'slug']) == ['id', 'slug', 'slug_length']
+    assert list(chain.transform_rows(rows, ['id', 'slug'])) == [
+        (1, '2w-post-op', 10), (3, '3w', 2), (4, 'x', 1)
+    ]
+    # one call per batch, the blank row was dropped before the lengths were taken
+    assert calls == [1, 2]
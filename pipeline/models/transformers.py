@@ -0,0 +1,153 @@
+# Chains of batch transformers, attached to any loader with transformers=[...]. Copy and pushdown loaders given
+# transformers read their rows in the values extract mode instead, the rows have to come through python.
+# Rows are handed to each transformer a batch at a time as columns (a list of values per field), so a cleansing
+# step costs one python call per batch, and can work on a whole column at once with a comprehension,
+# a lookup table or numpy.
+
+import itertools
+from abc import ABC, abstractmethod
+from typing import Callable, Iterable, Iterator
+
+# rows per transformed batch, the batch is held as columns while the chain runs
+TRANSFORM_BATCH_SIZE = 10_000
+
+
+class ColumnBatch:
+    """
+    A batch of rows as columns, a list of values per field, all of the same length
+    """
+
+    def __init__(self, columns: dict[str, list]):
+        self.columns = columns
+
+    @classmethod
+    def from_rows(cls, fields: list[str], rows: list[tuple]) -> 'ColumnBatch':
+        if not rows:
+            return cls({name: [] for name in fields})
+        return cls(dict(zip(fields, map(list, zip(*rows)))))
+
+    def __len__(self) -> int:
+        return len(next(iter(self.columns.values()), ()))
+
+    def __contains__(self, name: str) -> bool:
+        return name in self.columns
+
+    def __getitem__(self, name: str) -> list:
+        return self.columns[name]
+
+    def __setitem__(self, name: str, values: list) -> None:
+        """Add or replace a column"""
+        values = list(values)
+        if self.columns and len(values) != len(self):
+            raise ValueError(f"Column {name} has {len(values)} values, the batch has {len(self)} rows")
+        self.columns[name] = values
+
+    def keep(self, mask: Iterable[bool]) -> None:
+        """Drop the rows where mask is false"""
+        mask = list(mask)
+        for name, values in self.columns.items():
+            self.columns[name] = list(itertools.compress(values, mask))
+
+    def rows(self, fields: list[str]) -> Iterator[tuple]:
+        return zip(*(self.columns[name] for name in fields))
+
+
+class BatchTransformer(ABC):
+    """
+    A step of a transformer chain. Loaders can share a transformer between threads, keep it stateless
+    """
+
+    @property
+    def output_fields(self) -> list[str]:
+        """Fields the transformer adds to the rows, fields it only changes or drops rows by don't need listing"""
+        return []
+
+    @abstractmethod
+    def transform_batch(self, batch: ColumnBatch) -> None:
+        """Change the batch in place, replacing or adding columns and dropping rows"""
+
+
+class MapColumns(BatchTransformer):
+    """
+    Replace each of the fields with function(values) of the whole column, or with output_field
+    a single field into a new one
+    """
+
+    def __init__(self, fields: str | list[str], function: Callable[[list], Iterable], output_field: str | None = None):
+        self.fields = [fields] if isinstance(fields, str) else list(fields)
+        if output_field and len(self.fields) != 1:
+            raise ValueError("An output field can only be made from one field")
+        self.function = function
+        self.output_field = output_field
+
+    @property
+    def output_fields(self) -> list[str]:
+        return [self.output_field] if self.output_field else []
+
+    def transform_batch(self, batch: ColumnBatch) -> None:
+        for name in self.fields:
+            batch[self.output_field or name] = self.function(batch[name])
+
+
+class CleanText(BatchTransformer):
+    """Strip the whitespace around text values, with blank_as_null blank values become null"""
+
+    def __init__(self, fields: list[str], blank_as_null: bool = False):
+        self.fields = list(fields)
+        self.blank_as_null = blank_as_null
+
+    def transform_batch(self, batch: ColumnBatch) -> None:
+        for name in self.fields:
+            values = [value.strip() if isinstance(value, str) else value for value in batch[name]]
+            if self.blank_as_null:
+                values = [value if value != '' else None for value in values]
+            batch[name] = values
+
+
+class DropRows(BatchTransformer):
+    """Drop the rows where predicate(value) is true for the value of field"""
+
+    def __init__(self, field: str, predicate: Callable[[object], bool]):
+        self.field = field
+        self.predicate = predicate
+
+    def transform_batch(self, batch: ColumnBatch) -> None:
+        batch.keep([not self.predicate(value) for value in batch[self.field]])
+
+
+class TransformerChain:
+    """
+    Runs batch transformers in order over the rows of a load
+    """
+
+    def __init__(self, transformers: Iterable[BatchTransformer], batch_size: int = TRANSFORM_BATCH_SIZE):
+        self.transformers = list(transformers)
+        self.batch_size = batch_size
+
+    def __bool__(self) -> bool:
+        return bool(self.transformers)
+
+    def fields(self, source_fields: list[str]) -> list[str]:
+        """Fields of the transformed rows, the source fields followed by the ones the transformers add"""
+        fields = list(source_fields)
+        for transformer in self.transformers:
+            fields.extend(name for name in transformer.output_fields if name not in fields)
+        return fields
+
+    def transform(self, batch: ColumnBatch) -> ColumnBatch:
+        for transformer in self.transformers:
+            if not len(batch):
+                break
+            transformer.transform_batch(batch)
+        return batch
+
+    def transform_rows(self, rows: Iterable[tuple], source_fields: list[str]) -> Iterator[tuple]:
+        """Transform rows of the source fields, the rows that come out are rows of fields(source_fields)"""
+        fields = self.fields(source_fields)
+        rows = iter(rows)
+        while chunk := list(itertools.islice(rows, self.batch_size)):
+            batch = self.transform(ColumnBatch.from_rows(source_fields, chunk))
+            missing = [name for name in fields if name not in batch]
+            if missing and len(batch):
+                raise ValueError(f"Transformers didn't add the fields {missing}")
+            yield from batch.rows(fields)
@@ -0,0 +1,175 @@
+# Works out which loaders in a pipeline depend on each other so independent ones can run side by side.
+# Dependencies come from each model's foreign keys, plus anything a manager declares in depends_on
+# (query based loaders read from tables they have no foreign key to).
+
+import logging
+import traceback
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+from django.db import connections
+
+from pipeline.coordination import LOADED, BUSY, FAILED_ELSEWHERE
+from pipeline.locks import model_lock
+
+logger = logging.getLogger('Pipeline Runner')
+
+
+def model_dependencies(model, pipeline) -> set:
+    """
+    Models in the pipeline that have to be loaded before this one
+    """
+    dependencies = set()
+    for fld in model._meta.get_fields():
+        if not fld.is_relation or fld.auto_created or fld.many_to_many:
+            continue
+        dependencies.add(fld.related_model)
+    dependencies.update(getattr(model.objects, 'depends_on', ()))
+    # anything outside this pipeline (e.g. staging for analytics) is assumed to be loaded already
+    return {dep for dep in dependencies if dep in pipeline and dep is not model}
+
+
+def dependency_graph(pipeline) -> dict:
+    return {model: model_dependencies(model, pipeline) for model in pipeline}
+
+
+def topological_order(pipeline, graph: dict) -> list:
+    """
+    Order the pipeline so every model comes after its dependencies,
+    keeping the declared order wherever the graph allows it
+    """
+    ordered = []
+    done = set()
+    pending = list(pipeline)
+    while pending:
+        ready = next((model for model in pending if graph[model] <= done), None)
+        if ready is None:
+            raise ValueError(f"Dependency cycle between {[model.__name__ for model in pending]}")
+        pending.remove(ready)
+        done.add(ready)
+        ordered.append(ready)
+    return ordered
+
+
+def populate_locked(model, context=None):
+    """
+    Load a model holding its lock, first waiting for anything else loading it (a micro-batch of the same table)
+    """
+    with model_lock(model, wait=True):
+        return model.objects.populate_model(context)
+
+
+def populate_in_worker(model, context=None):
+    """
+    Each worker thread gets its own database connections from django, close them when done
+    """
+    try:
+        return populate_locked(model, context)
+    finally:
+        connections.close_all()
+
+
+def run_parallel(pipeline, graph: dict, workers: int, contexts: dict | None = None) -> dict:
+    """
+    Run loaders on a thread pool as soon as everything they depend on has loaded, each in its LoadContext
+    from contexts if given.
+    After a failure nothing new is started, loaders already running are allowed to finish.
+    """
+    topological_order(pipeline, graph)  # fail early on cycles
+    contexts = contexts or {}
+
+    analytics_log = {}
+    pending = list(pipeline)
+    done = set()
+    running = {}
+    failed = False
+
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='pipeline') as executor:
+        while pending or running:
+            if not failed:
+                for model in [m for m in pending if graph[m] <= done]:
+                    if len(running) >= workers:
+                        break
+                    pending.remove(model)
+                    running[executor.submit(populate_in_worker, model, contexts.get(model))] = model
+
+            if not running:
+                break
+
+            finished, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in finished:
+                model = running.pop(future)
+                try:
+                    analytics_log[model.__name__] = future.result()
+                    done.add(model)
+                except Exception as e:
+                    logger.error(f"Error loading {model.__name__}:\n\t\t{e}")
+                    traceback.print_exception(e)
+                    failed = True
+
+    return analytics_log
+
+
+def populate_shared(shared_run, model, context=None, wait=False):
+    try:
+        return shared_run.populate(model, context, wait)
+    finally:
+        connections.close_all()
+
+
+def run_shared(pipeline, graph: dict, workers: int, contexts: dict | None, shared_run) -> dict:
+    """
+    Run the pipeline's part of a run shared with other instances (see pipeline.coordination) on a thread pool.
+    Models another instance is loading are put aside while there's something else to load, then waited for.
+    Only the models loaded here make it into the log
+    """
+    topological_order(pipeline, graph)  # fail early on cycles
+    contexts = contexts or {}
+
+    analytics_log = {}
+    pending = list(pipeline)
+    busy = set()
+    done = set()
+    running = {}
+    failed = False
+
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='pipeline') as executor:
+        while pending or running:
+            if not failed:
+                ready = [m for m in pending if graph[m] <= done]
+                # wait for other instances only when there's nothing else to do
+                if not running and all(m in busy for m in ready):
+                    to_start = [(m, True) for m in ready]
+                else:
+                    to_start = [(m, False) for m in ready if m not in busy]
+                for model, wait_for in to_start[:workers - len(running)]:
+                    pending.remove(model)
+                    future = executor.submit(populate_shared, shared_run, model, contexts.get(model), wait_for)
+                    running[future] = model
+
+            if not running:
+                break
+
+            finished, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in finished:
+                model = running.pop(future)
+                try:
+                    outcome, result = future.result()
+                except Exception as e:
+                    logger.error(f"Error loading {model.__name__}:\n\t\t{e}")
+                    traceback.print_exception(e)
+                    failed = True
+                    continue
+                if outcome == BUSY:
+                    busy.add(model)
+                    pending.append(model)
+                elif outcome == FAILED_ELSEWHERE:
+                    logger.error(f"{model.__name__} failed on {result}")
+                    failed = True
+                else:
+                    if outcome == LOADED:
+                        analytics_log[model.__name__] = result
+                    else:
+                        logger.info(f"{model.__name__} was loaded by {result}")
+                    done.add(model)
+
+    return analytics_log
@@ -0,0 +1,170 @@
+# Deterministic synthetic data for the msk_db source tables, so loaders can be benchmarked at any scale
+# on a local postgres. The same scale and seed always produce the same rows.
+# Row counts of each table are fixed proportions of the scale, survey results and step results dominate
+# like they do in the real database.
+
+import datetime
+import io
+import random
+from itertools import accumulate
+
+from django.db import connections
+
+from pipeline.models.core import (Schedule, Activity, Device, Journey, JourneyActivity, Patient, PatientJourney,
+                                  StepResult, Survey, SurveyResult)
+from pipeline.models.pgcopy import copy_from, copy_text_value
+
+# rows of each table per row of scale, with a minimum so small scales still have every table
+TABLE_PROPORTIONS = {
+    Schedule: (0.0005, 10),
+    Journey: (0.00005, 5),
+    Activity: (0.002, 20),
+    Survey: (0.0002, 10),
+    JourneyActivity: (0.005, 20),
+    Device: (0.02, 10),
+    Patient: (0.05, 10),
+    PatientJourney: (0.08, 10),
+    StepResult: (0.25, 10),
+    SurveyResult: (0.55, 10),
+}
+
+MILESTONES = ['post-op', 'pre-op', 'appt', 'post-appt', 'reg', 'dis']
+UNITS = ['d', 'w', 'm', 'y']
+BASE_DATE = datetime.date(2020, 1, 1)
+COPY_CHUNK_ROWS = 100_000
+
+
+class SyntheticDataGenerator:
+    """
+    scale: roughly the total number of source rows
+    orphan_rate: share of foreign keys that point at ids that don't exist
+    distinct_slugs: how many different schedule slugs there are
+    slug_skew: zipf exponent of how often each slug is used, 0 is uniform
+    """
+
+    def __init__(self, scale: int, seed: int = 0, orphan_rate: float = 0.0, distinct_slugs: int = 50,
+                 slug_skew: float = 1.0):
+        self.scale = scale
+        self.seed = seed
+        self.orphan_rate = orphan_rate
+        self.distinct_slugs = distinct_slugs
+        self.slug_skew = slug_skew
+        self.counts = {model: max(minimum, int(scale * share)) for model, (share, minimum) in TABLE_PROPORTIONS.items()}
+
+    def table_random(self, model) -> random.Random:
+        # a generator per table, so the rows of a table don't depend on which other tables were generated
+        return random.Random(f"{self.seed}-{model._meta.db_table}")
+
+    def slugs(self) -> list[str]:
+        pool = random.Random(f"{self.seed}-slugs")
+        slugs = []
+        while len(slugs) < self.distinct_slugs:
+            start, length = pool.randint(0, 12), pool.randint(0, 12)
+            unit, milestone = pool.choice(UNITS), pool.choice(MILESTONES)
+            window = f"{start}{unit}-{start + length}{unit}" if length else f"{start}{unit}"
+            if (slug := f"{window}-{milestone}") not in slugs:
+                slugs.append(slug)
+        return slugs
+
+    def foreign_key(self, rng: random.Random, model) -> int:
+        """A random id of the model, or one past the end of it at the orphan rate"""
+        count = self.counts[model]
+        if self.orphan_rate and rng.random() < self.orphan_rate:
+            return count + rng.randint(1, count)
+        return rng.randint(1, count)
+
+    def rows(self, model):
+        """Yield the rows of a table as tuples in the order of model._meta.concrete_fields"""
+        rng = self.table_random(model)
+        count = self.counts[model]
+        ids = range(1, count + 1)
+
+        if model is Schedule:
+            slugs = self.slugs()
+            weights = list(accumulate(1 / (rank + 1) ** self.slug_skew for rank in range(len(slugs))))
+            for i in ids:
+                yield i, rng.choices(slugs, cum_weights=weights)[0]
+        elif model is Journey:
+            for i in ids:
+                yield i, f"J{i}", rng.choice(['hip', 'knee', 'shoulder', 'spine'])
+        elif model is Activity:
+            for i in ids:
+                yield i, f"activity-{rng.randint(1, 200)}", self.foreign_key(rng, Schedule)
+        elif model is Survey:
+            for i in ids:
+                yield i, f"survey-{i}", f"{rng.randint(1, 5)}.0", [f"tag-{rng.randint(1, 10)}"]
+        elif model is JourneyActivity:
+            for _ in ids:
+                yield self.foreign_key(rng, Journey), self.foreign_key(rng, Activity)
+        elif model is Device:
+            for i in ids:
+                platform = rng.choice(['ios', 'android', 'web'])
+                yield i, platform, f"{rng.randint(8, 17)}.{rng.randint(0, 9)}"
+        elif model is Patient:
+            for i in ids:
+                yield (i, rng.choice(['18-30', '31-50', '51-70', '70+']), rng.choice(['m', 'f']),
+                       f"hospital-{rng.randint(1, 40)}")
+        elif model is PatientJourney:
+            for i in ids:
+                invitation = BASE_DATE + datetime.timedelta(days=rng.randint(0, 1500))
+                dates = [invitation + datetime.timedelta(days=offset) for offset in sorted(rng.sample(range(1, 200), 4))]
+                yield (i, self.foreign_key(rng, Patient), self.foreign_key(rng, Journey), invitation, *dates,
+                       rng.randint(1, 500))
+        elif model is StepResult:
+            # incrementally loaded by date, so dates increase with the rows
+            for i in ids:
+                date = BASE_DATE + datetime.timedelta(days=i * 1500 // count)
+                yield self.foreign_key(rng, Patient), date, str(rng.randint(0, 30_000))
+        elif model is SurveyResult:
+            for i in ids:
+                start = datetime.datetime(2020, 1, 1, tzinfo=datetime.timezone.utc) + datetime.timedelta(
+                    minutes=i * 2_000_000 // count)
+                yield (i, self.foreign_key(rng, PatientJourney), self.foreign_key(rng, Survey),
+                       self.foreign_key(rng, Activity), self.foreign_key(rng, Device), rng.randint(0, 100),
+                       start, start + datetime.timedelta(minutes=rng.randint(1, 30)))
+        else:
+            raise ValueError(f"No synthetic data for {model.__name__}")
+
+    def write_table(self, model, using='msk_db', replace=False) -> int:
+        """
+        COPY the rows of a table into the source database, creating the table if it doesn't exist.
+        A table that already has rows is only overwritten with replace. Returns the number of rows written
+        """
+        connection = connections[using]
+        quote_name = connection.ops.quote_name
+        table = quote_name(model._meta.db_table)
+
+        fields = model._meta.concrete_fields
+        if model._meta.db_table not in connection.introspection.table_names():
+            # plain columns, some of these models declare a primary key the real table doesn't have
+            definition = ', '.join(f"{quote_name(f.column)} {f.db_type(connection)}"
+                                   f"{' PRIMARY KEY' if f.primary_key and f.column == 'id' else ''}" for f in fields)
+            with connection.cursor() as cursor:
+                cursor.execute(f"CREATE TABLE {table} ({definition})")
+        with connection.cursor() as cursor:
+            cursor.execute(f"SELECT EXISTS (SELECT 1 FROM {table})")
+            if cursor.fetchone()[0]:
+                if not replace:
+                    raise ValueError(f"{model._meta.db_table} already has rows, use replace to overwrite it")
+                cursor.execute(f"TRUNCATE {table}")
+
+        columns = ', '.join(quote_name(f.column) for f in fields)
+        buffer = io.StringIO()
+        written = 0
+        with connection.cursor() as cursor:
+            for row in self.rows(model):
+                buffer.write('\t'.join(copy_text_value(f.get_db_prep_save(value, connection))
+                                       for f, value in zip(fields, row)))
+                buffer.write('\n')
+                written += 1
+                if written % COPY_CHUNK_ROWS == 0:
+                    buffer.seek(0)
+                    copy_from(cursor, f"COPY {table} ({columns}) FROM STDIN", buffer)
+                    buffer = io.StringIO()
+            buffer.seek(0)
+            copy_from(cursor, f"COPY {table} ({columns}) FROM STDIN", buffer)
+            cursor.execute(f"ANALYZE {table}")
+        return written
+
+    def write_all(self, using='msk_db', replace=False) -> dict[str, int]:
+        return {model._meta.db_table: self.write_table(model, using, replace) for model in self.counts}
@@ -0,0 +1,87 @@
+import asyncio
+import threading
+
+import pytest
+from django.db import connections
+
+from pipeline.asyncload import async_loadable, prepare_load, load_locked, run_async
+from pipeline.locks import model_lock
+from pipeline.models.analytics import AnalyticsSchedule, AnalyticsScheduleWindow, AnalyticsIncrementalLog
+from pipeline.models.staging import (StagingScheduleModel, StagingStepResultsModel, StagingJourneyActivityModel,
+                                     StagingPatientJourneyModel)
+from pipeline.models.context import LoadContext
+from pipeline.scheduler import dependency_graph
+
+
+def test_async_loadable():
+    """Ensure only set based full and incremental loads run on the event loop."""
+    assert async_loadable(StagingScheduleModel)
+    assert async_loadable(AnalyticsSchedule)
+    # row by row
+    assert not async_loadable(AnalyticsScheduleWindow)
+    # partitioned
+    assert not async_loadable(StagingStepResultsModel)
+    # swapped in
+    assert not async_loadable(StagingJourneyActivityModel)
+    # change data capture
+    assert not async_loadable(StagingPatientJourneyModel)
+
+
+@pytest.mark.django_db
+def test_prepare_load():
+    """Ensure an async load is compiled to SQL with the incremental log applied."""
+    AnalyticsIncrementalLog.objects.create(schedule_id=5)
+
+    load = prepare_load(AnalyticsSchedule)
+
+    assert load.pushdown
+    assert load.insert_sql.startswith('INSERT INTO "schedule"')
+    assert '"staging_schedule"."id" > 5' in load.select_sql
+    assert load.last_loaded.schedule_id == 5
+    assert not load.delete_sql
+    assert prepare_load(AnalyticsScheduleWindow) is None
+
+
+# the lock is tried from the connection of another thread
+@pytest.mark.django_db(transaction=True)
+def test_load_locked_holds_the_model_lock_while_the_load_runs():
+    """Ensure nothing else loads a table while its async load runs on the event loop."""
+    AnalyticsIncrementalLog.objects.create()
+    taken_elsewhere = []
+
+    def try_lock():
+        try:
+            with model_lock(AnalyticsSchedule) as acquired:
+                taken_elsewhere.append(acquired)
+        finally:
+            connections.close_all()
+
+    def run_on_loop(load):
+        thread = threading.Thread(target=try_lock)
+        thread.start()
+        thread.join()
+        return 0
+
+    log = load_locked(AnalyticsSchedule, LoadContext(), run_on_loop, threading.Semaphore(1))
+
+    assert taken_elsewhere == [False]
+    assert log == [('Loaded Values', 'AnalyticsSchedule', 0)]
+    try_lock()
+    assert taken_elsewhere == [False, True]
+
+
+# the event loop has connections of its own, so the test data has to be committed
+@pytest.mark.django_db(transaction=True)
+def test_run_async():
+    """Ensure async loads and the usual ones run in dependency order on the event loop."""
+    pytest.importorskip('psycopg_pool')
+    for schedule_id in range(1, 6):
+        StagingScheduleModel.objects.create(id=schedule_id, slug=f'{schedule_id}w-post-op')
+    pipeline = [AnalyticsSchedule, AnalyticsScheduleWindow]
+
+    log = asyncio.run(run_async(pipeline, dependency_graph(pipeline)))
+
+    assert ('Loaded Values', 'AnalyticsSchedule', 5) in log['AnalyticsSchedule']
+    assert AnalyticsSchedule.objects.count() == 5
+    assert AnalyticsScheduleWindow.objects.count() == 5
+    assert AnalyticsIncrementalLog.objects.get().schedule_id == 5
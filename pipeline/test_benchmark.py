@@ -0,0 +1,59 @@
+from collections import Counter
+
+import pytest
+
+from pipeline.benchmark import compare
+from pipeline.models.core import Schedule, Activity, SurveyResult
+from pipeline.synthetic import SyntheticDataGenerator
+
+
+def test_synthetic_data_is_deterministic():
+    first = list(SyntheticDataGenerator(10_000, seed=1).rows(SurveyResult))
+    again = list(SyntheticDataGenerator(10_000, seed=1).rows(SurveyResult))
+    other_seed = list(SyntheticDataGenerator(10_000, seed=2).rows(SurveyResult))
+
+    assert first == again
+    assert first != other_seed
+    assert len(first) == SyntheticDataGenerator(10_000).counts[SurveyResult]
+
+
+def test_synthetic_data_orphan_rate_and_slugs():
+    """Ensure the orphan rate and the slug distribution follow the parameters."""
+    generator = SyntheticDataGenerator(1_000_000, orphan_rate=0.1, distinct_slugs=20, slug_skew=2.0)
+
+    schedules = generator.counts[Schedule]
+    orphans = sum(schedule_id > schedules for _, _, schedule_id in generator.rows(Activity))
+    assert 0.05 < orphans / generator.counts[Activity] < 0.15
+
+    slugs = Counter(slug for _, slug in generator.rows(Schedule))
+    assert len(slugs) <= 20
+    # with a zipf exponent of 2 the most common slug is more than half of them
+    assert slugs.most_common(1)[0][1] > schedules / 2
+
+    uniform = SyntheticDataGenerator(1_000_000, distinct_slugs=20, slug_skew=0)
+    assert Counter(slug for _, slug in uniform.rows(Schedule)).most_common(1)[0][1] < schedules / 5
+
+
+@pytest.mark.django_db(databases=['default', 'msk_db'])
+def test_synthetic_data_is_written_to_the_source_database():
+    generator = SyntheticDataGenerator(1_000, orphan_rate=0.5)
+
+    assert generator.write_table(SurveyResult) == generator.counts[SurveyResult]
+    assert SurveyResult.objects.count() == generator.counts[SurveyResult]
+    with pytest.raises(ValueError):
+        generator.write_table(SurveyResult)
+    assert generator.write_table(SurveyResult, replace=True) == generator.counts[SurveyResult]
+
+
+def test_compare_with_the_latest_other_commit():
+    def result(commit, seconds, model='AnalyticsSchedule', scale=100):
+        return {'commit': commit, 'scale': scale, 'seed': 0, 'orphan_rate': 0.0, 'distinct_slugs': 50,
+                'slug_skew': 1.0, 'phase': 'initial', 'model': model, 'seconds': seconds}
+
+    history = [result('aaa', 2.0), result('bbb', 3.0), result('bbb', 2.5), result('ccc', 9.0, scale=200)]
+    current = [result('ddd', 1.0), result('ddd', 1.5), result('ddd', 4.0, model='AnalyticsPatient')]
+
+    assert compare(current, history) == [
+        ('initial', 'AnalyticsSchedule', 1.0, 'bbb', 2.5),
+        ('initial', 'AnalyticsPatient', 4.0, None, None),
+    ]
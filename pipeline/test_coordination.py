@@ -0,0 +1,102 @@
+import threading
+
+import pytest
+from django.db import connections
+from django.utils import timezone
+
+from pipeline.coordination import SharedRun
+from pipeline.locks import model_lock
+from pipeline.models.runs import PipelineRun, ModelRun
+from pipeline.scheduler import run_shared
+from pipeline.test_scheduler import make_model
+
+
+def in_thread(target, *args):
+    """Run target on another connection, returns the thread and an event to let target finish"""
+    started, release = threading.Event(), threading.Event()
+
+    def run():
+        try:
+            target(started, release, *args)
+        finally:
+            connections.close_all()
+
+    thread = threading.Thread(target=run)
+    thread.start()
+    started.wait()
+    return thread, release
+
+
+def take_part(started, release, shared_runs):
+    with SharedRun('other:1') as shared_run:
+        shared_runs.append(shared_run)
+        started.set()
+        release.wait()
+
+
+@pytest.mark.django_db(transaction=True)
+def test_instances_join_the_same_shared_run():
+    others = []
+    thread, release = in_thread(take_part, others)
+
+    with SharedRun('this:1') as shared_run:
+        assert shared_run.run.run_id == others[0].run.run_id
+    # the other instance is still in it
+    assert PipelineRun.objects.get().finished is None
+
+    release.set()
+    thread.join()
+    assert PipelineRun.objects.get().finished is not None
+
+
+@pytest.mark.django_db(transaction=True)
+def test_runs_left_behind_are_not_joined():
+    """Ensure a run whose instances all died is finished instead of joined."""
+    left_behind = PipelineRun.objects.create()
+
+    with SharedRun('this:1') as shared_run:
+        assert shared_run.run != left_behind
+
+    left_behind.refresh_from_db()
+    assert left_behind.finished is not None
+
+
+@pytest.mark.django_db(transaction=True)
+def test_run_shared_skips_models_loaded_elsewhere():
+    record = []
+    schedule, activity = make_model('schedule', record), make_model('activity', record)
+
+    with SharedRun('this:1') as shared_run:
+        ModelRun.objects.create(run=shared_run.run, model_name='schedule', instance='other:1',
+                                status=ModelRun.DONE, started=timezone.now())
+        log = run_shared([schedule, activity], {schedule: set(), activity: {schedule}}, 1, None, shared_run)
+
+    assert log == {'activity': 'activity'}
+    assert record == [('start', 'activity'), ('end', 'activity')]
+    assert ModelRun.objects.get(model_name='activity').instance == 'this:1'
+
+
+@pytest.mark.django_db(transaction=True)
+def test_run_shared_waits_for_models_loading_elsewhere():
+    """Ensure models being loaded elsewhere are put aside, and their dependents wait for them."""
+    record = []
+    schedule, journey, activity = (make_model(name, record) for name in ('schedule', 'journey', 'activity'))
+    graph = {schedule: set(), journey: set(), activity: {schedule}}
+
+    with SharedRun('this:1') as shared_run:
+        def load_elsewhere(started, release):
+            with model_lock(schedule):
+                started.set()
+                release.wait()
+                ModelRun.objects.create(run=shared_run.run, model_name='schedule', instance='other:1',
+                                        status=ModelRun.DONE, started=timezone.now(), finished=timezone.now())
+
+        thread, release = in_thread(load_elsewhere)
+        # let the other instance finish once this one has loaded everything it can
+        journey.objects.populate_model.side_effect = lambda context=None: release.set() or 'journey'
+        log = run_shared([schedule, journey, activity], graph, 1, None, shared_run)
+        thread.join()
+
+    assert log == {'journey': 'journey', 'activity': 'activity'}
+    assert ('start', 'schedule') not in record
+    assert ModelRun.objects.get(model_name='schedule').instance == 'other:1'
@@ -0,0 +1,55 @@
+import threading
+from datetime import datetime
+
+import pytest
+
+from pipeline.daemon import CronSchedule, IntervalSchedule, parse_duration, run_forever
+
+
+def test_parse_duration():
+    assert parse_duration('90') == 90
+    assert parse_duration('30s') == 30
+    assert parse_duration('15m') == 900
+    assert parse_duration('1h') == 3600
+    with pytest.raises(ValueError):
+        parse_duration('soon')
+    with pytest.raises(ValueError):
+        parse_duration('0')
+
+
+def test_cron_schedule_next_run():
+    every_quarter = CronSchedule('*/15 * * * *')
+    assert every_quarter.next_run(datetime(2024, 5, 1, 10, 7, 30)) == datetime(2024, 5, 1, 10, 15)
+    assert every_quarter.next_run(datetime(2024, 5, 1, 23, 50)) == datetime(2024, 5, 2, 0, 0)
+
+    # 2024-05-04 is a saturday, weekdays only
+    weekday_mornings = CronSchedule('30 6 * * 1-5')
+    assert weekday_mornings.next_run(datetime(2024, 5, 3, 7, 0)) == datetime(2024, 5, 6, 6, 30)
+
+    # with both day fields restricted either one matches
+    first_or_sunday = CronSchedule('0 0 1 * 0')
+    assert first_or_sunday.next_run(datetime(2024, 5, 1, 12, 0)) == datetime(2024, 5, 5, 0, 0)
+
+    assert CronSchedule('0 12 29 2 *').next_run(datetime(2024, 3, 1)) == datetime(2028, 2, 29, 12, 0)
+
+
+@pytest.mark.parametrize('expression', ['* * * *', '60 * * * *', '*/0 * * * *', '5-1 * * * *', 'a * * * *'])
+def test_cron_schedule_rejects_invalid_expressions(expression):
+    with pytest.raises(ValueError):
+        CronSchedule(expression)
+
+
+def test_run_forever_until_stopped():
+    """Ensure runs carry on after a failure, and stop once the run in progress is done."""
+    stop = threading.Event()
+    calls = []
+
+    def run():
+        calls.append(len(calls))
+        if len(calls) == 2:
+            raise RuntimeError('source unavailable')
+        if len(calls) == 3:
+            stop.set()
+
+    assert run_forever(run, IntervalSchedule(0.01), stop) == 3
+    assert calls == [0, 1, 2]
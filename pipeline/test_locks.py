@@ -0,0 +1,60 @@
+import threading
+
+import pytest
+from django.core.management import call_command
+from django.db import connections
+
+from pipeline.locks import pipeline_lock
+
+
+def hold_elsewhere(test, shared=False):
+    """Run test while another connection holds the pipeline lock"""
+    acquired, release, done = threading.Event(), threading.Event(), threading.Event()
+
+    def hold():
+        try:
+            with pipeline_lock(shared=shared):
+                acquired.set()
+                release.wait()
+        finally:
+            connections.close_all()
+            done.set()
+
+    threading.Thread(target=hold).start()
+    acquired.wait()
+    try:
+        test()
+    finally:
+        release.set()
+        done.wait()
+
+
+# the lock is held on the connection of another thread
+@pytest.mark.django_db(transaction=True)
+def test_pipeline_lock_is_taken_once():
+    def test():
+        with pipeline_lock() as acquired:
+            assert not acquired
+
+    hold_elsewhere(test)
+    with pipeline_lock() as acquired:
+        assert acquired
+
+
+@pytest.mark.django_db(transaction=True)
+def test_run_pipeline_skips_overlapping_runs(capsys):
+    hold_elsewhere(lambda: call_command('run_pipeline'))
+
+    assert 'Another pipeline run is in progress' in capsys.readouterr().err
+
+
+
+@pytest.mark.django_db(transaction=True)
+def test_shared_runs_exclude_exclusive_ones():
+    def test():
+        with pipeline_lock(shared=True) as acquired:
+            assert acquired
+        with pipeline_lock() as acquired:
+            assert not acquired
+
+    hold_elsewhere(test, shared=True)
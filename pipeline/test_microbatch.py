@@ -0,0 +1,48 @@
+import threading
+
+import pytest
+from django.db import connections
+
+from pipeline.locks import model_lock
+from pipeline.microbatch import micro_batch_models, load_micro_batches
+from pipeline.models.analytics import (AnalyticsSchedule, AnalyticsScheduleWindow, AnalyticsActivity,
+                                       AnalyticsSurveyResults, AnalyticsJourneyActivity, AnalyticsIncrementalLog,
+                                       analytics_pipeline)
+from pipeline.models.staging import StagingScheduleModel
+
+
+def test_micro_batch_models_leave_out_models_depending_on_full_loads():
+    models = micro_batch_models(analytics_pipeline)
+
+    assert {AnalyticsSchedule, AnalyticsScheduleWindow, AnalyticsActivity} <= set(models)
+    # full loads, and survey results pointing at patient journeys, which are full loads
+    assert AnalyticsJourneyActivity not in models
+    assert AnalyticsSurveyResults not in models
+    assert models.index(AnalyticsSchedule) < models.index(AnalyticsActivity)
+
+
+@pytest.mark.django_db(transaction=True)
+def test_load_micro_batches_leaves_tables_being_loaded_alone():
+    AnalyticsIncrementalLog.objects.create()
+    StagingScheduleModel.objects.create(id=1, slug='2w-post-op')
+    acquired, release = threading.Event(), threading.Event()
+
+    def load_elsewhere():
+        try:
+            with model_lock(AnalyticsSchedule):
+                acquired.set()
+                release.wait()
+        finally:
+            connections.close_all()
+
+    thread = threading.Thread(target=load_elsewhere)
+    thread.start()
+    acquired.wait()
+    try:
+        assert load_micro_batches([AnalyticsSchedule]) == {}
+    finally:
+        release.set()
+        thread.join()
+
+    assert load_micro_batches([AnalyticsSchedule]) == {'AnalyticsSchedule': 1}
+    assert AnalyticsSchedule.objects.get().slug == '2w-post-op'
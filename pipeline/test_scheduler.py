@@ -0,0 +1,84 @@
+import time
+from unittest.mock import MagicMock
+
+import pytest
+
+from pipeline.models.analytics import (AnalyticsSchedule, AnalyticsScheduleWindow, AnalyticsActivity,
+                                       AnalyticsJourneyActivity, AnalyticsJourney, AnalyticsPatient,
+                                       AnalyticsPatientJourney, AnalyticsPatientJourneyScheduleWindow,
+                                       analytics_pipeline)
+from pipeline.models.staging import staging_pipeline
+from pipeline.scheduler import dependency_graph, topological_order, run_parallel
+
+
+def make_model(name, record, delay=0.0, error=None):
+    """A stand in for a model whose loader records when it ran"""
+    model = MagicMock(__name__=name)
+
+    def populate_model(context=None):
+        record.append(('start', name))
+        time.sleep(delay)
+        if error:
+            raise error
+        record.append(('end', name))
+        return name
+
+    model.objects.populate_model.side_effect = populate_model
+    return model
+
+
+def test_dependency_graph_from_foreign_keys():
+    """Ensure dependencies come from foreign keys and declared depends_on."""
+    graph = dependency_graph(analytics_pipeline)
+
+    assert graph[AnalyticsSchedule] == set()
+    assert graph[AnalyticsScheduleWindow] == {AnalyticsSchedule}
+    assert graph[AnalyticsActivity] == {AnalyticsSchedule}
+    assert graph[AnalyticsJourneyActivity] == {AnalyticsJourney, AnalyticsActivity}
+    assert {AnalyticsPatient, AnalyticsPatientJourney, AnalyticsJourneyActivity,
+            AnalyticsScheduleWindow} <= graph[AnalyticsPatientJourneyScheduleWindow]
+
+
+def test_staging_models_are_independent():
+    assert all(not deps for deps in dependency_graph(staging_pipeline).values())
+
+
+def test_topological_order_keeps_declared_order():
+    graph = dependency_graph(analytics_pipeline)
+    assert topological_order(analytics_pipeline, graph) == analytics_pipeline
+
+
+def test_topological_order_rejects_cycles():
+    a, b = MagicMock(__name__='A'), MagicMock(__name__='B')
+    with pytest.raises(ValueError):
+        topological_order([a, b], {a: {b}, b: {a}})
+
+
+# loads take their model's lock on the connection of their worker thread
+@pytest.mark.django_db(transaction=True)
+def test_run_parallel_respects_dependencies():
+    """Ensure a model only starts once its dependencies have finished."""
+    record = []
+    schedule, journey, activity = (make_model(name, record, delay=0.05) for name in ('schedule', 'journey', 'activity'))
+    pipeline = [schedule, journey, activity]
+    graph = {schedule: set(), journey: set(), activity: {schedule}}
+
+    result = run_parallel(pipeline, graph, workers=3)
+
+    assert result == {'schedule': 'schedule', 'journey': 'journey', 'activity': 'activity'}
+    assert record.index(('end', 'schedule')) < record.index(('start', 'activity'))
+    # independent models overlap
+    assert record.index(('start', 'journey')) < record.index(('end', 'schedule'))
+
+
+@pytest.mark.django_db(transaction=True)
+def test_run_parallel_stops_after_failure():
+    """Ensure nothing depending on a failed model is loaded."""
+    record = []
+    schedule = make_model('schedule', record, error=RuntimeError('boom'))
+    activity = make_model('activity', record)
+
+    result = run_parallel([schedule, activity], {schedule: set(), activity: {schedule}}, workers=2)
+
+    assert result == {}
+    activity.objects.populate_model.assert_not_called()